@@ -0,0 +1,317 @@
+import faiss
+import numpy as np
+from typing import List, Optional
+import logging
+import math
+import time
+logger = logging.getLogger(__name__)
+
+# 支持的索引类型；sq_fp16 / sq8 为精确检索的压缩版本，每维分别占 2 字节 / 1 字节
+INDEX_TYPES = ('flat', 'sq_fp16', 'sq8', 'ivf_flat', 'hnsw', 'ivf_pq', 'opq_ivf_pq')
+# 需要先在样本上训练才能写入的索引类型
+TRAINED_INDEX_TYPES = ('sq8', 'ivf_flat', 'ivf_pq', 'opq_ivf_pq')
+# 降维方式：pca 在样本上训练投影矩阵；matryoshka 直接截取前 reduce_dim 维（适用于 Matryoshka 训练的嵌入模型）
+REDUCE_MODES = ('pca', 'matryoshka')
+# 相似度度量：l2 为欧氏距离（越小越相似），cosine 为归一化向量上的内积（越大越相似）
+METRICS = {'l2': faiss.METRIC_L2, 'cosine': faiss.METRIC_INNER_PRODUCT}
+
+DEFAULT_INDEX_PARAMS = {
+    'nlist': None,          # IVF 聚类中心数，None 表示按 4*sqrt(N) 自动选择
+    'hnsw_m': 32,           # HNSW 每个节点的邻居数
+    'ef_construction': 200, # HNSW 建图时的候选集大小
+    'pq_m': 64,             # PQ 子空间数（需整除维度）
+    'pq_nbits': 8,          # 每个子空间的编码位数
+    'nprobe': 16,           # IVF 搜索时访问的聚类数
+    'ef_search': 64,        # HNSW 搜索时的候选集大小
+    'train_size': 20000,    # 累积到这么多向量后才训练
+    'max_train_sample': 200000,
+    'reduce': None,         # 降维方式：None / pca / matryoshka
+    'reduce_dim': 256       # 降维后的维度
+}
+
+
+def resolve_index_params(index_type: str, index_params: Optional[dict] = None) -> dict:
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown index type: {index_type}, expected one of {INDEX_TYPES}")
+    params = dict(DEFAULT_INDEX_PARAMS)
+    params.update(index_params or {})
+    if params['reduce'] is not None and params['reduce'] not in REDUCE_MODES:
+        raise ValueError(f"Unknown reduce mode: {params['reduce']}, expected one of {REDUCE_MODES}")
+    return params
+
+
+def requires_training(index_type: str, params: dict) -> bool:
+    """索引类型本身需要训练，或使用了 PCA 降维"""
+    return index_type in TRAINED_INDEX_TYPES or params.get('reduce') == 'pca'
+
+
+def min_train_vectors(index_type: str, params: dict) -> int:
+    """训练所需的最少向量数：PQ 每个子空间要聚出 2**pq_nbits 个码字，PCA 至少要 reduce_dim 个样本"""
+    if not requires_training(index_type, params):
+        return 0
+    minimum = 1
+    if index_type in ('ivf_pq', 'opq_ivf_pq'):
+        minimum = max(minimum, 2 ** params['pq_nbits'])
+    if params.get('reduce') == 'pca':
+        minimum = max(minimum, params['reduce_dim'])
+    return minimum
+
+
+def validate_index_params(index_type: str, params: dict, dimension: int):
+    """在创建系统时检查索引参数，而不是等到累积够向量、保存时训练才失败
+
+    IVF 的聚类中心数由 choose_nlist 按训练样本数自动收紧，这里不检查。
+
+    Raises:
+        ValueError: 参数与维度不匹配，或 train_size / max_train_sample 不足以训练该索引
+    """
+    if params.get('reduce') is not None and not 0 < params['reduce_dim'] <= dimension:
+        raise ValueError(f"reduce_dim must be between 1 and the embedding dimension {dimension}, "
+                         f"got {params['reduce_dim']}")
+    if index_type in ('ivf_pq', 'opq_ivf_pq'):
+        code_dim = params['reduce_dim'] if params.get('reduce') is not None else dimension
+        if code_dim % params['pq_m'] != 0:
+            raise ValueError(f"pq_m={params['pq_m']} must divide the indexed dimension {code_dim}")
+    minimum = min_train_vectors(index_type, params)
+    for key in ('train_size', 'max_train_sample'):
+        if params[key] < minimum:
+            raise ValueError(f"{index_type} index needs at least {minimum} training vectors "
+                             f"(pq_nbits={params['pq_nbits']}, reduce={params['reduce']}), "
+                             f"but {key}={params[key]}")
+
+
+def choose_nlist(ntrain: int, nlist: Optional[int] = None) -> int:
+    """选择聚类中心数：默认 4*sqrt(N)，且保证每个中心至少有 39 个训练样本"""
+    if nlist is None:
+        nlist = int(4 * math.sqrt(ntrain))
+    return max(1, min(nlist, ntrain // 39))
+
+
+def factory_string(index_type: str, params: dict, nlist: int = 1) -> str:
+    if index_type == 'flat':
+        return "Flat"
+    if index_type == 'sq_fp16':
+        return "SQfp16"
+    if index_type == 'sq8':
+        return "SQ8"
+    if index_type == 'ivf_flat':
+        return f"IVF{nlist},Flat"
+    if index_type == 'hnsw':
+        return f"HNSW{params['hnsw_m']}"
+    if index_type == 'ivf_pq':
+        return f"IVF{nlist},PQ{params['pq_m']}x{params['pq_nbits']}"
+    if index_type == 'opq_ivf_pq':
+        return f"OPQ{params['pq_m']},IVF{nlist},PQ{params['pq_m']}x{params['pq_nbits']}"
+    raise ValueError(f"Unknown index type: {index_type}")
+
+
+def faiss_metric(metric: str) -> int:
+    if metric not in METRICS:
+        raise ValueError(f"Unknown metric: {metric}, expected one of {tuple(METRICS)}")
+    return METRICS[metric]
+
+
+def create_flat_index(dimension: int, metric: str = 'l2') -> faiss.Index:
+    if metric == 'cosine':
+        return faiss.IndexFlatIP(dimension)
+    return faiss.IndexFlatL2(dimension)
+
+
+def create_index(index_type: str, dimension: int, params: dict,
+                 train_vectors: Optional[np.ndarray] = None, metric: str = 'l2') -> faiss.Index:
+    """创建一个空的、可直接写入的索引
+
+    需要训练的类型必须提供 train_vectors，训练后返回的索引不包含任何向量。
+    cosine 度量下调用方负责先对向量做 L2 归一化；降维后会在索引内部重新归一化。
+    """
+    nlist = 1
+    if requires_training(index_type, params):
+        if train_vectors is None:
+            raise ValueError(f"Index type {index_type} requires training vectors")
+        nlist = choose_nlist(len(train_vectors), params.get('nlist'))
+    description = factory_string(index_type, params, nlist)
+    reduce, reduce_dim = params.get('reduce'), params.get('reduce_dim')
+    transforms = []
+    if reduce == 'pca':
+        description = f"PCA{reduce_dim}," + ("L2norm," if metric == 'cosine' else "") + description
+    elif reduce == 'matryoshka':
+        transforms.append(faiss.RemapDimensionsTransform(dimension, reduce_dim, False))
+        if metric == 'cosine':
+            transforms.append(faiss.NormalizationTransform(reduce_dim))
+    inner = faiss.index_factory(reduce_dim if transforms else dimension, description, faiss_metric(metric))
+    if index_type == 'hnsw':
+        _base_index(inner).hnsw.efConstruction = params['ef_construction']
+    index = inner
+    if transforms:
+        index = faiss.IndexPreTransform(transforms[0], inner)
+        for transform in transforms[1:]:
+            index.chain.push_back(transform)
+    if not index.is_trained:
+        start = time.time()
+        index.train(np.ascontiguousarray(train_vectors, dtype=np.float32))
+        logger.info(f"Trained {index_type} index (nlist={nlist}) on {len(train_vectors)} vectors "
+                    f"in {time.time() - start:.2f}s")
+    if transforms:
+        # 序列化再读回，让 C++ 对象拥有各个变换，不依赖这里的 Python 引用
+        index = faiss.deserialize_index(faiss.serialize_index(index))
+    set_search_params(index, params.get('nprobe'), params.get('ef_search'))
+    return index
+
+
+def copy_index(index: faiss.Index) -> faiss.Index:
+    """复制索引；部分向量变换（截取维度、归一化、PCA）不支持 clone_index，改用序列化复制"""
+    try:
+        return faiss.clone_index(index)
+    except RuntimeError:
+        return faiss.deserialize_index(faiss.serialize_index(index))
+
+
+def _base_index(index: faiss.Index) -> faiss.Index:
+    return faiss.downcast_index(index.index) if isinstance(index, faiss.IndexPreTransform) else index
+
+
+def set_search_params(index: faiss.Index, nprobe: Optional[int] = None, ef_search: Optional[int] = None):
+    """设置搜索参数；不适用于该索引类型的参数会被忽略"""
+    if nprobe is not None:
+        try:
+            faiss.extract_index_ivf(index).nprobe = nprobe
+        except RuntimeError:
+            pass
+    if ef_search is not None:
+        base = _base_index(index)
+        if hasattr(base, 'hnsw'):
+            base.hnsw.efSearch = ef_search
+
+
+def enable_reconstruct(index: faiss.Index):
+    """IVF 类索引建立编号到倒排表位置的映射，之后才能按编号取回向量；其他类型不需要
+
+    映射在分段发布之前由写入方建立，发布后的分段只读，取回向量不必加锁。
+    """
+    try:
+        ivf = faiss.extract_index_ivf(index)
+    except RuntimeError:
+        return
+    if ivf.direct_map.type == faiss.DirectMap.NoMap:
+        ivf.make_direct_map()
+
+
+def exclude_ids(ids: np.ndarray) -> faiss.IDSelector:
+    """排除给定编号（分段内编号）的 ID 过滤器"""
+    batch = faiss.IDSelectorBatch(np.ascontiguousarray(ids, dtype=np.int64))
+    selector = faiss.IDSelectorNot(batch)
+    selector.referenced_objects = [batch]
+    return selector
+
+
+def search_parameters(index: faiss.Index, selector: faiss.IDSelector) -> faiss.SearchParameters:
+    """带 ID 过滤器的搜索参数，被排除的向量在索引内部跳过，不占用 k 个结果的名额
+
+    传入参数后 faiss 不再读取索引上的 nprobe / efSearch，这里沿用索引当前的设置。
+    """
+    base = _base_index(index)
+    try:
+        params = faiss.SearchParametersIVF(sel=selector, nprobe=faiss.extract_index_ivf(index).nprobe)
+    except RuntimeError:
+        if hasattr(base, 'hnsw'):
+            params = faiss.SearchParametersHNSW(sel=selector, efSearch=base.hnsw.efSearch)
+        else:
+            params = faiss.SearchParameters(sel=selector)
+    if isinstance(index, faiss.IndexPreTransform):
+        inner = params
+        params = faiss.SearchParametersPreTransform(index_params=inner)
+        params.referenced_objects = [inner, selector]
+    return params
+
+
+def reconstruct_all(index: faiss.Index) -> np.ndarray:
+    """取出索引中全部向量（PQ 类索引得到的是近似值）"""
+    if index.ntotal == 0:
+        return np.zeros((0, index.d), dtype=np.float32)
+    try:
+        return index.reconstruct_n(0, index.ntotal)
+    except RuntimeError:
+        faiss.extract_index_ivf(index).make_direct_map()
+        return index.reconstruct_n(0, index.ntotal)
+
+
+def index_memory_bytes(index: faiss.Index) -> int:
+    """通过序列化大小估算索引占用的内存"""
+    return int(faiss.serialize_index(index).size)
+
+
+def evaluate_index_modes(base: np.ndarray, queries: np.ndarray, configs: List[dict],
+                         k: int = 10, metric: str = 'l2') -> List[dict]:
+    """对比各索引配置相对精确检索（Flat）的召回率与延迟
+
+    Args:
+        base: 语料向量
+        queries: 查询向量
+        configs: 每项形如 {'index_type': 'ivf_flat', 'nprobe': [1, 4, 16]}，
+            nprobe / ef_search 可给出列表以扫描多个工作点，其余键作为索引参数
+        k: 召回率按 recall@k 计算
+        metric: l2 或 cosine（cosine 时会先归一化语料和查询）
+    Returns:
+        每个 (配置, 搜索参数) 一行的报告
+    """
+    base = np.array(base, dtype=np.float32)
+    queries = np.array(queries, dtype=np.float32)
+    if metric == 'cosine':
+        faiss.normalize_L2(base)
+        faiss.normalize_L2(queries)
+    dimension = base.shape[1]
+
+    flat = create_flat_index(dimension, metric)
+    flat.add(base)
+    start = time.perf_counter()
+    _, truth = flat.search(queries, k)
+    flat_ms = (time.perf_counter() - start) * 1000 / len(queries)
+
+    report = [{
+        'index_type': 'flat', 'recall': 1.0, 'latency_ms': flat_ms,
+        'memory_bytes': index_memory_bytes(flat), 'bytes_per_vector': index_memory_bytes(flat) / max(len(base), 1),
+        'build_seconds': 0.0
+    }]
+    for config in configs:
+        config = dict(config)
+        index_type = config.pop('index_type')
+        nprobes = config.pop('nprobe', [None])
+        ef_searches = config.pop('ef_search', [None])
+        nprobes = nprobes if isinstance(nprobes, (list, tuple)) else [nprobes]
+        ef_searches = ef_searches if isinstance(ef_searches, (list, tuple)) else [ef_searches]
+        params = resolve_index_params(index_type, config)
+        validate_index_params(index_type, params, dimension)
+
+        build_start = time.time()
+        sample = base[np.random.default_rng(0).permutation(len(base))[:params['max_train_sample']]]
+        index = create_index(index_type, dimension, params, train_vectors=sample, metric=metric)
+        index.add(base)
+        build_seconds = time.time() - build_start
+        memory = index_memory_bytes(index)
+        bytes_per_vector = memory / max(len(base), 1)
+
+        for nprobe in nprobes:
+            for ef_search in ef_searches:
+                set_search_params(index, nprobe, ef_search)
+                start = time.perf_counter()
+                _, found = index.search(queries, k)
+                latency_ms = (time.perf_counter() - start) * 1000 / len(queries)
+                hits = sum(len(set(f[f >= 0]) & set(t[t >= 0])) for f, t in zip(found, truth))
+                row = {
+                    'index_type': index_type,
+                    'recall': hits / float(truth.size),
+                    'latency_ms': latency_ms,
+                    'memory_bytes': memory,
+                    'bytes_per_vector': bytes_per_vector,
+                    'build_seconds': build_seconds
+                }
+                if params['reduce'] is not None:
+                    row['reduce'] = params['reduce']
+                    row['reduce_dim'] = params['reduce_dim']
+                if nprobe is not None:
+                    row['nprobe'] = nprobe
+                if ef_search is not None:
+                    row['ef_search'] = ef_search
+                report.append(row)
+                logger.info(f"{row}")
+    return report
@@ -1,12 +1,18 @@
 from flask import Flask, request, jsonify, Response
-from openai import OpenAI
-import json
 import os
 
 from typing import List
 import logging
 import time
 from rag import SecurityRAGSystem
+from pdf_extract import create_extractor
+from result_cache import ResultCache
+from context_packer import ContextPacker, format_context
+from ingest_worker import IngestWorker
+from metrics import render_prometheus, stage_metrics
+from query_batcher import QueryBatcher
+from reranker import OnnxCrossEncoder, Reranker
+from sse_relay import RelayError, SSERelay
 # 配置日志
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -14,42 +20,144 @@ logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 rag_system = None
-client = None
+query_batcher = None
+context_packer = None
+reranker = None
+ingest_worker = None
+llm_relay = None
+INDEX_STORE_DIR = "index_store"
+PAPERS_DIR = "security_papers"
+# 解析PDF的进程数，None 表示使用全部CPU核
+INGEST_WORKERS = None
+# 后台导入线程扫描论文目录的间隔（秒）
+INGEST_POLL_INTERVAL = 5.0
+# 索引类型：flat / sq_fp16 / sq8 / ivf_flat / hnsw / ivf_pq / opq_ivf_pq，语料较大时可用
+# python -m benchmarks.bench_index --store index_store 选择合适的类型和 nprobe / ef_search；
+# 压缩存储（量化、reduce 降维）的内存与召回率对比加 --preset compression
+INDEX_TYPE = "flat"
+INDEX_PARAMS = {}
+# 余弦相似度检索：向量归一化后用内积索引，阈值为相似度下限，可在不同查询和语料间比较
+METRIC = "cosine"
+RETRIEVAL_THRESHOLD = 0.6
+# 导入时的近重复检测：与已入库分块的 Jaccard 相似度不低于该值的段落不再向量化，None 表示不去重
+DEDUP_THRESHOLD = 0.85
+RETRIEVAL_TOPK = 5
+# 上下文组装：先召回 CONTEXT_CANDIDATES 个候选，用 MMR 挑选彼此不重复的分块装入 CONTEXT_MAX_TOKENS 的预算，
+# 同一篇论文中相邻的分块合并；提示词长度有上限，首 token 延迟更稳定。None 表示直接使用前 RETRIEVAL_TOPK 个结果
+CONTEXT_MAX_TOKENS = 1500
+CONTEXT_CANDIDATES = 20
+# MMR 中相关性的权重，越小越偏向多样性
+CONTEXT_MMR_LAMBDA = 0.7
+# 两阶段检索：召回 RERANK_CANDIDATES 个候选，用本地 CPU cross-encoder 重新打分后保留 RERANK_TOPK 个；
+# 超出 RERANK_BUDGET（秒）时退回第一阶段的顺序。RERANK_MODEL_DIR 为 None 表示不重排
+RERANK_MODEL_DIR = None
+RERANK_QUANTIZED = False
+RERANK_CANDIDATES = 50
+RERANK_TOPK = 8
+RERANK_BUDGET = 0.2
+RERANK_BATCH_SIZE = 16
+# 检索模式：dense / lexical / hybrid，hybrid 融合向量检索和 BM25，对 CVE 编号、攻击名称等精确词更可靠
+RETRIEVAL_MODE = "hybrid"
+# 查询向量化的超时（秒），嵌入服务慢或不可用时退化为纯 BM25 检索
+QUERY_EMBED_TIMEOUT = 2.0
+# 检索结果缓存：重复的查询（重试、重新生成、常见问题）不再计算向量和搜索索引，索引变化时自动失效
+RESULT_CACHE_SIZE = 1024
+RESULT_CACHE_TTL = 300.0
+# 语义层：与已缓存查询的向量余弦相似度不低于该值时复用结果，None 表示只做精确匹配
+RESULT_CACHE_SIMILARITY = None
+# 嵌入后端：http（远程 /v1/embeddings 接口）或 onnx（本地 CPU 推理，见 local_embedding.py，可离线部署）
+EMBED_BACKEND = "http"
+LOCAL_EMBED_MODEL_DIR = "models/bge-large-en-v1.5"
+# 与远程模型相同时可以共用已有索引；int8 量化模型的向量略有差异，建议使用单独的名字
+LOCAL_EMBED_MODEL = "BAAI/bge-large-en-v1.5"
+LOCAL_EMBED_QUANTIZED = False
+LOCAL_EMBED_THREADS = None
+LOCAL_EMBED_MAX_LENGTH = 512
+# PDF文本提取后端：pypdf2 或 pdfium（需要 pypdfium2，快得多），
+# 用 python -m benchmarks.bench_extract --papers-dir security_papers 对比速度和段落质量
+PDF_EXTRACTOR = "pypdf2"
+LLM_BASE_URL = 'http://localhost:11435/v1'
+LLM_MODEL = "Qwen/Qwen2.5-7B-Instruct"
+# 流式转发时合并相邻 token 的时间窗口（秒），0 表示每个片段立即转发
+STREAM_FLUSH_INTERVAL = 0.02
 
-def init_services():
-    """初始化RAG系统和OpenAI客户端"""
-    global rag_system, client
+def create_embedder():
+    """按 EMBED_BACKEND 创建嵌入后端，http 时返回 None（由 SecurityRAGSystem 创建远程客户端）"""
+    if EMBED_BACKEND == "http":
+        return None
+    if EMBED_BACKEND == "onnx":
+        from local_embedding import OnnxEmbeddingClient
+        return OnnxEmbeddingClient(LOCAL_EMBED_MODEL_DIR, model=LOCAL_EMBED_MODEL, threads=LOCAL_EMBED_THREADS,
+                                   max_length=LOCAL_EMBED_MAX_LENGTH, quantized=LOCAL_EMBED_QUANTIZED)
+    raise ValueError(f"Unknown embedding backend: {EMBED_BACKEND}")
+
+def create_rag_system() -> SecurityRAGSystem:
+    """创建RAG系统：从磁盘索引热启动，论文目录的同步交给后台导入线程"""
     api_key = "your_api_key"
     if not api_key:
         raise ValueError("API key is required")
-    # 初始化RAG系统
-    rag_system = SecurityRAGSystem(api_key)
-    papers_dir = "security_papers"
-    if not os.path.exists(papers_dir):
-        os.makedirs(papers_dir)
-        logger.info(f"Created directory: {papers_dir}")
-    else:
-        for file in os.listdir(papers_dir):
-            if file.endswith('.pdf'):
-                pdf_path = os.path.join(papers_dir, file)
-                logger.info(f"Processing: {file}")
-                rag_system.add_documents(pdf_path)
+    rag = SecurityRAGSystem(api_key, store_dir=INDEX_STORE_DIR,
+                            index_type=INDEX_TYPE, index_params=INDEX_PARAMS, metric=METRIC,
+                            dedup_threshold=DEDUP_THRESHOLD, embedder=create_embedder(),
+                            extractor=create_extractor(PDF_EXTRACTOR))
+    rag.embed_timeout = QUERY_EMBED_TIMEOUT
+    if RESULT_CACHE_SIZE > 0:
+        rag.result_cache = ResultCache(RESULT_CACHE_SIZE, ttl=RESULT_CACHE_TTL, similarity=RESULT_CACHE_SIMILARITY)
+    if not os.path.exists(PAPERS_DIR):
+        os.makedirs(PAPERS_DIR)
+        logger.info(f"Created directory: {PAPERS_DIR}")
+    return rag
+
+def retrieval_topk() -> int:
+    """检索的结果数：启用重排或上下文组装时超量召回候选"""
+    if RERANK_MODEL_DIR:
+        return RERANK_CANDIDATES
+    return CONTEXT_CANDIDATES if CONTEXT_MAX_TOKENS else RETRIEVAL_TOPK
+
+def create_reranker():
+    """RERANK_MODEL_DIR 为 None 时返回 None"""
+    if not RERANK_MODEL_DIR:
+        return None
+    return Reranker(OnnxCrossEncoder(RERANK_MODEL_DIR, quantized=RERANK_QUANTIZED),
+                    batch_size=RERANK_BATCH_SIZE, budget=RERANK_BUDGET)
+
+def rerank_results(reranker, query: str, results: List[dict]) -> List[dict]:
+    """第二阶段重排，未启用时原样返回"""
+    if reranker is None:
+        return results
+    with stage_metrics.time('rerank'):
+        return reranker.rerank(query, results, RERANK_TOPK)
+
+def create_context_packer(rag: SecurityRAGSystem):
+    """CONTEXT_MAX_TOKENS 为 None 时返回 None"""
+    if not CONTEXT_MAX_TOKENS:
+        return None
+    return ContextPacker(rag, max_tokens=CONTEXT_MAX_TOKENS, mmr_lambda=CONTEXT_MMR_LAMBDA)
+
+def select_context(packer, results: List[dict]) -> List[dict]:
+    """从检索结果中挑选放入提示词的段落"""
+    if packer is None:
+        return results
+    with stage_metrics.time('pack_context'):
+        return packer.pack(results)
+
+def start_ingest_worker(rag: SecurityRAGSystem) -> IngestWorker:
+    """启动后台导入线程：服务立即可用，新增、修改和删除的论文在后台同步到索引"""
+    return IngestWorker(rag, PAPERS_DIR, poll_interval=INGEST_POLL_INTERVAL, workers=INGEST_WORKERS).start()
+
+def init_services():
+    """初始化RAG系统和上游 LLM 的流式转发"""
+    global rag_system, query_batcher, context_packer, reranker, ingest_worker, llm_relay
+    rag_system = create_rag_system()
+    ingest_worker = start_ingest_worker(rag_system)
+    # 并发请求的检索在短时间窗口内合并成一次批量检索
+    query_batcher = QueryBatcher(rag_system)
+    context_packer = create_context_packer(rag_system)
+    reranker = create_reranker()
     
-    # 初始化OpenAI客户端
-    client = OpenAI(
-        base_url='http://localhost:11435/v1',  # 使用本地服务器
-        api_key="dummy"  # 本地测试使用dummy token
-    )
+    # 上游 LLM 的流式响应按字节转发，连接在请求之间复用
+    llm_relay = SSERelay(LLM_BASE_URL, "dummy", flush_interval=STREAM_FLUSH_INTERVAL)
     logger.info("Services initialized successfully")
-def format_context(results: List[dict]) -> str:
-    """格式化检索结果"""
-    context = ""
-    for result in results:
-        context += f"[Paper: {result['title']}\n"
-        context += f"File: {result['file_name']}, Page: {result['page']}\n"
-        context += f"Content: {result['text']}\n\n"
-    return context
-
 SYSTEM_PROMPT = """你是一个AI安全专家，请基于以下论文内容回答问题：
 
 {context}
@@ -62,9 +170,80 @@ SYSTEM_PROMPT = """你是一个AI安全专家，请基于以下论文内容回
 
 用户问题：{query}"""
 
+def build_messages(messages: List[dict], results: List[dict]) -> List[dict]:
+    """在消息列表开头插入带检索上下文的系统提示词"""
+    last_message = messages[-1].get('content', '')
+    system_message = {
+        "role": "system",
+        "content": SYSTEM_PROMPT.format(context=format_context(results), query=last_message)
+    }
+    return [system_message] + messages
+
+def mock_chat_completion() -> dict:
+    """非流式请求的模拟响应"""
+    return {
+        "id": "chatcmpl-123",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": LLM_MODEL,
+        "choices": [
+            {
+                "index": 0,
+                "message": {
+                    "role": "assistant",
+                    "content": "这是一个模拟的响应，用于测试API是否正常工作。实际部署时请删除这个模拟响应。"
+                },
+                "finish_reason": "stop"
+            }
+        ]
+    }
+
+def error_body(message: str, error_type: str, code: int) -> dict:
+    return {
+        "error": {
+            "message": message,
+            "type": error_type,
+            "code": code
+        }
+    }
+
+TAGS = {
+    "tags": ["ai-security", "chinese", "english"]
+}
+
+VERSION_INFO = {
+    "version": "1.0.0",
+    "build_date": "2024-03-27",
+    "model_version": "Qwen2.5-72B-Instruct"
+}
+
+def resolve_upload_path(path: str) -> str:
+    """上传接口只接受论文目录中的PDF文件名或路径"""
+    path = os.path.join(PAPERS_DIR, os.path.basename(path))
+    if not path.endswith('.pdf'):
+        raise ValueError(f"Not a PDF file: {path}")
+    return path
+
+def model_list() -> dict:
+    return {
+        "object": "list",
+        "data": [
+            {
+                "id": LLM_MODEL,
+                "object": "model",
+                "created": int(time.time()),
+                "owned_by": "Qwen",
+                "permission": [],
+                "root": LLM_MODEL,
+                "parent": None
+            }
+        ]
+    }
+
 @app.route('/v1/chat/completions', methods=['POST'])
 def openai_chat_completion():
     try:
+        request_start = time.perf_counter()
         data = request.json
         messages = data['messages']
         stream = data.get('stream', False)
@@ -73,115 +252,88 @@ def openai_chat_completion():
         last_message = messages[-1].get('content', '')
         
         # 使用RAG系统检索相关内容
-        results = rag_system.retrieval(last_message, threshold=0.4, topk=5)
-        context = format_context(results)
-        
-        # 构建系统提示词
-        system_message = {
-            "role": "system",
-            "content": SYSTEM_PROMPT.format(context=context, query=last_message)
-        }
-        
+        with stage_metrics.time('retrieval'):
+            results = query_batcher.retrieval(last_message, threshold=RETRIEVAL_THRESHOLD, topk=retrieval_topk(),
+                                              mode=RETRIEVAL_MODE)
+        results = rerank_results(reranker, last_message, results)
+        results = select_context(context_packer, results)
         # 在消息列表开头插入系统提示词
-        messages = [system_message] + messages
-        logger.info(f"Messages: {messages}")
+        with stage_metrics.time('build_messages'):
+            messages = build_messages(messages, results)
 
         if stream:
-            response = client.chat.completions.create(
-                model="Qwen/Qwen2.5-7B-Instruct",
-                messages=messages,
-                stream=True
+            llm_start = time.perf_counter()
+            upstream = llm_relay.open(
+                {"model": LLM_MODEL, "messages": messages},
+                # 从收到请求到转发第一个流式片段的时间
+                on_first_chunk=lambda: stage_metrics.observe('time_to_first_token',
+                                                             time.perf_counter() - request_start),
+                on_complete=lambda: stage_metrics.observe('llm_stream', time.perf_counter() - llm_start)
             )
-            
-            def generate():
-                for chunk in response:
-                    yield f"data: {json.dumps(chunk.model_dump())}\n\n"
-                yield "data: [DONE]\n\n"
-            
-            return Response(generate(), mimetype='text/event-stream')
+            # 客户端断开时服务器关闭响应，upstream.close() 随即断开上游连接
+            return Response(upstream, mimetype='text/event-stream')
         else:
             # 模拟响应
-            mock_response = {
-                "id": "chatcmpl-123",
-                "object": "chat.completion",
-                "created": int(time.time()),
-                "model": "Qwen/Qwen2.5-7B-Instruct",
-                "choices": [
-                    {
-                        "index": 0,
-                        "message": {
-                            "role": "assistant",
-                            "content": "这是一个模拟的响应，用于测试API是否正常工作。实际部署时请删除这个模拟响应。"
-                        },
-                        "finish_reason": "stop"
-                    }
-                ]
-            }
-            return jsonify(mock_response)
+            return jsonify(mock_chat_completion())
             
+    except RelayError as e:
+        return jsonify(error_body(str(e), "upstream_error", 502)), 502
+    except TimeoutError as e:
+        logger.error(f"Error in chat completion: {e}")
+        return jsonify(error_body(str(e), "server_error", 503)), 503
     except Exception as e:
         logger.error(f"Error in chat completion: {e}")
-        return jsonify({
-            "error": {
-                "message": str(e),
-                "type": "server_error",
-                "code": 500
-            }
-        }), 500
+        return jsonify(error_body(str(e), "server_error", 500)), 500
+
+@app.route('/v1/ingest', methods=['POST'])
+def submit_ingest():
+    """上传PDF（multipart 的 file 字段），或以 {"paths": [...]} 提交论文目录中已有的文件"""
+    try:
+        paths = []
+        for upload in request.files.getlist('file'):
+            path = resolve_upload_path(upload.filename)
+            upload.save(path)
+            paths.append(path)
+        if request.is_json:
+            paths.extend(resolve_upload_path(path) for path in request.json.get('paths', []))
+        for path in paths:
+            ingest_worker.submit(path)
+        return jsonify({"submitted": paths, "status": ingest_worker.status()}), 202
+    except ValueError as e:
+        return jsonify(error_body(str(e), "invalid_request_error", 400)), 400
+
+@app.route('/v1/ingest/status', methods=['GET'])
+def ingest_status():
+    """后台导入进度"""
+    return jsonify(ingest_worker.status())
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Prometheus 格式的阶段耗时直方图、索引规模、缓存命中率、嵌入接口和流式转发的计数"""
+    return Response(render_prometheus(rag_system, query_batcher, llm_relay=llm_relay, reranker=reranker), mimetype='text/plain; version=0.0.4')
 
 @app.route('/api/tags', methods=['GET'])
 def get_tags():
     """获取标签列表"""
-    return jsonify({
-        "tags": ["ai-security", "chinese", "english"]
-    })
+    return jsonify(TAGS)
 
 @app.route('/api/version', methods=['GET'])
 def get_version():
     """获取API版本信息"""
-    return jsonify({
-        "version": "1.0.0",
-        "build_date": "2024-03-27",
-        "model_version": "Qwen2.5-72B-Instruct"
-    })
+    return jsonify(VERSION_INFO)
 
 @app.route('/v1/models', methods=['GET'])
 def list_models():
     """获取可用模型列表，兼容 OpenAI API"""
-    return jsonify({
-        "object": "list",
-        "data": [
-            {
-                "id": "Qwen/Qwen2.5-7B-Instruct",
-                "object": "model",
-                "created": int(time.time()),
-                "owned_by": "Qwen",
-                "permission": [],
-                "root": "Qwen/Qwen2.5-7B-Instruct",
-                "parent": None
-            }
-        ]
-    })
+    return jsonify(model_list())
 
 @app.errorhandler(404)
 def not_found(error):
-    return jsonify({
-        "error": {
-            "message": "Not found",
-            "type": "invalid_request_error",
-            "code": 404
-        }
-    }), 404
+    return jsonify(error_body("Not found", "invalid_request_error", 404)), 404
 
 @app.errorhandler(500)
 def internal_error(error):
-    return jsonify({
-        "error": {
-            "message": "Internal server error",
-            "type": "server_error",
-            "code": 500
-        }
-    }), 500
+    return jsonify(error_body("Internal server error", "server_error", 500)), 500
 
 if __name__ == '__main__':
     init_services()
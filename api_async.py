@@ -0,0 +1,215 @@
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from starlette.routing import Route
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import List
+import asyncio
+import logging
+import numpy as np
+import time
+import uvicorn
+from embedding_client import AsyncEmbeddingClient
+from metrics import render_prometheus, stage_metrics
+from sse_relay import AsyncSSERelay, RelayError
+from api import (EMBED_BACKEND, LLM_BASE_URL, LLM_MODEL, QUERY_EMBED_TIMEOUT, RETRIEVAL_MODE, RETRIEVAL_THRESHOLD,
+                 STREAM_FLUSH_INTERVAL, TAGS, VERSION_INFO,
+                 build_messages, create_context_packer, create_rag_system, create_reranker, error_body, mock_chat_completion,
+                 model_list, rerank_results, resolve_upload_path, retrieval_topk, select_context,
+                 start_ingest_worker)
+logger = logging.getLogger(__name__)
+
+# 异步服务模式：与 api.py 提供相同的 OpenAI 兼容接口，但运行在单个 asyncio 事件循环上。
+# 嵌入请求和上游 LLM 流式响应在等待网络时不占用线程，FAISS 检索放到线程池中执行，
+# 因此一个进程可以同时承载数百个流式对话。
+rag_system = None
+context_packer = None
+reranker = None
+ingest_worker = None
+embedder = None
+llm_relay = None
+search_pool = None
+# 执行 FAISS 检索的线程数（faiss 在搜索时会释放 GIL）
+SEARCH_THREADS = 4
+
+
+async def embed_locally(texts: List[str]) -> np.ndarray:
+    """本地嵌入后端是 CPU 计算，放到线程中执行，不阻塞事件循环"""
+    return await asyncio.to_thread(rag_system.embedder.embed, texts)
+
+
+async def encode_query(texts: List[str]) -> np.ndarray:
+    """异步计算查询向量（先查嵌入缓存），失败或超过 QUERY_EMBED_TIMEOUT 时返回 None"""
+    embed = embedder.embed if embedder is not None else embed_locally
+    try:
+        if rag_system.embed_cache is not None:
+            embedding = rag_system.embed_cache.aget_or_embed(texts, embed)
+        else:
+            embedding = embed(texts)
+        return await asyncio.wait_for(embedding, QUERY_EMBED_TIMEOUT)
+    except asyncio.TimeoutError:
+        logger.warning(f"Query embedding timed out after {QUERY_EMBED_TIMEOUT}s")
+        return None
+    except Exception as e:
+        logger.error(f"Embedding error: {e}")
+        return None
+
+
+async def retrieve(query: str) -> List[dict]:
+    """检索相关分块；向量化失败或超时时 rag_system.search 退化为 BM25 检索"""
+    topk = retrieval_topk()
+    cached = rag_system.cached_results([query], RETRIEVAL_THRESHOLD, topk, RETRIEVAL_MODE)[0]
+    if cached is not None:
+        return cached
+    vectors = None
+    if RETRIEVAL_MODE != 'lexical':
+        with stage_metrics.time('query_embed'):
+            vectors = await encode_query([query])
+    loop = asyncio.get_running_loop()
+    results = await loop.run_in_executor(search_pool, rag_system.search, [query], vectors,
+                                         RETRIEVAL_THRESHOLD, topk, RETRIEVAL_MODE)
+    logger.info(f"Retrieved {len(results[0])} results for query '{query}'")
+    return results[0]
+
+
+@asynccontextmanager
+async def lifespan(app):
+    """启动时初始化RAG系统和异步客户端，退出时关闭连接"""
+    global rag_system, context_packer, reranker, ingest_worker, embedder, llm_relay, search_pool
+    # 加载索引是阻塞操作，放到线程中执行；论文目录由后台导入线程同步
+    rag_system = await asyncio.to_thread(create_rag_system)
+    context_packer = create_context_packer(rag_system)
+    reranker = await asyncio.to_thread(create_reranker)
+    ingest_worker = start_ingest_worker(rag_system)
+    if EMBED_BACKEND == "http":
+        embedder = AsyncEmbeddingClient(rag_system.embed_url, rag_system.api_key, rag_system.embed_model)
+    llm_relay = AsyncSSERelay(LLM_BASE_URL, "dummy", flush_interval=STREAM_FLUSH_INTERVAL)
+    search_pool = ThreadPoolExecutor(max_workers=SEARCH_THREADS, thread_name_prefix="search")
+    logger.info("Async services initialized successfully")
+    try:
+        yield
+    finally:
+        ingest_worker.stop(timeout=5)
+        if embedder is not None:
+            await embedder.close()
+        await llm_relay.close()
+        search_pool.shutdown(wait=False)
+
+
+async def openai_chat_completion(request: Request):
+    try:
+        request_start = time.perf_counter()
+        data = await request.json()
+        messages = data['messages']
+        stream = data.get('stream', False)
+
+        # 获取最后一条用户消息并检索相关内容
+        last_message = messages[-1].get('content', '')
+        with stage_metrics.time('retrieval'):
+            results = await retrieve(last_message)
+        if reranker is not None:
+            # cross-encoder 打分是 CPU 计算，放到检索线程池中执行
+            results = await asyncio.get_running_loop().run_in_executor(search_pool, rerank_results, reranker,
+                                                                       last_message, results)
+        results = select_context(context_packer, results)
+        with stage_metrics.time('build_messages'):
+            messages = build_messages(messages, results)
+
+        if stream:
+            llm_start = time.perf_counter()
+            response = await llm_relay.open({"model": LLM_MODEL, "messages": messages})
+            # 客户端断开时生成器被取消，relay 在 finally 中关闭上游连接
+            body = llm_relay.relay(
+                response,
+                on_first_chunk=lambda: stage_metrics.observe('time_to_first_token',
+                                                             time.perf_counter() - request_start),
+                on_complete=lambda: stage_metrics.observe('llm_stream', time.perf_counter() - llm_start)
+            )
+            return StreamingResponse(body, media_type='text/event-stream')
+        # 模拟响应
+        return JSONResponse(mock_chat_completion())
+
+    except RelayError as e:
+        return JSONResponse(error_body(str(e), "upstream_error", 502), status_code=502)
+    except Exception as e:
+        logger.error(f"Error in chat completion: {e}")
+        return JSONResponse(error_body(str(e), "server_error", 500), status_code=500)
+
+
+def _save_upload(path: str, data: bytes):
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+async def submit_ingest(request: Request):
+    """上传PDF（multipart 的 file 字段），或以 {"paths": [...]} 提交论文目录中已有的文件"""
+    try:
+        paths = []
+        if request.headers.get('content-type', '').startswith('multipart/form-data'):
+            form = await request.form()
+            for upload in form.getlist('file'):
+                path = resolve_upload_path(upload.filename)
+                await asyncio.to_thread(_save_upload, path, await upload.read())
+                paths.append(path)
+        else:
+            data = await request.json()
+            paths.extend(resolve_upload_path(path) for path in data.get('paths', []))
+        for path in paths:
+            ingest_worker.submit(path)
+        return JSONResponse({"submitted": paths, "status": ingest_worker.status()}, status_code=202)
+    except ValueError as e:
+        return JSONResponse(error_body(str(e), "invalid_request_error", 400), status_code=400)
+
+
+async def ingest_status(request: Request):
+    """后台导入进度"""
+    return JSONResponse(ingest_worker.status())
+
+
+async def get_metrics(request: Request):
+    """Prometheus 格式的阶段耗时直方图、索引规模、缓存命中率、嵌入接口和流式转发的计数"""
+    # 异步服务的查询向量由单独的异步客户端计算
+    return PlainTextResponse(render_prometheus(rag_system, query_embedder=embedder, llm_relay=llm_relay, reranker=reranker),
+                             media_type='text/plain; version=0.0.4')
+
+
+async def get_tags(request: Request):
+    """获取标签列表"""
+    return JSONResponse(TAGS)
+
+
+async def get_version(request: Request):
+    """获取API版本信息"""
+    return JSONResponse(VERSION_INFO)
+
+
+async def list_models(request: Request):
+    """获取可用模型列表，兼容 OpenAI API"""
+    return JSONResponse(model_list())
+
+
+async def not_found(request: Request, exc):
+    return JSONResponse(error_body("Not found", "invalid_request_error", 404), status_code=404)
+
+
+async def internal_error(request: Request, exc):
+    return JSONResponse(error_body("Internal server error", "server_error", 500), status_code=500)
+
+
+app = Starlette(
+    routes=[
+        Route('/v1/chat/completions', openai_chat_completion, methods=['POST']),
+        Route('/v1/ingest', submit_ingest, methods=['POST']),
+        Route('/v1/ingest/status', ingest_status, methods=['GET']),
+        Route('/metrics', get_metrics, methods=['GET']),
+        Route('/api/tags', get_tags, methods=['GET']),
+        Route('/api/version', get_version, methods=['GET']),
+        Route('/v1/models', list_models, methods=['GET'])
+    ],
+    exception_handlers={404: not_found, 500: internal_error},
+    lifespan=lifespan
+)
+
+if __name__ == '__main__':
+    uvicorn.run(app, host='0.0.0.0', port=11435)
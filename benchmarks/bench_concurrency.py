@@ -0,0 +1,168 @@
+import argparse
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+import faiss
+import numpy as np
+from benchmarks.bench_index import synthetic_corpus
+from rag import SecurityRAGSystem
+logger = logging.getLogger(__name__)
+
+
+class CorpusWriter(threading.Thread):
+    """唯一的写入线程：不断把新文档（一批向量）写入索引，可选地删除旧文档
+
+    live 记录已发布、尚未删除的分块编号，读线程只从中抽取查询。
+    导入清单需要真实存在的文件，每篇文档在 doc_dir 中对应一个空文件。
+    """
+    def __init__(self, rag_system: SecurityRAGSystem, vectors: np.ndarray, start_chunk: int,
+                 batch: int, delete_every: int, stop: threading.Event, doc_dir: str):
+        super().__init__(daemon=True)
+        self.rag_system = rag_system
+        self.doc_dir = doc_dir
+        self.vectors = vectors
+        self.next_chunk = start_chunk
+        self.batch = batch
+        self.delete_every = delete_every
+        self.stop_event = stop
+        self.live = list(range(start_chunk))
+        self.docs = {}
+        self.inserted = 0
+        self.deleted = 0
+
+    def insert(self, name: str, start: int, end: int):
+        doc = os.path.join(self.doc_dir, f"{name}.pdf")
+        open(doc, 'wb').close()
+        chunks = [{'text': f"chunk {i}"} for i in range(start, end)]
+        self.rag_system.insert_chunks(doc, chunks, self.vectors[start:end])
+        self.docs[doc] = (start, end)
+        self.live.extend(range(start, end))
+
+    def run(self):
+        n = 0
+        while not self.stop_event.is_set() and self.next_chunk + self.batch <= len(self.vectors):
+            start, end = self.next_chunk, self.next_chunk + self.batch
+            self.insert(f"doc{start}", start, end)
+            self.next_chunk = end
+            self.inserted += end - start
+            n += 1
+            if self.delete_every and n % self.delete_every == 0 and len(self.docs) > 1:
+                doc = next(iter(self.docs))
+                start, end = self.docs.pop(doc)
+                # 先从候选中移除，再删除，读线程不会期待已删除的分块
+                removed = set(range(start, end))
+                self.live = [i for i in self.live if i not in removed]
+                self.rag_system.remove_document(doc)
+                self.deleted += end - start
+
+
+def reader(rag_system: SecurityRAGSystem, writer: CorpusWriter, threshold: float,
+           stop: threading.Event, stats: dict, seed: int):
+    """用某个已发布分块自身的向量查询，最相似的结果必须正是这个分块"""
+    rng = np.random.default_rng(seed)
+    queries = mismatches = missing = errors = 0
+    while not stop.is_set():
+        live = writer.live
+        chunk = live[int(rng.integers(len(live)))]
+        try:
+            results = rag_system.search_vectors(writer.vectors[chunk:chunk + 1], threshold=threshold, topk=1)[0]
+        except Exception as e:
+            errors += 1
+            logger.error(f"Search failed: {e}")
+            continue
+        queries += 1
+        if not results:
+            missing += 1
+        elif results[0]['text'] != f"chunk {chunk}":
+            mismatches += 1
+    with stats['lock']:
+        stats['queries'] += queries
+        stats['mismatches'] += mismatches
+        stats['missing'] += missing
+        stats['errors'] += errors
+
+
+def run_case(args, vectors: np.ndarray, threads: int, with_writer: bool) -> dict:
+    rag_system = SecurityRAGSystem(metric=args.metric, index_type=args.index_type, embed_cache_bytes=0)
+    stop = threading.Event()
+    doc_dir = tempfile.TemporaryDirectory()
+    writer = CorpusWriter(rag_system, vectors, args.base, args.batch, args.delete_every, stop, doc_dir.name)
+    for start in range(0, args.base, args.batch):
+        writer.insert(f"base{start}", start, min(start + args.batch, args.base))
+    writer.live = list(range(args.base))
+    writer.docs = {}
+
+    # cosine 下查询自身的相似度为 1；l2 下距离为 0
+    threshold = 0.99 if args.metric == 'cosine' else 1e-3
+    stats = {'lock': threading.Lock(), 'queries': 0, 'mismatches': 0, 'missing': 0, 'errors': 0}
+    readers = [threading.Thread(target=reader, args=(rag_system, writer, threshold, stop, stats, i),
+                                daemon=True) for i in range(threads)]
+    start = time.perf_counter()
+    for thread in readers:
+        thread.start()
+    if with_writer:
+        writer.start()
+    time.sleep(args.seconds)
+    stop.set()
+    for thread in readers + ([writer] if with_writer else []):
+        thread.join()
+    elapsed = time.perf_counter() - start
+    doc_dir.cleanup()
+
+    row = {
+        'threads': threads,
+        'writer': with_writer,
+        'qps': stats['queries'] / elapsed,
+        'queries': stats['queries'],
+        'mismatches': stats['mismatches'],
+        'missing': stats['missing'],
+        'errors': stats['errors'],
+        'inserted_per_second': writer.inserted / elapsed,
+        'deleted': writer.deleted,
+        'segments': len(rag_system._view.segments)
+    }
+    logger.info(f"{row}")
+    return row
+
+
+def print_report(report):
+    print(f"{'threads':>8}{'writer':>8}{'qps':>10}{'mismatch':>10}{'missing':>9}{'errors':>8}{'ins/s':>10}")
+    for row in report:
+        print(f"{row['threads']:>8}{str(row['writer']):>8}{row['qps']:>10.1f}{row['mismatches']:>10}"
+              f"{row['missing']:>9}{row['errors']:>8}{row['inserted_per_second']:>10.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="并发读写压力测试：导入进行时检索吞吐随线程数的变化及结果一致性")
+    parser.add_argument('--base', type=int, default=20000, help="开始前已写入的向量数")
+    parser.add_argument('--extra', type=int, default=50000, help="写入线程最多追加的向量数")
+    parser.add_argument('--batch', type=int, default=256, help="每篇文档的分块数")
+    parser.add_argument('--delete-every', type=int, default=10, help="每写入 N 篇文档删除一篇旧文档，0 表示不删除")
+    parser.add_argument('--threads', default="1,2,4,8", help="逗号分隔的读线程数")
+    parser.add_argument('--seconds', type=float, default=5.0, help="每个测试点的持续时间")
+    parser.add_argument('--index-type', default='flat')
+    parser.add_argument('--metric', choices=['l2', 'cosine'], default='cosine')
+    parser.add_argument('--omp-threads', type=int, default=1,
+                        help="faiss 内部的 OpenMP 线程数，单条查询并发时设为 1 避免过度订阅")
+    parser.add_argument('--output', help="把报告写入 JSON 文件")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    faiss.omp_set_num_threads(args.omp_threads)
+    vectors = synthetic_corpus(args.base + args.extra, 1024)
+    report = []
+    for threads in (int(t) for t in args.threads.split(',')):
+        for with_writer in (False, True):
+            report.append(run_case(args, vectors, threads, with_writer))
+    print_report(report)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'base': args.base, 'batch': args.batch, 'index_type': args.index_type,
+                       'metric': args.metric, 'report': report}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+import argparse
+import json
+import logging
+import random
+import time
+import numpy as np
+from embedding_client import EmbeddingClient
+from stub_servers import StubEmbeddingServer
+logger = logging.getLogger(__name__)
+
+_WORDS = ("adversarial attack model extraction poisoning backdoor membership inference privacy robustness "
+          "gradient defense evaluation threat security neural network jailbreak prompt injection").split()
+
+
+def synthetic_texts(n: int, min_words: int, max_words: int, seed: int = 0) -> list:
+    """长度不一的合成段落，模拟论文分块或用户问题"""
+    rng = random.Random(seed)
+    return [' '.join(rng.choice(_WORDS) for _ in range(rng.randint(min_words, max_words))) for _ in range(n)]
+
+
+def measure(embedder, queries: list, corpus: list, window: int) -> dict:
+    """单条查询的延迟分布，以及按导入窗口批量向量化语料的吞吐"""
+    embedder.embed(queries[:2])
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        embedder.embed([query])
+        latencies.append((time.perf_counter() - start) * 1000)
+    start = time.perf_counter()
+    for i in range(0, len(corpus), window):
+        embedder.embed(corpus[i:i + window])
+    seconds = time.perf_counter() - start
+    return {
+        'query_p50_ms': float(np.percentile(latencies, 50)),
+        'query_p95_ms': float(np.percentile(latencies, 95)),
+        'query_mean_ms': float(np.mean(latencies)),
+        'ingest_texts_per_second': len(corpus) / seconds,
+        'ingest_seconds': seconds
+    }
+
+
+def print_report(report):
+    print(f"{'backend':<14}{'p50(ms)':>10}{'p95(ms)':>10}{'texts/s':>12}")
+    for row in report:
+        if 'error' in row:
+            print(f"{row['backend']:<14}  {row['error']}")
+            continue
+        print(f"{row['backend']:<14}{row['query_p50_ms']:>10.2f}{row['query_p95_ms']:>10.2f}"
+              f"{row['ingest_texts_per_second']:>12.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="对比本地 CPU 嵌入后端与远程 HTTP 接口的查询延迟和导入吞吐")
+    parser.add_argument('--model-dir', help="本地 ONNX 模型目录，不指定时只测 HTTP 后端")
+    parser.add_argument('--quantized', action='store_true', help="本地后端使用 int8 量化模型")
+    parser.add_argument('--threads', type=int, help="本地后端的算子内线程数")
+    parser.add_argument('--max-length', type=int, default=512)
+    parser.add_argument('--latency', type=float, default=0.05, help="桩服务器每个请求的延迟（秒），模拟网络往返")
+    parser.add_argument('--per-item-latency', type=float, default=0.002, help="桩服务器每条文本的额外延迟（秒），模拟服务端计算")
+    parser.add_argument('--queries', type=int, default=50)
+    parser.add_argument('--corpus', type=int, default=1024, help="导入吞吐测试的分块数")
+    parser.add_argument('--window', type=int, default=256, help="每次向量化的分块数，与 ingest_window 一致")
+    parser.add_argument('--output', help="把报告写入 JSON 文件")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    queries = synthetic_texts(args.queries, 5, 20, seed=1)
+    corpus = synthetic_texts(args.corpus, 60, 200, seed=2)
+    report = []
+
+    with StubEmbeddingServer(latency=args.latency, per_item_latency=args.per_item_latency) as server:
+        client = EmbeddingClient(server.url, "dummy", "stub")
+        report.append({'backend': 'http', **measure(client, queries, corpus, args.window)})
+        client.close()
+
+    if args.model_dir:
+        try:
+            from local_embedding import OnnxEmbeddingClient
+            local = OnnxEmbeddingClient(args.model_dir, threads=args.threads, max_length=args.max_length,
+                                        quantized=args.quantized)
+            row = {'backend': 'onnx-int8' if args.quantized else 'onnx', **measure(local, queries, corpus, args.window)}
+            row['padding_ratio'] = local.stats['padded_tokens'] / max(local.stats['tokens'], 1)
+            report.append(row)
+        except Exception as e:
+            logger.error(f"Local backend failed: {e}")
+            report.append({'backend': 'onnx', 'error': str(e)})
+
+    print_report(report)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'latency': args.latency, 'per_item_latency': args.per_item_latency,
+                       'corpus': args.corpus, 'report': report}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
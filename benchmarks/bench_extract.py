@@ -0,0 +1,133 @@
+import argparse
+import json
+import logging
+import os
+import tempfile
+import time
+from benchmarks.bench_suite import write_synthetic_pdf
+from pdf_extract import EXTRACTORS, create_extractor
+from rag import SecurityRAGSystem
+logger = logging.getLogger(__name__)
+
+
+def extract_pages(extractor, paths: list) -> tuple:
+    """用给定后端解析并清理全部页，返回 (每篇文档的页文本, 耗时)"""
+    documents = []
+    start = time.perf_counter()
+    for path in paths:
+        documents.append([text for _, _, text in SecurityRAGSystem.iter_pages(path, extractor)])
+    return documents, time.perf_counter() - start
+
+
+def paragraph_quality(documents: list) -> dict:
+    """段落质量：通过 _is_valid_paragraph 的比例、有效段落的平均长度，以及粘连词（超过 25 个字符、
+    通常是提取时丢了空格）占词数的比例"""
+    candidates = valid = chars = words = glued = 0
+    for pages in documents:
+        for text in pages:
+            for para in SecurityRAGSystem._split_into_paragraphs(text):
+                candidates += 1
+                if not SecurityRAGSystem._is_valid_paragraph(para):
+                    continue
+                valid += 1
+                chars += len(para)
+                tokens = para.split()
+                words += len(tokens)
+                glued += sum(len(token) > 25 for token in tokens)
+    return {
+        'paragraphs': valid,
+        'valid_ratio': valid / candidates if candidates else 0.0,
+        'mean_paragraph_chars': chars / valid if valid else 0.0,
+        'glued_word_ratio': glued / words if words else 0.0
+    }
+
+
+def agreement(documents: list, reference: list) -> float:
+    """与基准后端逐页比较词集合的平均 Jaccard 相似度"""
+    scores = []
+    for pages, reference_pages in zip(documents, reference):
+        for text, reference_text in zip(pages, reference_pages):
+            a, b = set(text.lower().split()), set(reference_text.lower().split())
+            scores.append(len(a & b) / len(a | b) if a | b else 1.0)
+    return sum(scores) / len(scores) if scores else 0.0
+
+
+def bench_cache(extractor, paths: list, pages: int, workdir: str) -> dict:
+    """read_pdf 在解析缓存未命中（解析并写入）和命中（只解压和重新切分）时的吞吐及缓存大小"""
+    store_dir = tempfile.mkdtemp(dir=workdir)
+    rag = SecurityRAGSystem(store_dir=store_dir, embed_cache_bytes=0, dedup_threshold=None, extractor=extractor)
+    row = {}
+    for name in ('cold', 'warm'):
+        start = time.perf_counter()
+        for path in paths:
+            rag.read_pdf(path)
+        row[f'{name}_pages_per_second'] = pages / (time.perf_counter() - start)
+    cache_dir = rag.parse_cache.cache_dir
+    row['cache_bytes'] = sum(os.path.getsize(os.path.join(cache_dir, name)) for name in os.listdir(cache_dir))
+    row['cache_hits'] = rag.parse_cache.stats['hits']
+    return row
+
+
+def print_report(report: list):
+    print(f"{'extractor':<10}{'pages/s':>10}{'warm p/s':>10}{'paras':>8}{'valid':>8}{'chars':>8}"
+          f"{'glued':>8}{'agree':>8}{'cache KB':>10}")
+    for row in report:
+        if 'error' in row:
+            print(f"{row['extractor']:<10}  {row['error']}")
+            continue
+        print(f"{row['extractor']:<10}{row['pages_per_second']:>10.1f}{row['warm_pages_per_second']:>10.1f}"
+              f"{row['paragraphs']:>8}{row['valid_ratio']:>8.2f}{row['mean_paragraph_chars']:>8.0f}"
+              f"{row['glued_word_ratio']:>8.3f}{row['agreement']:>8.2f}{row['cache_bytes'] / 1024:>10.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="对比PDF文本提取后端的解析速度和段落质量，以及解析缓存命中时的吞吐")
+    parser.add_argument('--papers-dir', help="论文目录，不指定时使用合成PDF")
+    parser.add_argument('--pdfs', type=int, default=20, help="合成PDF的数量")
+    parser.add_argument('--pages', type=int, default=10, help="每篇合成PDF的页数")
+    parser.add_argument('--extractors', default=','.join(EXTRACTORS),
+                        help=f"逗号分隔的提取后端，第一个作为一致性比较的基准，可选 {','.join(EXTRACTORS)}")
+    parser.add_argument('--output', help="把报告写入 JSON 文件")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    report = []
+    reference = None
+    with tempfile.TemporaryDirectory() as workdir:
+        if args.papers_dir:
+            paths = [os.path.join(args.papers_dir, file) for file in sorted(os.listdir(args.papers_dir))
+                     if file.endswith('.pdf')]
+        else:
+            paths = []
+            for i in range(args.pdfs):
+                paths.append(os.path.join(workdir, f"paper{i}.pdf"))
+                write_synthetic_pdf(paths[-1], args.pages, seed=i)
+        for name in args.extractors.split(','):
+            try:
+                extractor = create_extractor(name)
+                documents, seconds = extract_pages(extractor, paths)
+            except Exception as e:
+                logger.error(f"Extractor {name} failed: {e}")
+                report.append({'extractor': name, 'error': str(e)})
+                continue
+            pages = sum(len(doc) for doc in documents)
+            reference = reference or documents
+            report.append({
+                'extractor': name,
+                'version': extractor.version,
+                'documents': len(paths),
+                'pages': pages,
+                'pages_per_second': pages / seconds,
+                **paragraph_quality(documents),
+                'agreement': agreement(documents, reference),
+                **bench_cache(extractor, paths, pages, workdir)
+            })
+
+    print_report(report)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'papers_dir': args.papers_dir, 'report': report}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
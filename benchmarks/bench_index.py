@@ -0,0 +1,91 @@
+import argparse
+import json
+import logging
+import numpy as np
+from ann_index import evaluate_index_modes, reconstruct_all
+from index_store import IndexStore
+logger = logging.getLogger(__name__)
+
+# 默认扫描的工作点
+DEFAULT_CONFIGS = [
+    {'index_type': 'ivf_flat', 'nprobe': [1, 4, 16, 64]},
+    {'index_type': 'hnsw', 'hnsw_m': 32, 'ef_search': [16, 64, 256]},
+    {'index_type': 'ivf_pq', 'pq_m': 64, 'nprobe': [4, 16, 64]},
+    {'index_type': 'opq_ivf_pq', 'pq_m': 64, 'nprobe': [4, 16, 64]}
+]
+# 压缩存储的工作点：降低精度（fp16 / int8）与降维（PCA / Matryoshka 截取）
+COMPRESSION_CONFIGS = [
+    {'index_type': 'sq_fp16'},
+    {'index_type': 'sq8'},
+    {'index_type': 'flat', 'reduce': 'pca', 'reduce_dim': 256},
+    {'index_type': 'flat', 'reduce': 'matryoshka', 'reduce_dim': 256},
+    {'index_type': 'sq8', 'reduce': 'pca', 'reduce_dim': 256}
+]
+PRESETS = {'ann': DEFAULT_CONFIGS, 'compression': COMPRESSION_CONFIGS}
+
+
+def synthetic_corpus(n: int, dimension: int, n_clusters: int = 100, seed: int = 0) -> np.ndarray:
+    """生成带聚类结构的单位向量，近似真实嵌入的分布"""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((n_clusters, dimension)).astype(np.float32)
+    vectors = centers[rng.integers(0, n_clusters, n)] + 0.5 * rng.standard_normal((n, dimension)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def load_store_vectors(store_dir: str) -> np.ndarray:
+    state = IndexStore(store_dir).load()
+    if state is None:
+        raise ValueError(f"No index store found in {store_dir}")
+    return np.vstack([reconstruct_all(segment) for segment in state['segments']])
+
+
+def make_queries(base: np.ndarray, n: int, noise: float = 0.3, seed: int = 1) -> np.ndarray:
+    """从语料中抽样并加噪声作为查询，模拟与某些段落相近但不相同的问题"""
+    rng = np.random.default_rng(seed)
+    queries = base[rng.integers(0, len(base), n)] + noise * rng.standard_normal((n, base.shape[1])).astype(np.float32) / np.sqrt(base.shape[1])
+    return (queries / np.linalg.norm(queries, axis=1, keepdims=True)).astype(np.float32)
+
+
+def print_report(report):
+    print(f"{'index':<12}{'param':<20}{'recall':>8}{'latency(ms)':>14}{'memory(MB)':>12}{'B/vec':>8}{'build(s)':>10}")
+    for row in report:
+        param = ''
+        if 'nprobe' in row:
+            param = f"nprobe={row['nprobe']}"
+        elif 'ef_search' in row:
+            param = f"efSearch={row['ef_search']}"
+        if 'reduce' in row:
+            param = f"{row['reduce']}{row['reduce_dim']} {param}".strip()
+        print(f"{row['index_type']:<12}{param:<20}{row['recall']:>8.3f}{row['latency_ms']:>14.3f}"
+              f"{row['memory_bytes'] / 1e6:>12.1f}{row['bytes_per_vector']:>8.0f}{row['build_seconds']:>10.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="对比各近似索引和压缩存储方式相对 Flat 的召回率、延迟与内存")
+    parser.add_argument('--store', help="使用已有索引存储中的向量作为语料")
+    parser.add_argument('--synthetic', type=int, default=50000, help="未指定 --store 时生成的向量数")
+    parser.add_argument('--dimension', type=int, default=1024)
+    parser.add_argument('--queries', type=int, default=500)
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--metric', choices=['l2', 'cosine'], default='l2')
+    parser.add_argument('--preset', choices=sorted(PRESETS), default='ann',
+                        help="ann 扫描 IVF/HNSW/PQ 的常用工作点；compression 对比 fp16/int8 量化与 PCA/Matryoshka 降维")
+    parser.add_argument('--configs', help="JSON 格式的索引配置列表，指定时忽略 --preset")
+    parser.add_argument('--output', help="把报告写入 JSON 文件")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    base = load_store_vectors(args.store) if args.store else synthetic_corpus(args.synthetic, args.dimension)
+    queries = make_queries(base, args.queries)
+    configs = json.loads(args.configs) if args.configs else PRESETS[args.preset]
+    logger.info(f"Evaluating {len(configs)} index configs on {len(base)} vectors, {len(queries)} queries")
+
+    report = evaluate_index_modes(base, queries, configs, k=args.k, metric=args.metric)
+    print_report(report)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'corpus_size': len(base), 'k': args.k, 'metric': args.metric, 'report': report}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
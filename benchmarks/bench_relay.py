@@ -0,0 +1,157 @@
+import argparse
+import json
+import logging
+import multiprocessing
+import threading
+import time
+from benchmarks.bench_suite import percentiles
+from sse_relay import SSERelay
+from stub_servers import StubLLMServer
+logger = logging.getLogger(__name__)
+
+MESSAGES = [{"role": "user", "content": "What is a membership inference attack?"}]
+
+
+def serve_stub(conn, options: dict):
+    """在单独的进程中运行桩 LLM，测得的 CPU 时间只包含转发一侧"""
+    with StubLLMServer(**options) as server:
+        conn.send(server.url)
+        while conn.recv() == 'stats':
+            conn.send({'requests': server.request_count, 'completed': server.completed,
+                       'disconnects': server.disconnects})
+
+
+def sdk_stream(client):
+    """原先的做法：OpenAI SDK 解析每个片段，再 model_dump、json.dumps 重新序列化"""
+    response = client.chat.completions.create(model="stub", messages=MESSAGES, stream=True)
+    try:
+        for chunk in response:
+            yield f"data: {json.dumps(chunk.model_dump())}\n\n".encode('utf-8')
+        yield b"data: [DONE]\n\n"
+    finally:
+        response.close()
+
+
+def relay_stream(relay: SSERelay):
+    stream = relay.open({"model": "stub", "messages": MESSAGES})
+    try:
+        yield from stream
+    finally:
+        stream.close()
+
+
+def measure(make_stream, streams: int, concurrency: int, tokens: int) -> dict:
+    """concurrency 个线程共发起 streams 个流，统计首个片段的时间、每个 token 的进程 CPU 时间和下游写次数"""
+    ttfts, writes = [], []
+    lock = threading.Lock()
+    per_thread = streams // concurrency
+
+    def worker():
+        for _ in range(per_thread):
+            start = time.perf_counter()
+            first = None
+            count = 0
+            for _ in make_stream():
+                if first is None:
+                    first = time.perf_counter() - start
+                count += 1
+            with lock:
+                ttfts.append(first)
+                writes.append(count)
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    cpu_start, wall_start = time.process_time(), time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    cpu, wall = time.process_time() - cpu_start, time.perf_counter() - wall_start
+    total_tokens = len(ttfts) * tokens
+    return {
+        **percentiles(ttfts, 'ttft_'),
+        'cpu_us_per_token': cpu / total_tokens * 1e6,
+        'writes_per_stream': sum(writes) / len(writes),
+        'tokens_per_second': total_tokens / wall
+    }
+
+
+def measure_cancel(relay: SSERelay, conn, attempts: int, read_chunks: int = 3, timeout: float = 2.0) -> dict:
+    """读几个片段后断开下游，统计上游多快停止发送（桩服务器的 disconnects 计数增加）"""
+    conn.send('stats')
+    baseline = conn.recv()['disconnects']
+    stop_ms = []
+    for _ in range(attempts):
+        stream = relay.open({"model": "stub", "messages": MESSAGES})
+        for _, _ in zip(range(read_chunks), stream):
+            pass
+        start = time.perf_counter()
+        stream.close()
+        while time.perf_counter() - start < timeout:
+            conn.send('stats')
+            if conn.recv()['disconnects'] > baseline:
+                baseline += 1
+                stop_ms.append((time.perf_counter() - start) * 1000)
+                break
+            time.sleep(0.001)
+    return {'attempts': attempts, 'upstream_stopped': len(stop_ms),
+            'stop_p50_ms': float(sorted(stop_ms)[len(stop_ms) // 2]) if stop_ms else None}
+
+
+def print_report(report: dict):
+    print(f"{'client':<18}{'ttft p50':>10}{'ttft p99':>10}{'cpu us/tok':>12}{'writes':>8}{'tok/s':>10}")
+    for name, row in report['streams'].items():
+        print(f"{name:<18}{row['ttft_p50_ms']:>10.2f}{row['ttft_p99_ms']:>10.2f}{row['cpu_us_per_token']:>12.1f}"
+              f"{row['writes_per_stream']:>8.1f}{row['tokens_per_second']:>10.0f}")
+    cancel = report['cancel']
+    print(f"cancelled {cancel['attempts']} streams, upstream stopped for {cancel['upstream_stopped']} "
+          f"(p50 {cancel['stop_p50_ms']} ms)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="流式转发的首 token 时间、每个 token 的 CPU 开销和断开后上游的停止，"
+                                                 "对比 OpenAI SDK 逐片段重新序列化与按字节转发")
+    parser.add_argument('--streams', type=int, default=64, help="每种客户端发起的流数")
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--tokens', type=int, default=256, help="桩 LLM 每个回答的 token 数")
+    parser.add_argument('--ttft', type=float, default=0.02, help="桩 LLM 的首 token 延迟（秒）")
+    parser.add_argument('--token-interval', type=float, default=0.001, help="桩 LLM 相邻 token 的间隔（秒）")
+    parser.add_argument('--flush-intervals', default="0,0.02", help="逗号分隔的合并窗口（秒）")
+    parser.add_argument('--output', help="把报告写入 JSON 文件")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    from openai import OpenAI
+
+    conn, child_conn = multiprocessing.Pipe()
+    stub = multiprocessing.get_context('spawn').Process(
+        target=serve_stub, args=(child_conn, {'tokens': args.tokens, 'ttft': args.ttft,
+                                              'token_interval': args.token_interval}), daemon=True)
+    stub.start()
+    url = conn.recv()
+    report = {'config': {key: value for key, value in vars(args).items() if key != 'output'}, 'streams': {}}
+    try:
+        client = OpenAI(base_url=url, api_key="dummy")
+        report['streams']['openai-sdk'] = measure(lambda: sdk_stream(client), args.streams, args.concurrency,
+                                                  args.tokens)
+        client.close()
+        for interval in [float(i) for i in args.flush_intervals.split(',')]:
+            relay = SSERelay(url, "dummy", flush_interval=interval)
+            report['streams'][f'relay flush={interval:g}'] = measure(lambda: relay_stream(relay), args.streams,
+                                                                     args.concurrency, args.tokens)
+            relay.close()
+        relay = SSERelay(url, "dummy")
+        report['cancel'] = measure_cancel(relay, conn, attempts=10)
+        report['cancel']['relay_stats'] = dict(relay.stats)
+        relay.close()
+    finally:
+        conn.send('stop')
+        stub.join(5)
+
+    print_report(report)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
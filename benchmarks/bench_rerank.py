@@ -0,0 +1,104 @@
+import argparse
+import json
+import logging
+import time
+import numpy as np
+from benchmarks.bench_embedding import synthetic_texts
+from benchmarks.bench_suite import percentiles
+from reranker import Reranker
+logger = logging.getLogger(__name__)
+
+
+class SyntheticScorer:
+    """没有模型时的替代打分器：按词重叠打分，并按每对 pair_latency 秒模拟推理耗时"""
+    model = 'synthetic'
+
+    def __init__(self, pair_latency: float):
+        self.pair_latency = pair_latency
+
+    def score(self, query: str, texts: list) -> np.ndarray:
+        time.sleep(self.pair_latency * len(texts))
+        words = set(query.split())
+        return np.array([len(words & set(text.split())) / (len(text.split()) + 1) for text in texts], dtype=np.float32)
+
+
+def candidates_for(query_id: int, n: int, texts: list) -> list:
+    """模拟第一阶段的结果：n 个候选按得分降序排列"""
+    start = query_id * n
+    return [{'chunk_id': start + i, 'text': texts[(start + i) % len(texts)], 'score': 1.0 - i / n} for i in range(n)]
+
+
+def measure(reranker: Reranker, queries: list, texts: list, candidates: int, topk: int) -> dict:
+    """每个查询重排一次（冷缓存），再重复一次（热缓存）"""
+    rows = {}
+    for name in ('cold', 'warm'):
+        before = dict(reranker.stats)
+        latencies, changed = [], 0
+        for q, query in enumerate(queries):
+            results = candidates_for(q, candidates, texts)
+            start = time.perf_counter()
+            reranked = reranker.rerank(query, results, topk)
+            latencies.append(time.perf_counter() - start)
+            changed += [r['chunk_id'] for r in reranked] != [r['chunk_id'] for r in results[:topk]]
+        rows[name] = {
+            **percentiles(latencies),
+            'fallback_rate': (reranker.stats['fallbacks'] - before['fallbacks']) / len(queries),
+            'order_changed_rate': changed / len(queries),
+            'pairs_scored': reranker.stats['pairs_scored'] - before['pairs_scored']
+        }
+    return rows
+
+
+def print_report(report: list):
+    print(f"{'cands':>6}{'batch':>6}{'budget':>8}{'cache':>6}{'p50(ms)':>10}{'p99(ms)':>10}{'fallback':>10}"
+          f"{'changed':>9}{'pairs':>8}")
+    for row in report:
+        budget = f"{row['budget'] * 1000:.0f}ms" if row['budget'] else '-'
+        for name in ('cold', 'warm'):
+            r = row[name]
+            print(f"{row['candidates']:>6}{row['batch_size']:>6}{budget:>8}{name:>6}{r['p50_ms']:>10.2f}"
+                  f"{r['p99_ms']:>10.2f}{r['fallback_rate']:>10.2f}{r['order_changed_rate']:>9.2f}{r['pairs_scored']:>8}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="第二阶段重排的延迟、超出预算的比例和得分缓存的效果")
+    parser.add_argument('--model-dir', help="ONNX cross-encoder 模型目录，不指定时使用模拟打分器")
+    parser.add_argument('--quantized', action='store_true')
+    parser.add_argument('--threads', type=int)
+    parser.add_argument('--pair-latency', type=float, default=0.002, help="模拟打分器每对的耗时（秒）")
+    parser.add_argument('--candidates', default="20,50", help="逗号分隔的候选数")
+    parser.add_argument('--batch-sizes', default="8,16,32", help="逗号分隔的批大小")
+    parser.add_argument('--budgets', default="0,0.1", help="逗号分隔的延迟预算（秒），0 表示不限时")
+    parser.add_argument('--topk', type=int, default=8)
+    parser.add_argument('--queries', type=int, default=50)
+    parser.add_argument('--output', help="把报告写入 JSON 文件")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.ERROR, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    if args.model_dir:
+        from reranker import OnnxCrossEncoder
+        scorer = OnnxCrossEncoder(args.model_dir, threads=args.threads, quantized=args.quantized)
+    else:
+        scorer = SyntheticScorer(args.pair_latency)
+    queries = synthetic_texts(args.queries, 5, 15, seed=1)
+    texts = synthetic_texts(1000, 60, 200, seed=2)
+
+    report = []
+    for candidates in [int(c) for c in args.candidates.split(',')]:
+        for batch_size in [int(b) for b in args.batch_sizes.split(',')]:
+            for budget in [float(b) or None for b in args.budgets.split(',')]:
+                reranker = Reranker(scorer, batch_size=batch_size, budget=budget)
+                row = {'candidates': candidates, 'batch_size': batch_size, 'budget': budget,
+                       **measure(reranker, queries, texts, candidates, args.topk)}
+                report.append(row)
+                logger.info(f"{row}")
+
+    print_report(report)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'scorer': scorer.model, 'config': {k: v for k, v in vars(args).items() if k != 'output'},
+                       'report': report}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
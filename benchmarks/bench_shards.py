@@ -0,0 +1,115 @@
+import argparse
+import json
+import logging
+import os
+import random
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from benchmarks.bench_suite import build_corpus, new_rag, percentiles, write_synthetic_pdf
+from sharding import ShardedRAGSystem
+from stub_servers import StubEmbeddingServer
+logger = logging.getLogger(__name__)
+
+
+def bench_ingest(rag, papers_dir: str) -> dict:
+    """同步整个论文目录（解析、向量化、写索引）的吞吐"""
+    start = time.perf_counter()
+    stats = rag.sync_directory(papers_dir)
+    seconds = time.perf_counter() - start
+    chunks = sum(s['chunks'] for s in rag.stats()) if isinstance(rag, ShardedRAGSystem) else rag._view.ntotal
+    return {
+        'documents': stats['added'],
+        'chunks': chunks,
+        'documents_per_second': stats['added'] / seconds,
+        'chunks_per_second': chunks / seconds,
+        'seconds': seconds
+    }
+
+
+def bench_queries(rag, queries: list, args) -> dict:
+    """顺序查询的延迟分布，以及 clients 个并发客户端下的吞吐"""
+    rag.retrieval(queries[0], threshold=args.threshold, topk=args.topk, mode=args.mode)
+
+    def timed(query):
+        start = time.perf_counter()
+        rag.retrieval(query, threshold=args.threshold, topk=args.topk, mode=args.mode)
+        return time.perf_counter() - start
+
+    row = percentiles([timed(query) for query in queries])
+    with ThreadPoolExecutor(max_workers=args.clients) as pool:
+        start = time.perf_counter()
+        latencies = list(pool.map(timed, queries))
+        seconds = time.perf_counter() - start
+    row.update(percentiles(latencies, prefix='concurrent_'))
+    row['concurrent_qps'] = len(queries) / seconds
+    return row
+
+
+def run(rag, args, papers_dir: str, doc_dir: str) -> dict:
+    row = {'ingest': bench_ingest(rag, papers_dir)}
+    texts = build_corpus(rag, args.corpus, doc_dir)
+    rng = random.Random(0)
+    # 查询取自语料：最相近的分块一定存在，阈值过滤后仍有结果
+    row['query'] = bench_queries(rag, [texts[rng.randrange(len(texts))] for _ in range(args.queries)], args)
+    return row
+
+
+def print_report(report: dict):
+    print(f"{'shards':>8}{'docs/s':>10}{'chunks/s':>10}{'p50(ms)':>10}{'p99(ms)':>10}"
+          f"{'conc p50':>10}{'conc p99':>10}{'qps':>10}")
+    for name, row in report.items():
+        ingest, query = row['ingest'], row['query']
+        print(f"{name:>8}{ingest['documents_per_second']:>10.2f}{ingest['chunks_per_second']:>10.1f}"
+              f"{query['p50_ms']:>10.2f}{query['p99_ms']:>10.2f}{query['concurrent_p50_ms']:>10.2f}"
+              f"{query['concurrent_p99_ms']:>10.2f}{query['concurrent_qps']:>10.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="分片检索的扩展性：不同分片进程数下的导入吞吐和查询延迟，"
+                                                 "以进程内的单索引为基线")
+    parser.add_argument('--shards', default="1,2,4", help="逗号分隔的分片进程数")
+    parser.add_argument('--pdfs', type=int, default=24, help="导入测试的合成PDF数量")
+    parser.add_argument('--pages', type=int, default=10, help="每篇PDF的页数")
+    parser.add_argument('--embed-latency', type=float, default=0.02, help="桩嵌入服务器每个请求的延迟（秒）")
+    parser.add_argument('--corpus', type=int, default=50000, help="查询测试额外写入的合成分块数")
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--clients', type=int, default=8, help="并发查询的客户端数")
+    parser.add_argument('--mode', choices=['dense', 'lexical', 'hybrid'], default='dense')
+    parser.add_argument('--metric', choices=['l2', 'cosine'], default='cosine')
+    parser.add_argument('--threshold', type=float, default=0.6)
+    parser.add_argument('--topk', type=int, default=5)
+    parser.add_argument('--output', help="把结果写入 JSON 文件")
+    args = parser.parse_args()
+    shard_counts = [int(s) for s in args.shards.split(',')]
+
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    report = {}
+    with tempfile.TemporaryDirectory() as workdir, StubEmbeddingServer(latency=args.embed_latency) as server:
+        papers_dir = os.path.join(workdir, 'papers')
+        os.makedirs(papers_dir)
+        for i in range(args.pdfs):
+            write_synthetic_pdf(os.path.join(papers_dir, f"paper{i}.pdf"), args.pages, seed=i)
+
+        doc_dir = os.path.join(workdir, 'single')
+        os.makedirs(doc_dir)
+        rag = new_rag(server.url, args.metric)
+        report['single'] = run(rag, args, papers_dir, doc_dir)
+        rag.embedder.close()
+        for n in shard_counts:
+            doc_dir = os.path.join(workdir, f"shards{n}")
+            os.makedirs(doc_dir)
+            with ShardedRAGSystem(n, embed_url=server.url, metric=args.metric, dedup_threshold=None,
+                                  embed_cache_bytes=0) as sharded:
+                report[str(n)] = run(sharded, args, papers_dir, doc_dir)
+            logger.info(f"{n} shards: {report[str(n)]}")
+
+    print_report(report)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'config': {key: value for key, value in vars(args).items() if key != 'output'},
+                       'cpus': os.cpu_count(), 'results': report}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,358 @@
+import argparse
+import json
+import logging
+import os
+import random
+import subprocess
+import tempfile
+import textwrap
+import threading
+import time
+import numpy as np
+import requests
+from benchmarks.bench_embedding import synthetic_texts
+from rag import SecurityRAGSystem
+from stub_servers import StubEmbeddingServer, StubLLMServer, stub_embedding
+logger = logging.getLogger(__name__)
+
+STAGES = ('pdf', 'embed', 'retrieval', 'chat')
+_WORDS = ("adversarial attack model extraction poisoning backdoor membership inference privacy robustness "
+          "gradient defense evaluation threat security neural network jailbreak prompt injection").split()
+
+
+def _pdf_string(text: str) -> str:
+    return text.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+
+
+def write_synthetic_pdf(path: str, pages: int, seed: int = 0, paragraphs: int = 4, words: int = 80):
+    """生成一篇每页若干段随机文本的PDF，不依赖额外的库；第一页第一行为标题"""
+    rng = random.Random(seed)
+    contents = []
+    for page in range(pages):
+        lines = [f"A Study of Security Threats in Machine Learning Systems {seed}", ""] if page == 0 else []
+        for _ in range(paragraphs):
+            lines.extend(textwrap.wrap(' '.join(rng.choice(_WORDS) for _ in range(words)) + '.', 90))
+            lines.append("")
+        ops = ''.join(f"({_pdf_string(line)}) Tj T* " if line else "T* " for line in lines)
+        contents.append(f"BT /F1 10 Tf 12 TL 50 760 Td {ops}ET".encode('latin-1'))
+
+    # 对象编号：1 目录，2 页面树，3 字体，之后每页一个页面对象和一个内容流
+    kids = ' '.join(f"{4 + 2 * i} 0 R" for i in range(pages))
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        f"<< /Type /Pages /Kids [{kids}] /Count {pages} >>".encode('ascii'),
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"
+    ]
+    for i, content in enumerate(contents):
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+                       f"/Resources << /Font << /F1 3 0 R >> >> /Contents {5 + 2 * i} 0 R >>".encode('ascii'))
+        objects.append(f"<< /Length {len(content)} >>\nstream\n".encode('ascii') + content + b"\nendstream")
+
+    data = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(data))
+        data += f"{number} 0 obj\n".encode('ascii') + body + b"\nendobj\n"
+    xref = len(data)
+    data += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode('ascii')
+    data += ''.join(f"{offset:010d} 00000 n \n" for offset in offsets).encode('ascii')
+    data += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode('ascii')
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+def percentiles(values: list, prefix: str = '') -> dict:
+    return {
+        f'{prefix}p50_ms': float(np.percentile(values, 50)) * 1000,
+        f'{prefix}p99_ms': float(np.percentile(values, 99)) * 1000,
+        f'{prefix}mean_ms': float(np.mean(values)) * 1000
+    }
+
+
+def new_rag(embed_url: str, metric: str) -> SecurityRAGSystem:
+    rag = SecurityRAGSystem(metric=metric, embed_cache_bytes=0, dedup_threshold=None)
+    rag.embedder.url = embed_url
+    return rag
+
+
+def bench_pdf(args, workdir: str) -> dict:
+    """read_pdf 的解析吞吐：页/秒和有效段落/秒"""
+    paths = []
+    for i in range(args.pdfs):
+        path = os.path.join(workdir, f"paper{i}.pdf")
+        write_synthetic_pdf(path, args.pages, seed=i)
+        paths.append(path)
+    rag = SecurityRAGSystem(embed_cache_bytes=0, dedup_threshold=None)
+    paragraphs = 0
+    start = time.perf_counter()
+    for path in paths:
+        paragraphs += len(rag.read_pdf(path))
+    seconds = time.perf_counter() - start
+    pages = args.pdfs * args.pages
+    return {
+        'documents': args.pdfs,
+        'pages': pages,
+        'paragraphs': paragraphs,
+        'pages_per_second': pages / seconds,
+        'paragraphs_per_second': paragraphs / seconds,
+        'seconds': seconds
+    }
+
+
+def bench_embed(args, embed_url: str) -> dict:
+    """encode_text 按导入窗口向量化分块的吞吐（嵌入缓存关闭）"""
+    rag = new_rag(embed_url, args.metric)
+    texts = synthetic_texts(args.embed_chunks, 60, 200, seed=2)
+    rag.encode_text(texts[:2])
+    start = time.perf_counter()
+    for i in range(0, len(texts), rag.ingest_window):
+        if rag.encode_text(texts[i:i + rag.ingest_window]) is None:
+            raise RuntimeError("Embedding failed")
+    seconds = time.perf_counter() - start
+    return {
+        'chunks': len(texts),
+        'chunks_per_second': len(texts) / seconds,
+        'seconds': seconds,
+        'requests': rag.embedder.stats['requests']
+    }
+
+
+def build_corpus(rag: SecurityRAGSystem, size: int, doc_dir: str, batch: int = 500) -> list:
+    """写入 size 个合成分块，向量与桩服务器对同一文本返回的向量相同；返回分块文本"""
+    texts = synthetic_texts(size, 40, 120, seed=size)
+    for start in range(0, size, batch):
+        doc = os.path.join(doc_dir, f"corpus{size}_{start}.pdf")
+        open(doc, 'wb').close()
+        end = min(start + batch, size)
+        chunks = [{'text': texts[i], 'title': f"Synthetic paper {start}", 'page': 1 + (i - start) // 8}
+                  for i in range(start, end)]
+        vectors = np.vstack([stub_embedding(text, rag.dimension) for text in texts[start:end]])
+        rag.insert_chunks(doc, chunks, vectors)
+    return texts
+
+
+def bench_retrieval(args, embed_url: str, doc_dir: str, corpora: dict) -> dict:
+    """不同语料规模下 retrieval() 的延迟分布（包括查询向量化的往返），每种检索模式分别统计"""
+    report = {}
+    rng = random.Random(0)
+    for size in args.sizes:
+        rag = new_rag(embed_url, args.metric)
+        start = time.perf_counter()
+        texts = build_corpus(rag, size, doc_dir)
+        build_seconds = time.perf_counter() - start
+        corpora[size] = rag
+        # 查询取自语料：最相近的分块一定存在，阈值过滤后仍有结果
+        queries = [texts[rng.randrange(size)] for _ in range(args.queries)]
+        row = {'build_seconds': build_seconds}
+        for mode in args.modes:
+            rag.retrieval(queries[0], threshold=args.threshold, topk=args.topk, mode=mode)
+            latencies = []
+            for query in queries:
+                start = time.perf_counter()
+                rag.retrieval(query, threshold=args.threshold, topk=args.topk, mode=mode)
+                latencies.append(time.perf_counter() - start)
+            row[mode] = {**percentiles(latencies), 'qps': len(latencies) / sum(latencies)}
+        report[str(size)] = row
+        logger.info(f"retrieval {size}: {row}")
+    return report
+
+
+def stream_chat(session: requests.Session, url: str, question: str) -> tuple:
+    """发送一个流式聊天请求，返回 (首 token 时间, 总时间, token 数)，单位为秒"""
+    start = time.perf_counter()
+    first = None
+    tokens = 0
+    with session.post(url, json={"model": "stub", "stream": True,
+                                 "messages": [{"role": "user", "content": question}]},
+                      stream=True, timeout=60) as response:
+        response.raise_for_status()
+        for line in response.iter_lines():
+            if not line.startswith(b'data: ') or line == b'data: [DONE]':
+                continue
+            chunk = json.loads(line[6:])
+            if chunk['choices'] and chunk['choices'][0]['delta'].get('content'):
+                tokens += 1
+                if first is None:
+                    first = time.perf_counter() - start
+    return first, time.perf_counter() - start, tokens
+
+
+def bench_chat(args, rag: SecurityRAGSystem, llm_url: str) -> dict:
+    """api.py 的 /v1/chat/completions 端到端测试：N 个并发流式客户端的吞吐和首 token 时间"""
+    from werkzeug.serving import make_server
+    from sse_relay import SSERelay
+    from query_batcher import QueryBatcher
+    import api
+
+    api.rag_system = rag
+    api.query_batcher = QueryBatcher(rag)
+    api.context_packer = api.create_context_packer(rag)
+    api.llm_relay = SSERelay(llm_url, "dummy", flush_interval=args.flush_interval)
+    # api 导入时把日志级别设为 INFO，测试时只保留警告
+    logging.getLogger().setLevel(logging.WARNING)
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    server = make_server('127.0.0.1', 0, api.app, threaded=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    url = f"http://127.0.0.1:{server.server_port}/v1/chat/completions"
+    questions = synthetic_texts(64, 5, 20, seed=3)
+
+    report = {}
+    try:
+        for concurrency in args.concurrency:
+            samples, errors = [], []
+            lock = threading.Lock()
+
+            def client(worker: int):
+                session = requests.Session()
+                for i in range(args.chat_requests):
+                    try:
+                        sample = stream_chat(session, url, questions[(worker * args.chat_requests + i) % len(questions)])
+                    except Exception as e:
+                        with lock:
+                            errors.append(str(e))
+                        continue
+                    with lock:
+                        samples.append(sample)
+                session.close()
+
+            clients = [threading.Thread(target=client, args=(i,)) for i in range(concurrency)]
+            start = time.perf_counter()
+            for c in clients:
+                c.start()
+            for c in clients:
+                c.join()
+            seconds = time.perf_counter() - start
+            row = {'requests': len(samples), 'errors': len(errors),
+                   'requests_per_second': len(samples) / seconds,
+                   'tokens_per_second': sum(s[2] for s in samples) / seconds}
+            if samples:
+                row.update(percentiles([s[0] for s in samples if s[0] is not None], 'ttft_'))
+                row.update(percentiles([s[1] for s in samples], 'latency_'))
+            if errors:
+                logger.warning(f"{len(errors)} chat requests failed, first error: {errors[0]}")
+            report[str(concurrency)] = row
+            logger.info(f"chat concurrency={concurrency}: {row}")
+    finally:
+        server.shutdown()
+        api.llm_relay.close()
+    return report
+
+
+def flatten(report: dict, prefix: str = '') -> dict:
+    """把嵌套的报告展开为 {'retrieval.1000.dense.p50_ms': 值}，便于跨提交对比"""
+    flat = {}
+    for key, value in report.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(flatten(value, name + '.'))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = value
+    return flat
+
+
+def print_report(report: dict):
+    results = report['results']
+    if 'pdf' in results:
+        r = results['pdf']
+        print(f"read_pdf     {r['pages_per_second']:>10.1f} pages/s  {r['paragraphs_per_second']:>10.1f} paragraphs/s")
+    if 'embed' in results:
+        print(f"encode_text  {results['embed']['chunks_per_second']:>10.1f} chunks/s")
+    if 'retrieval' in results:
+        print(f"{'corpus':>10}{'mode':>10}{'p50(ms)':>10}{'p99(ms)':>10}{'qps':>10}")
+        for size, row in results['retrieval'].items():
+            for mode, stats in row.items():
+                if isinstance(stats, dict):
+                    print(f"{size:>10}{mode:>10}{stats['p50_ms']:>10.2f}{stats['p99_ms']:>10.2f}{stats['qps']:>10.1f}")
+    if 'chat' in results:
+        print(f"{'clients':>10}{'req/s':>10}{'tokens/s':>10}{'ttft p50':>10}{'ttft p99':>10}{'errors':>8}")
+        for concurrency, row in results['chat'].items():
+            print(f"{concurrency:>10}{row['requests_per_second']:>10.2f}{row['tokens_per_second']:>10.1f}"
+                  f"{row.get('ttft_p50_ms', float('nan')):>10.1f}{row.get('ttft_p99_ms', float('nan')):>10.1f}"
+                  f"{row['errors']:>8}")
+
+
+def print_comparison(report: dict, baseline: dict):
+    """逐项对比两次运行的结果，只列出两边都有的指标"""
+    current, previous = flatten(report['results']), flatten(baseline['results'])
+    print(f"\ncompared with {baseline.get('commit') or 'baseline'}:")
+    print(f"{'metric':<44}{'baseline':>12}{'current':>12}{'change':>9}")
+    for name in sorted(current.keys() & previous.keys()):
+        change = (current[name] - previous[name]) / previous[name] * 100 if previous[name] else float('nan')
+        print(f"{name:<44}{previous[name]:>12.2f}{current[name]:>12.2f}{change:>8.1f}%")
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="可复现的性能测试：PDF解析、向量化、检索延迟和聊天接口的并发流式吞吐，"
+                                                 "嵌入接口和 LLM 由本地桩服务器模拟")
+    parser.add_argument('--stages', default=','.join(STAGES), help=f"逗号分隔的测试阶段，可选 {','.join(STAGES)}")
+    parser.add_argument('--pdfs', type=int, default=20, help="合成PDF的数量")
+    parser.add_argument('--pages', type=int, default=10, help="每篇PDF的页数")
+    parser.add_argument('--embed-chunks', type=int, default=2048, help="向量化吞吐测试的分块数")
+    parser.add_argument('--embed-latency', type=float, default=0.0, help="桩嵌入服务器每个请求的延迟（秒）")
+    parser.add_argument('--sizes', default="1000,10000,50000", help="逗号分隔的检索语料规模（分块数）")
+    parser.add_argument('--modes', default="dense,lexical,hybrid", help="逗号分隔的检索模式")
+    parser.add_argument('--queries', type=int, default=200, help="每个规模、每种模式的查询数")
+    parser.add_argument('--metric', choices=['l2', 'cosine'], default='cosine')
+    parser.add_argument('--threshold', type=float, default=0.6)
+    parser.add_argument('--topk', type=int, default=5)
+    parser.add_argument('--concurrency', default="1,4,16", help="逗号分隔的并发流式客户端数")
+    parser.add_argument('--chat-requests', type=int, default=8, help="每个客户端发送的请求数")
+    parser.add_argument('--llm-tokens', type=int, default=64, help="桩 LLM 每个回答的 token 数")
+    parser.add_argument('--llm-ttft', type=float, default=0.05, help="桩 LLM 的首 token 延迟（秒）")
+    parser.add_argument('--llm-token-interval', type=float, default=0.01, help="桩 LLM 相邻 token 的间隔（秒）")
+    parser.add_argument('--flush-interval', type=float, default=0.02, help="流式转发合并 token 的时间窗口（秒）")
+    parser.add_argument('--output', help="把结果写入 JSON 文件")
+    parser.add_argument('--compare', help="与之前保存的 JSON 结果逐项对比")
+    args = parser.parse_args()
+    stages = args.stages.split(',')
+    args.sizes = [int(s) for s in args.sizes.split(',')]
+    args.modes = args.modes.split(',')
+    args.concurrency = [int(c) for c in args.concurrency.split(',')]
+    unknown = set(stages) - set(STAGES)
+    if unknown:
+        parser.error(f"Unknown stages: {sorted(unknown)}")
+
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    report = {'commit': git_commit(), 'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+              'config': {key: value for key, value in vars(args).items() if key not in ('output', 'compare')},
+              'results': {}}
+    results = report['results']
+    corpora = {}
+    with tempfile.TemporaryDirectory() as workdir, \
+            StubEmbeddingServer(latency=args.embed_latency) as embed_server, \
+            StubLLMServer(tokens=args.llm_tokens, ttft=args.llm_ttft, token_interval=args.llm_token_interval) as llm:
+        if 'pdf' in stages:
+            results['pdf'] = bench_pdf(args, workdir)
+        if 'embed' in stages:
+            results['embed'] = bench_embed(args, embed_server.url)
+        if 'retrieval' in stages:
+            results['retrieval'] = bench_retrieval(args, embed_server.url, workdir, corpora)
+        if 'chat' in stages:
+            # 聊天测试使用最大规模的语料
+            size = max(args.sizes)
+            rag = corpora.get(size)
+            if rag is None:
+                rag = new_rag(embed_server.url, args.metric)
+                build_corpus(rag, size, workdir)
+            results['chat'] = bench_chat(args, rag, llm.url)
+
+    print_report(report)
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            print_comparison(report, json.load(f))
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,221 @@
+import numpy as np
+from array import array
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Tuple
+import json
+import math
+import os
+import re
+import logging
+from chunk_store import IntColumn
+logger = logging.getLogger(__name__)
+
+# 英文按字母数字切分，保留 CVE-2021-44228、log4j、gpt-4 这类带连接符的整体；中文按单字切分
+_TOKEN_RE = re.compile(r'[a-z0-9]+(?:[-_.][a-z0-9]+)*|[一-鿿]')
+_STOPWORDS = frozenset("""
+a an and are as at be by for from has have in is it its of on or that the this to was were which with
+we our these those can not but been also such than their they into more may via using use used
+""".split())
+
+
+def tokenize(text: str) -> List[str]:
+    """小写化并切分成词；带连接符的词同时产出整体和各部分，精确的编号和名称都能命中"""
+    tokens = []
+    for token in _TOKEN_RE.findall(text.lower()):
+        if token in _STOPWORDS:
+            continue
+        tokens.append(token)
+        if any(sep in token for sep in '-_.'):
+            tokens.extend(part for part in re.split(r'[-_.]', token) if part and part not in _STOPWORDS)
+    return tokens
+
+
+class BM25Index:
+    """与 FAISS 索引并列的 BM25 倒排索引，编号与分块编号一致
+
+    已落盘部分为 CSR 格式（每个词一段连续的分块编号和词频），可以 mmap；
+    新增分块的倒排表以紧凑的 array 追加在内存中，保存时合并成新的 CSR。
+    只追加不修改，检索时只使用编号小于快照分块数的倒排项。
+
+    磁盘上为 bm25_terms.json / bm25_offsets.npy / bm25_postings.npy / bm25_tfs.npy / bm25_lengths.npy。
+
+    Args:
+        k1: 词频饱和参数
+        b: 文档长度归一化参数
+    """
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.terms: Dict[str, int] = {}
+        self._base_offsets = np.zeros(1, dtype=np.int64)
+        self._base_postings = np.zeros(0, dtype=np.int32)
+        self._base_tfs = np.zeros(0, dtype=np.uint16)
+        self._tail: Dict[int, Tuple[array, array]] = {}
+        self.lengths = IntColumn()
+        self._total_length = 0
+
+    def __len__(self) -> int:
+        return len(self.lengths)
+
+    def add(self, texts: Iterable[str]):
+        """按分块编号顺序追加分块（调用方持有写锁）"""
+        chunk_id = len(self.lengths)
+        lengths = []
+        for text in texts:
+            counts = Counter(tokenize(text))
+            for term, tf in counts.items():
+                term_id = self.terms.get(term)
+                if term_id is None:
+                    term_id = self.terms[term] = len(self.terms)
+                postings = self._tail.get(term_id)
+                if postings is None:
+                    postings = self._tail[term_id] = (array('i'), array('H'))
+                postings[0].append(chunk_id)
+                postings[1].append(min(tf, 65535))
+            length = sum(counts.values())
+            lengths.append(length)
+            self._total_length += length
+            chunk_id += 1
+        # 长度最后写入：检索按长度列的大小判断哪些分块已经完整
+        self.lengths.extend(lengths)
+
+    def _postings(self, term_id: int) -> Tuple[np.ndarray, np.ndarray]:
+        ids, tfs = [], []
+        if term_id + 1 < len(self._base_offsets):
+            start, end = int(self._base_offsets[term_id]), int(self._base_offsets[term_id + 1])
+            ids.append(np.asarray(self._base_postings[start:end]))
+            tfs.append(np.asarray(self._base_tfs[start:end]))
+        tail = self._tail.get(term_id)
+        if tail is not None:
+            # 先复制再转换，写入方可能同时在追加，两列长度按较短的对齐
+            tail_ids, tail_tfs = tail[0][:], tail[1][:]
+            n = min(len(tail_ids), len(tail_tfs))
+            ids.append(np.array(tail_ids[:n], dtype=np.int32))
+            tfs.append(np.array(tail_tfs[:n], dtype=np.uint16))
+        if not ids:
+            return np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.uint16)
+        if len(ids) == 1:
+            return ids[0], tfs[0]
+        return np.concatenate(ids), np.concatenate(tfs)
+
+    def search(self, query: str, topk: int, limit: Optional[int] = None,
+               exclude: Optional[frozenset] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """返回 BM25 得分最高的 topk 个分块 (得分, 编号)，按得分降序
+
+        Args:
+            query: 查询文本
+            topk: 返回数量
+            limit: 只考虑编号小于该值的分块（检索快照中的分块数）
+            exclude: 需要排除的分块编号（墓碑）
+        """
+        n = len(self.lengths) if limit is None else min(limit, len(self.lengths))
+        term_ids = [self.terms[t] for t in dict.fromkeys(tokenize(query)) if t in self.terms]
+        if n == 0 or not term_ids:
+            return np.zeros(0, dtype=np.float32), np.zeros(0, dtype=np.int64)
+        avgdl = max(self._total_length / max(len(self.lengths), 1), 1.0)
+
+        all_ids, all_scores = [], []
+        doc_lengths = None
+        for term_id in term_ids:
+            ids, tfs = self._postings(term_id)
+            mask = ids < n
+            ids, tfs = ids[mask], tfs[mask].astype(np.float32)
+            if not len(ids):
+                continue
+            df = len(ids)
+            idf = math.log(1 + (n - df + 0.5) / (df + 0.5))
+            if doc_lengths is None:
+                doc_lengths = self.lengths.to_numpy(n).astype(np.float32)
+            lengths = doc_lengths[ids]
+            all_scores.append(idf * tfs * (self.k1 + 1) /
+                              (tfs + self.k1 * (1 - self.b + self.b * lengths / avgdl)))
+            all_ids.append(ids)
+        if not all_ids:
+            return np.zeros(0, dtype=np.float32), np.zeros(0, dtype=np.int64)
+
+        ids, inverse = np.unique(np.concatenate(all_ids), return_inverse=True)
+        scores = np.bincount(inverse, weights=np.concatenate(all_scores)).astype(np.float32)
+        if exclude:
+            keep = ~np.isin(ids, np.fromiter(exclude, dtype=np.int64, count=len(exclude)))
+            ids, scores = ids[keep], scores[keep]
+        if len(ids) > topk:
+            top = np.argpartition(-scores, topk - 1)[:topk]
+            ids, scores = ids[top], scores[top]
+        order = np.argsort(-scores, kind='stable')
+        return scores[order], ids[order].astype(np.int64)
+
+    def _csr(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """合并已落盘部分和内存中的倒排表"""
+        counts = np.zeros(len(self.terms), dtype=np.int64)
+        base_terms = len(self._base_offsets) - 1
+        counts[:base_terms] = np.diff(self._base_offsets)
+        for term_id, (ids, _) in self._tail.items():
+            counts[term_id] += len(ids)
+        offsets = np.zeros(len(self.terms) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        postings = np.empty(int(offsets[-1]), dtype=np.int32)
+        tfs = np.empty(int(offsets[-1]), dtype=np.uint16)
+        for term_id in range(len(self.terms)):
+            ids, term_tfs = self._postings(term_id)
+            start = offsets[term_id]
+            postings[start:start + len(ids)] = ids
+            tfs[start:start + len(ids)] = term_tfs
+        return offsets, postings, tfs
+
+    def compact(self, keep: np.ndarray) -> "BM25Index":
+        """只保留 keep 为 True 的分块并重新编号，生成新的索引"""
+        new_ids = np.cumsum(keep) - 1
+        offsets, postings, tfs = self._csr()
+        index = BM25Index(self.k1, self.b)
+        term_of = np.repeat(np.arange(len(self.terms), dtype=np.int64), np.diff(offsets))
+        alive = keep[postings]
+        postings, tfs, term_of = new_ids[postings[alive]].astype(np.int32), tfs[alive], term_of[alive]
+        # 去掉不再出现的词，词编号重新连续
+        used = np.unique(term_of)
+        remap = np.zeros(len(self.terms), dtype=np.int64)
+        remap[used] = np.arange(len(used))
+        names = sorted(self.terms, key=self.terms.get)
+        index.terms = {names[t]: i for i, t in enumerate(used)}
+        index._base_offsets = np.zeros(len(used) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(remap[term_of], minlength=len(used)), out=index._base_offsets[1:])
+        index._base_postings = postings
+        index._base_tfs = tfs
+        lengths = self.lengths.to_numpy()[keep]
+        index.lengths = IntColumn(lengths)
+        index._total_length = int(lengths.sum())
+        return index
+
+    def write(self, directory: str):
+        offsets, postings, tfs = self._csr()
+        names = sorted(self.terms, key=self.terms.get)
+        with open(os.path.join(directory, 'bm25_terms.json'), 'w', encoding='utf-8') as f:
+            json.dump({'k1': self.k1, 'b': self.b, 'terms': names}, f, ensure_ascii=False)
+        np.save(os.path.join(directory, 'bm25_offsets.npy'), offsets)
+        np.save(os.path.join(directory, 'bm25_postings.npy'), postings)
+        np.save(os.path.join(directory, 'bm25_tfs.npy'), tfs)
+        np.save(os.path.join(directory, 'bm25_lengths.npy'), self.lengths.to_numpy())
+
+    @classmethod
+    def open(cls, directory: str, mmap: bool = True) -> Optional["BM25Index"]:
+        """读取已保存的倒排索引，不存在时返回 None"""
+        terms_path = os.path.join(directory, 'bm25_terms.json')
+        if not os.path.exists(terms_path):
+            return None
+        mode = 'r' if mmap else None
+        with open(terms_path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        index = cls(data['k1'], data['b'])
+        index.terms = {term: i for i, term in enumerate(data['terms'])}
+        index._base_offsets = np.load(os.path.join(directory, 'bm25_offsets.npy'))
+        index._base_postings = np.load(os.path.join(directory, 'bm25_postings.npy'), mmap_mode=mode)
+        index._base_tfs = np.load(os.path.join(directory, 'bm25_tfs.npy'), mmap_mode=mode)
+        lengths = np.load(os.path.join(directory, 'bm25_lengths.npy'))
+        index.lengths = IntColumn(lengths)
+        index._total_length = int(lengths.sum())
+        return index
+
+    @classmethod
+    def build(cls, texts: Iterable[str]) -> "BM25Index":
+        index = cls()
+        index.add(texts)
+        return index
@@ -0,0 +1,188 @@
+import numpy as np
+from array import array
+from typing import Iterable, List, Optional
+import json
+import os
+import logging
+logger = logging.getLogger(__name__)
+
+
+class TextArena:
+    """文本区：已落盘部分以 mmap 只读方式访问，新增文本保存在内存中
+
+    磁盘上所有文本以 UTF-8 拼接成一个 texts.bin，offsets.npy 记录每段的起止偏移，
+    按下标访问时才解码，因此加载耗时与文本总量无关，多个进程共享同一份页缓存。
+    """
+    def __init__(self, blob: Optional[np.ndarray] = None, offsets: Optional[np.ndarray] = None):
+        self._blob = blob
+        self._offsets = offsets
+        self._base_len = len(offsets) - 1 if offsets is not None else 0
+        self._tail: List[str] = []
+
+    def __len__(self) -> int:
+        return self._base_len + len(self._tail)
+
+    def __getitem__(self, idx: int) -> str:
+        if idx < 0:
+            idx += len(self)
+        if idx < 0 or idx >= len(self):
+            raise IndexError(f"text index out of range: {idx}")
+        if idx < self._base_len:
+            start, end = int(self._offsets[idx]), int(self._offsets[idx + 1])
+            return bytes(self._blob[start:end]).decode('utf-8')
+        return self._tail[idx - self._base_len]
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def append(self, text: str):
+        self._tail.append(text)
+
+    def extend(self, texts: List[str]):
+        self._tail.extend(texts)
+
+    def write(self, blob_path: str, offsets_path: str):
+        """写出完整文本区（已落盘部分按字节直接拷贝）"""
+        offsets = np.zeros(len(self) + 1, dtype=np.int64)
+        with open(blob_path, 'wb') as f:
+            if self._base_len:
+                f.write(self._blob[:int(self._offsets[-1])].tobytes())
+                offsets[:self._base_len + 1] = self._offsets
+            pos = int(offsets[self._base_len])
+            for i, text in enumerate(self._tail, self._base_len + 1):
+                data = text.encode('utf-8')
+                f.write(data)
+                pos += len(data)
+                offsets[i] = pos
+        np.save(offsets_path, offsets)
+
+    @classmethod
+    def open(cls, blob_path: str, offsets_path: str, mmap: bool = True) -> "TextArena":
+        offsets = np.load(offsets_path, mmap_mode='r' if mmap else None)
+        if int(offsets[-1]) == 0:
+            # 空文件无法 mmap
+            blob = np.zeros(0, dtype=np.uint8)
+        elif mmap:
+            blob = np.memmap(blob_path, dtype=np.uint8, mode='r')
+        else:
+            blob = np.fromfile(blob_path, dtype=np.uint8)
+        return cls(blob, offsets)
+
+
+class IntColumn:
+    """只追加的 int32 列：已落盘部分为（可 mmap 的）numpy 数组，新增部分为紧凑的 array('i')"""
+    def __init__(self, base: Optional[np.ndarray] = None):
+        self._base = base if base is not None else np.zeros(0, dtype=np.int32)
+        self._tail = array('i')
+
+    def __len__(self) -> int:
+        return len(self._base) + len(self._tail)
+
+    def __getitem__(self, idx: int) -> int:
+        if idx < len(self._base):
+            return int(self._base[idx])
+        return self._tail[idx - len(self._base)]
+
+    def extend(self, values: Iterable[int]):
+        self._tail.extend(values)
+
+    def to_numpy(self, n: Optional[int] = None) -> np.ndarray:
+        """前 n 个值（默认全部）的副本；新增部分先复制再转换，写入方可以同时追加"""
+        n = len(self) if n is None else n
+        base = np.asarray(self._base[:n], dtype=np.int32)
+        tail = self._tail[:n - len(base)]
+        tail = np.frombuffer(tail, dtype=np.int32) if len(tail) else np.zeros(0, dtype=np.int32)
+        return np.concatenate([base, tail])
+
+
+class ChunkStore:
+    """列式分块存储
+
+    文本只在 TextArena 中保存一份；每个分块的文档编号和页码是定长 int32 列，
+    标题、文件名等文档级信息放在一张小的文档表中，检索结果据此直接带上引用字段。
+
+    磁盘上为 texts.bin / offsets.npy / doc_ids.npy / pages.npy / documents.json。
+    """
+    def __init__(self, texts: Optional[TextArena] = None, doc_ids: Optional[np.ndarray] = None,
+                 pages: Optional[np.ndarray] = None, documents: Optional[List[dict]] = None):
+        self.texts = texts if texts is not None else TextArena()
+        self.doc_ids = IntColumn(doc_ids)
+        self.pages = IntColumn(pages)
+        self.documents = documents if documents is not None else []
+
+    def __len__(self) -> int:
+        return len(self.texts)
+
+    def add_document(self, path: str, title: Optional[str] = None) -> int:
+        """登记一篇文档，返回文档编号"""
+        self.documents.append({
+            'title': title or os.path.splitext(os.path.basename(path))[0],
+            'file_name': os.path.basename(path),
+            'path': os.path.normpath(path)
+        })
+        return len(self.documents) - 1
+
+    def extend(self, doc_id: int, texts: List[str], pages: List[int]):
+        """追加一篇文档的若干分块；先写定长列再写文本，读者按快照中的分块数访问"""
+        self.doc_ids.extend([doc_id] * len(texts))
+        self.pages.extend(pages)
+        self.texts.extend(texts)
+
+    def text(self, idx: int) -> str:
+        return self.texts[idx]
+
+    def get(self, idx: int) -> dict:
+        """分块文本及引用信息：title、file_name、page（从 1 开始，未知时为 0）和 chunk_id（即 idx）"""
+        document = self.documents[self.doc_ids[idx]]
+        return {
+            'chunk_id': idx,
+            'text': self.texts[idx],
+            'title': document['title'],
+            'file_name': document['file_name'],
+            'page': self.pages[idx]
+        }
+
+    def compact(self, keep: np.ndarray) -> "ChunkStore":
+        """只保留 keep 为 True 的分块，生成新的存储；不再被引用的文档从文档表中去掉"""
+        doc_ids = self.doc_ids.to_numpy()[keep]
+        used = np.unique(doc_ids)
+        remap = np.full(len(self.documents) + 1, -1, dtype=np.int32)
+        remap[used] = np.arange(len(used), dtype=np.int32)
+        store = ChunkStore(documents=[self.documents[i] for i in used])
+        store.doc_ids.extend(remap[doc_ids].tolist())
+        store.pages.extend(self.pages.to_numpy()[keep].tolist())
+        store.texts.extend([self.texts[i] for i in np.flatnonzero(keep)])
+        return store
+
+    def write(self, directory: str):
+        self.texts.write(os.path.join(directory, 'texts.bin'), os.path.join(directory, 'offsets.npy'))
+        np.save(os.path.join(directory, 'doc_ids.npy'), self.doc_ids.to_numpy())
+        np.save(os.path.join(directory, 'pages.npy'), self.pages.to_numpy())
+        with open(os.path.join(directory, 'documents.json'), 'w', encoding='utf-8') as f:
+            json.dump(self.documents, f, ensure_ascii=False)
+
+    @classmethod
+    def open(cls, directory: str, mmap: bool = True) -> "ChunkStore":
+        mode = 'r' if mmap else None
+        texts = TextArena.open(os.path.join(directory, 'texts.bin'),
+                               os.path.join(directory, 'offsets.npy'), mmap=mmap)
+        doc_ids = np.load(os.path.join(directory, 'doc_ids.npy'), mmap_mode=mode)
+        pages = np.load(os.path.join(directory, 'pages.npy'), mmap_mode=mode)
+        with open(os.path.join(directory, 'documents.json'), 'r', encoding='utf-8') as f:
+            documents = json.load(f)
+        return cls(texts, doc_ids, pages, documents)
+
+    @classmethod
+    def from_manifest(cls, texts: TextArena, manifest: dict) -> "ChunkStore":
+        """从旧格式（只有文本）迁移：按导入清单中的分块区间恢复文档编号，页码未知记为 0"""
+        store = cls(texts)
+        doc_ids = np.full(len(texts), -1, dtype=np.int32)
+        for path, entry in manifest.items():
+            doc_ids[entry['chunk_start']:entry['chunk_end']] = store.add_document(path)
+        if (doc_ids < 0).any():
+            # 清单之外的分块（如已删除文档的残留）归到一个占位文档
+            doc_ids[doc_ids < 0] = store.add_document('unknown')
+        store.doc_ids = IntColumn(doc_ids)
+        store.pages = IntColumn(np.zeros(len(texts), dtype=np.int32))
+        return store
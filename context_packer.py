@@ -0,0 +1,116 @@
+import numpy as np
+from typing import List, Optional
+import logging
+from embedding_client import estimate_tokens
+logger = logging.getLogger(__name__)
+
+
+def passage_header(result: dict) -> str:
+    page = result['page']
+    if result.get('last_page', page) != page:
+        page = f"{page}-{result['last_page']}"
+    return f"[Paper: {result['title']}\nFile: {result['file_name']}, Page: {page}\n"
+
+
+def format_context(passages: List[dict]) -> str:
+    """把分块（或合并后的段落）格式化为提示词中的上下文"""
+    return ''.join(f"{passage_header(p)}Content: {p['text']}\n\n" for p in passages)
+
+
+def mmr_select(relevance: np.ndarray, vectors: Optional[np.ndarray], costs: List[int],
+               budget: int, mmr_lambda: float = 0.7, max_similarity: float = 0.95) -> List[int]:
+    """按最大边际相关性（MMR）贪心挑选候选，直到预算用完
+
+    每一步选出 mmr_lambda * 相关性 - (1 - mmr_lambda) * 与已选候选的最大余弦相似度 最大、
+    且代价不超过剩余预算的候选。与已选候选的相似度达到 max_similarity 的候选（几乎相同的段落）直接丢弃。
+    vectors 为 None 时只按相关性挑选。
+
+    Args:
+        relevance: 每个候选的相关性，已归一化到 [0, 1]
+        vectors: 每个候选的向量，None 表示不做去冗余
+        costs: 每个候选的 token 数
+        budget: token 预算
+        mmr_lambda: 相关性的权重，1 表示不考虑多样性
+        max_similarity: 与已选候选的余弦相似度上限
+    Returns:
+        被选中的候选下标，按选中顺序
+    """
+    costs = np.asarray(costs)
+    if vectors is not None:
+        vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    # 每个候选与已选候选的最大相似度（负相似度不加分）
+    redundancy = np.zeros(len(relevance))
+    available = costs <= budget
+    selected = []
+    remaining = budget
+    while available.any():
+        scores = np.where(available, mmr_lambda * relevance - (1 - mmr_lambda) * redundancy, -np.inf)
+        best = int(np.argmax(scores))
+        selected.append(best)
+        remaining -= costs[best]
+        available[best] = False
+        available &= costs <= remaining
+        if vectors is not None:
+            redundancy = np.maximum(redundancy, vectors @ vectors[best])
+            available &= redundancy < max_similarity
+    return selected
+
+
+def merge_adjacent(passages: List[dict]) -> List[dict]:
+    """合并同一篇论文中编号相邻的分块，合并后的段落排在其中最先被选中的分块的位置"""
+    merged = []
+    for rank, passage in sorted(enumerate(passages), key=lambda item: (item[1]['file_name'], item[1]['chunk_id'])):
+        last = merged[-1][1] if merged else None
+        if last is not None and last['file_name'] == passage['file_name'] \
+                and passage['chunk_id'] == last['last_chunk_id'] + 1:
+            last['text'] += ' ' + passage['text']
+            last['last_chunk_id'] = passage['chunk_id']
+            last['last_page'] = passage['page']
+            merged[-1][0] = min(merged[-1][0], rank)
+            continue
+        merged.append([rank, {**passage, 'last_chunk_id': passage['chunk_id'], 'last_page': passage['page']}])
+    return [passage for _, passage in sorted(merged, key=lambda item: item[0])]
+
+
+class ContextPacker:
+    """从超量召回的候选中挑选上下文：MMR 去冗余、token 预算内装箱、相邻分块合并
+
+    提示词长度（以及 LLM 的 prefill 延迟）由 max_tokens 限定，而不是随 topk 和分块长度浮动；
+    内容几乎相同的相邻分块不会重复占用上下文。相关性为第一阶段得分归一化到 [0, 1]，
+    分块之间的相似度用索引中保存的向量计算。
+
+    Args:
+        rag_system: 提供 chunk_vectors 的 SecurityRAGSystem
+        max_tokens: 上下文的 token 预算（按 estimate_tokens 估算，包含每段的标题行）
+        mmr_lambda: 相关性的权重，越小越偏向多样性，1 表示只按相关性
+        max_similarity: 与已选分块的余弦相似度达到该值的候选视为重复，直接丢弃
+        merge: 是否合并同一篇论文中相邻的分块
+    """
+    def __init__(self, rag_system, max_tokens: int = 1500, mmr_lambda: float = 0.7,
+                 max_similarity: float = 0.95, merge: bool = True):
+        self.rag_system = rag_system
+        self.max_tokens = max_tokens
+        self.mmr_lambda = mmr_lambda
+        self.max_similarity = max_similarity
+        self.merge = merge
+
+    def pack(self, results: List[dict]) -> List[dict]:
+        """从按相关性排序的检索结果中挑选要放入提示词的段落"""
+        if not results:
+            return []
+        scores = np.array([r['score'] for r in results], dtype=np.float64)
+        spread = scores.max() - scores.min()
+        relevance = (scores - scores.min()) / spread if spread > 0 else np.ones(len(results))
+        vectors = None
+        if self.mmr_lambda < 1 or self.max_similarity < 1:
+            # 按检索时的快照取回向量，检索之后发生的压缩不会让编号指向别的分块
+            vectors = self.rag_system.chunk_vectors([r['chunk_id'] for r in results],
+                                                    [r.get('index_version') for r in results])
+        costs = [estimate_tokens(passage_header(r)) + estimate_tokens(r['text']) for r in results]
+        selected = mmr_select(relevance, vectors, costs, self.max_tokens, self.mmr_lambda, self.max_similarity)
+        passages = [results[i] for i in selected]
+        if self.merge:
+            passages = merge_adjacent(passages)
+        logger.debug(f"Packed {len(selected)} of {len(results)} candidates into {len(passages)} passages "
+                     f"({sum(costs[i] for i in selected)} tokens)")
+        return passages
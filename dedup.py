@@ -0,0 +1,144 @@
+import numpy as np
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+import re
+import threading
+import zlib
+import logging
+logger = logging.getLogger(__name__)
+
+_WORD_RE = re.compile(r'[a-z0-9]+|[一-鿿]')
+# MinHash 使用的梅森素数 2^61 - 1
+_PRIME = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64(0xffffffff)
+
+
+class NearDuplicateDetector:
+    """基于 MinHash + LSH 的近重复分块检测，在向量化之前跳过重复段落
+
+    每个分块按词切分后取连续 shingle 个词作为特征集合，用 num_perm 个哈希函数计算 MinHash 签名，
+    签名按 bands 段分桶：任意一段完全相同的分块成为候选，再用签名估计的 Jaccard 相似度
+    不低于 threshold 时判为重复。完全相同的文本总会命中。
+
+    已登记的签名按文档路径记录，文档删除或导入失败时用 forget 去掉。
+
+    Args:
+        threshold: 判为重复的 Jaccard 相似度下限
+        num_perm: MinHash 签名长度
+        bands: LSH 分段数，num_perm 必须能被整除；分段越多，低相似度的候选越多
+        shingle: 每个特征包含的连续词数
+    """
+    def __init__(self, threshold: float = 0.85, num_perm: int = 64, bands: int = 16, shingle: int = 3):
+        if num_perm % bands:
+            raise ValueError(f"num_perm ({num_perm}) must be divisible by bands ({bands})")
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle = shingle
+        rng = np.random.default_rng(1)
+        self._a = rng.integers(1, int(_PRIME), num_perm, dtype=np.uint64)
+        self._b = rng.integers(0, int(_PRIME), num_perm, dtype=np.uint64)
+        self._lock = threading.Lock()
+        self._signatures: Dict[int, Tuple[str, np.ndarray]] = {}
+        self._buckets: Dict[Tuple[int, bytes], List[int]] = {}
+        self._documents: Dict[str, List[int]] = {}
+        self._next_id = 0
+        # 从其他文档跳过重复分块时记录来源文档，来源被删除后这些文档需要重新导入
+        self._sources: Dict[str, Set[str]] = {}
+        self.loaded = False
+        self.stats = {'chunks_checked': 0, 'chunks_skipped': 0}
+
+    def signature(self, text: str) -> np.ndarray:
+        words = _WORD_RE.findall(text.lower())
+        if len(words) > self.shingle:
+            shingles = {' '.join(words[i:i + self.shingle]) for i in range(len(words) - self.shingle + 1)}
+        else:
+            shingles = {' '.join(words)}
+        x = np.fromiter((zlib.crc32(s.encode('utf-8')) for s in shingles), dtype=np.uint64, count=len(shingles))
+        # (a * x + b) mod p，乘法按 uint64 回绕，结果截成 32 位
+        hashes = ((np.outer(x, self._a) + self._b) % _PRIME) & _MAX_HASH
+        return hashes.min(axis=0).astype(np.uint32)
+
+    def _band_keys(self, signature: np.ndarray) -> List[Tuple[int, bytes]]:
+        return [(band, signature[band * self.rows:(band + 1) * self.rows].tobytes())
+                for band in range(self.bands)]
+
+    def _match(self, signature: np.ndarray, keys: List[Tuple[int, bytes]]) -> Optional[str]:
+        """返回与签名近重复的已登记分块所在的文档，没有时返回 None"""
+        seen = set()
+        for key in keys:
+            for entry_id in self._buckets.get(key, ()):
+                if entry_id in seen:
+                    continue
+                seen.add(entry_id)
+                path, other = self._signatures[entry_id]
+                if np.count_nonzero(signature == other) >= self.threshold * self.num_perm:
+                    return path
+        return None
+
+    def _add(self, path: str, signature: np.ndarray, keys: List[Tuple[int, bytes]]):
+        entry_id = self._next_id
+        self._next_id += 1
+        self._signatures[entry_id] = (path, signature)
+        self._documents.setdefault(path, []).append(entry_id)
+        for key in keys:
+            self._buckets.setdefault(key, []).append(entry_id)
+
+    def load(self, items: Iterable[Tuple[str, str]]):
+        """登记已入库的分块 (文档路径, 文本)，不做重复检查；已经登记过时直接返回"""
+        with self._lock:
+            if self.loaded:
+                return
+            for path, text in items:
+                signature = self.signature(text)
+                self._add(path, signature, self._band_keys(signature))
+            self.loaded = True
+
+    def filter(self, path: str, chunks: List[dict]) -> List[dict]:
+        """去掉与已登记分块（包括同一文档中靠前的分块）近重复的分块，保留下来的分块随即登记
+
+        Returns:
+            保留的分块，顺序不变
+        """
+        kept = []
+        with self._lock:
+            for chunk in chunks:
+                signature = self.signature(chunk['text'])
+                keys = self._band_keys(signature)
+                source = self._match(signature, keys)
+                if source is None:
+                    self._add(path, signature, keys)
+                    kept.append(chunk)
+                elif source != path:
+                    self._sources.setdefault(path, set()).add(source)
+            self.stats['chunks_checked'] += len(chunks)
+            self.stats['chunks_skipped'] += len(chunks) - len(kept)
+        if len(kept) < len(chunks):
+            logger.info(f"Skipped {len(chunks) - len(kept)} near-duplicate chunks of {path}")
+        return kept
+
+    def sources(self, path: str) -> List[str]:
+        """path 中被跳过的分块来自哪些文档"""
+        with self._lock:
+            return sorted(self._sources.get(path, ()))
+
+    def forget(self, path: str):
+        """去掉一篇文档登记的全部签名"""
+        with self._lock:
+            self._sources.pop(path, None)
+            for entry_id in self._documents.pop(path, []):
+                _, signature = self._signatures.pop(entry_id)
+                for key in self._band_keys(signature):
+                    bucket = self._buckets.get(key)
+                    if bucket is not None:
+                        bucket.remove(entry_id)
+                        if not bucket:
+                            del self._buckets[key]
+
+    def reset(self):
+        with self._lock:
+            self._signatures.clear()
+            self._buckets.clear()
+            self._documents.clear()
+            self._sources.clear()
+            self.loaded = False
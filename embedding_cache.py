@@ -0,0 +1,209 @@
+import numpy as np
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, List, Optional
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+from embedding_client import estimate_tokens
+logger = logging.getLogger(__name__)
+
+# 磁盘层一次查询的键数，低于 SQLite 默认的参数个数上限
+_SQL_BATCH = 500
+
+
+def normalize_text(text: str) -> str:
+    """规范化文本：Unicode NFC，并把连续空白合并成一个空格"""
+    return ' '.join(unicodedata.normalize('NFC', text).split())
+
+
+def cache_key(model: str, text: str) -> bytes:
+    return hashlib.sha256(f"{model}\0{normalize_text(text)}".encode('utf-8')).digest()
+
+
+class EmbeddingCache:
+    """按内容寻址的嵌入缓存
+
+    键为 (模型名, 规范化文本的哈希)。内存层是按字节预算淘汰的 LRU，
+    可选的磁盘层用 SQLite 保存 float32 向量，重启后仍然有效。
+
+    Args:
+        model: 嵌入模型名，作为键的一部分
+        max_bytes: 内存层的字节预算
+        disk_path: SQLite 文件路径，None 表示只用内存层
+    """
+    def __init__(self, model: str, max_bytes: int = 256 * 1024 * 1024, disk_path: Optional[str] = None):
+        self.model = model
+        self.max_bytes = max_bytes
+        self._memory: "OrderedDict[bytes, np.ndarray]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        # 磁盘层单独加锁，SQLite 读写不占用内存层的锁
+        self._db_lock = threading.Lock()
+
+        self._db = None
+        if disk_path:
+            os.makedirs(os.path.dirname(os.path.abspath(disk_path)), exist_ok=True)
+            self._db = sqlite3.connect(disk_path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings (key BLOB PRIMARY KEY, vector BLOB NOT NULL)"
+            )
+            self._db.commit()
+
+        self.stats = {
+            'hits': 0,
+            'disk_hits': 0,
+            'misses': 0,
+            'evictions': 0,
+            'tokens_saved': 0,
+            'miss_seconds': 0.0
+        }
+
+    def _remember(self, key: bytes, vector: np.ndarray):
+        """写入内存层并按字节预算淘汰最久未使用的条目（调用方持有锁）"""
+        old = self._memory.pop(key, None)
+        if old is not None:
+            self._bytes -= old.nbytes
+        if vector.nbytes > self.max_bytes:
+            return
+        self._memory[key] = vector
+        self._bytes += vector.nbytes
+        while self._bytes > self.max_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._bytes -= evicted.nbytes
+            self.stats['evictions'] += 1
+
+    def get(self, text: str) -> Optional[np.ndarray]:
+        return self.get_many([text])[0]
+
+    def get_many(self, texts: List[str]) -> List[Optional[np.ndarray]]:
+        keys = [cache_key(self.model, text) for text in texts]
+        found = self._get_keys(list(dict.fromkeys(keys)))
+        return [found.get(key) for key in keys]
+
+    def _get_keys(self, keys: List[bytes]) -> Dict[bytes, np.ndarray]:
+        """按（不重复的）键查找：先查内存层，未命中的键在内存层的锁外查磁盘层，查到的再写回内存层"""
+        found = {}
+        disk_keys = []
+        with self._lock:
+            for key in keys:
+                vector = self._memory.get(key)
+                if vector is not None:
+                    self._memory.move_to_end(key)
+                    found[key] = vector
+                elif self._db is not None:
+                    disk_keys.append(key)
+        if disk_keys:
+            rows = self._read_disk(disk_keys)
+            if rows:
+                with self._lock:
+                    for key, vector in rows.items():
+                        self._remember(key, vector)
+                    self.stats['disk_hits'] += len(rows)
+                found.update(rows)
+        return found
+
+    def _read_disk(self, keys: List[bytes]) -> Dict[bytes, np.ndarray]:
+        rows = {}
+        with self._db_lock:
+            if self._db is None:
+                return rows
+            for start in range(0, len(keys), _SQL_BATCH):
+                batch = keys[start:start + _SQL_BATCH]
+                query = f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(batch))})"
+                for key, blob in self._db.execute(query, batch):
+                    rows[bytes(key)] = np.frombuffer(blob, dtype=np.float32)
+        return rows
+
+    def put_many(self, texts: List[str], vectors: np.ndarray):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        rows = []
+        with self._lock:
+            for text, vector in zip(texts, vectors):
+                key = cache_key(self.model, text)
+                vector = np.array(vector, dtype=np.float32)
+                self._remember(key, vector)
+                rows.append((key, vector.tobytes()))
+        if rows:
+            # 磁盘写入不持有内存层的锁，其他线程的内存层查找不必等待
+            with self._db_lock:
+                if self._db is not None:
+                    self._db.executemany("INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)", rows)
+                    self._db.commit()
+
+    def _lookup(self, texts: List[str]):
+        """查缓存并记录命中统计，返回 (已命中的向量列表, {未命中文本的键: 下标列表})
+
+        同一批中重复的文本只查找一次，命中、未命中和节省的 token 也都只按不重复的文本计一次。
+        """
+        keys = [cache_key(self.model, text) for text in texts]
+        first = {}
+        for i, key in enumerate(keys):
+            first.setdefault(key, i)
+        found = self._get_keys(list(first))
+        cached = [found.get(key) for key in keys]
+        missing = {}
+        for i, key in enumerate(keys):
+            if key not in found:
+                missing.setdefault(key, []).append(i)
+
+        with self._lock:
+            self.stats['hits'] += len(found)
+            self.stats['misses'] += len(missing)
+            self.stats['tokens_saved'] += sum(estimate_tokens(texts[first[key]]) for key in found)
+        return cached, missing
+
+    def _fill(self, cached: List[Optional[np.ndarray]], positions: List[List[int]],
+              miss_texts: List[str], vectors: np.ndarray, seconds: float) -> np.ndarray:
+        with self._lock:
+            self.stats['miss_seconds'] += seconds
+        self.put_many(miss_texts, vectors)
+        for idx, vector in zip(positions, vectors):
+            for i in idx:
+                cached[i] = vector
+        return np.vstack(cached).astype(np.float32, copy=False)
+
+    def get_or_embed(self, texts: List[str], embed_fn: Callable[[List[str]], np.ndarray]) -> np.ndarray:
+        """先查缓存，只对未命中的文本调用 embed_fn（同一批中重复的文本只计算一次）"""
+        cached, missing = self._lookup(texts)
+        if not missing:
+            return np.vstack(cached).astype(np.float32, copy=False)
+        positions = list(missing.values())
+        miss_texts = [texts[idx[0]] for idx in positions]
+        start = time.time()
+        vectors = embed_fn(miss_texts)
+        return self._fill(cached, positions, miss_texts, vectors, time.time() - start)
+
+    async def aget_or_embed(self, texts: List[str],
+                            embed_fn: Callable[[List[str]], Awaitable[np.ndarray]]) -> np.ndarray:
+        """get_or_embed 的异步版本，embed_fn 为协程函数（如 AsyncEmbeddingClient.embed）"""
+        cached, missing = self._lookup(texts)
+        if not missing:
+            return np.vstack(cached).astype(np.float32, copy=False)
+        positions = list(missing.values())
+        miss_texts = [texts[idx[0]] for idx in positions]
+        start = time.time()
+        vectors = await embed_fn(miss_texts)
+        return self._fill(cached, positions, miss_texts, vectors, time.time() - start)
+
+    def summary(self) -> dict:
+        """命中率及估算节省的 token 数与耗时"""
+        with self._lock:
+            stats = dict(self.stats)
+            stats['entries'] = len(self._memory)
+            stats['bytes'] = self._bytes
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = stats['hits'] / lookups if lookups else 0.0
+        avg_miss = stats['miss_seconds'] / stats['misses'] if stats['misses'] else 0.0
+        stats['seconds_saved'] = avg_miss * stats['hits']
+        return stats
+
+    def close(self):
+        with self._db_lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
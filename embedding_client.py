@@ -0,0 +1,309 @@
+import numpy as np
+import requests
+import httpx
+import asyncio
+import base64
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+import logging
+import random
+import threading
+import time
+logger = logging.getLogger(__name__)
+
+
+class EmbeddingError(Exception):
+    """嵌入接口在重试后仍然失败"""
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算 token 数（英文约 4 个字符一个 token，中文约一个字一个 token）"""
+    non_ascii = sum(1 for ch in text if ord(ch) > 127)
+    return (len(text) - non_ascii) // 4 + non_ascii + 1
+
+
+class BaseEmbeddingClient:
+    """嵌入客户端的公共部分：按 token 预算切分批次、重试等待时间和统计计数"""
+    RETRY_STATUS = {429, 500, 502, 503, 504}
+
+    def __init__(self, url: str, api_key: str, model: str,
+                 max_batch_tokens: int = 8192, max_batch_items: int = 64,
+                 max_concurrency: int = 4, timeout: float = 30.0,
+                 max_retries: int = 4, backoff: float = 0.5, max_backoff: float = 30.0,
+                 encoding_format: str = "base64"):
+        if encoding_format not in ("base64", "float"):
+            raise ValueError(f"Unknown encoding_format: {encoding_format}")
+        self.url = url
+        self.api_key = api_key
+        self.model = model
+        self.max_batch_tokens = max_batch_tokens
+        self.max_batch_items = max_batch_items
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.encoding_format = encoding_format
+        self.headers = {
+            "Authorization": f"Bearer {api_key}",
+            "Content-Type": "application/json"
+        }
+
+        self._stats_lock = threading.Lock()
+        self.stats = {
+            'requests': 0,
+            'retries': 0,
+            'rate_limited': 0,
+            'errors': 0,
+            'texts': 0
+        }
+
+    def _count(self, key: str, n: int = 1):
+        with self._stats_lock:
+            self.stats[key] += n
+
+    def make_batches(self, texts: List[str]) -> List[List[int]]:
+        """按 token 预算切分批次，返回每批文本的下标"""
+        batches, current, current_tokens = [], [], 0
+        for i, text in enumerate(texts):
+            tokens = estimate_tokens(text)
+            if current and (current_tokens + tokens > self.max_batch_tokens
+                            or len(current) >= self.max_batch_items):
+                batches.append(current)
+                current, current_tokens = [], 0
+            current.append(i)
+            current_tokens += tokens
+        if current:
+            batches.append(current)
+        return batches
+
+    def _retry_delay(self, attempt: int, status_code: Optional[int], retry_after: Optional[str]) -> float:
+        if status_code == 429 and retry_after:
+            try:
+                return min(float(retry_after), self.max_backoff)
+            except ValueError:
+                pass
+        delay = min(self.backoff * (2 ** attempt), self.max_backoff)
+        # 加入抖动，避免多个批次同时重试
+        return delay * (0.5 + random.random() / 2)
+
+    def _payload(self, batch_texts: List[str]) -> dict:
+        return {
+            "model": self.model,
+            "input": batch_texts,
+            "encoding_format": self.encoding_format
+        }
+
+    @staticmethod
+    def _parse_response(body: dict, expected: int) -> np.ndarray:
+        """把响应中的向量解码到预先分配的 (expected, dim) float32 矩阵
+
+        base64 格式是小端 float32 的原始字节，直接按字节解码，不经过 Python 浮点数列表；
+        接口不支持 base64 而返回 JSON 数组时按数组解析。
+        """
+        data = sorted(body['data'], key=lambda item: item.get('index', 0))
+        if len(data) != expected:
+            raise EmbeddingError(f"expected {expected} embeddings, got {len(data)}")
+        output = None
+        for row, item in enumerate(data):
+            embedding = item['embedding']
+            if isinstance(embedding, str):
+                vector = np.frombuffer(base64.b64decode(embedding), dtype='<f4')
+            else:
+                vector = np.asarray(embedding, dtype=np.float32)
+            if output is None:
+                output = np.empty((expected, len(vector)), dtype=np.float32)
+            output[row] = vector
+        return output
+
+
+class EmbeddingClient(BaseEmbeddingClient):
+    """并发、连接复用、带重试的嵌入接口客户端
+
+    - 所有请求共用一个 keep-alive 的 requests.Session，连接池大小与并发数一致
+    - 按估算的 token 数而不是条数切分批次
+    - 同时最多有 max_concurrency 个批次在途
+    - 每个批次独立重试，指数退避；遇到 429 时优先遵守 Retry-After
+
+    Args:
+        url: 嵌入接口地址，测试时可指向本地桩服务器
+        api_key: API 密钥
+        model: 嵌入模型名
+        max_batch_tokens: 每批最多的估算 token 数
+        max_batch_items: 每批最多的文本条数
+        max_concurrency: 同时在途的批次数
+        timeout: 单个请求的超时（秒）
+        max_retries: 每个批次的最大重试次数
+        backoff: 首次重试的等待时间（秒），之后按 2 倍递增
+        max_backoff: 单次等待的上限（秒）
+        encoding_format: base64（默认，响应体更小、解码更快）或 float
+    """
+    def __init__(self, url: str, api_key: str, model: str, **kwargs):
+        super().__init__(url, api_key, model, **kwargs)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.max_concurrency)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers.update(self.headers)
+        self._executor = ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix="embed")
+
+    def _post_batch(self, batch_texts: List[str]) -> np.ndarray:
+        payload = self._payload(batch_texts)
+        for attempt in range(self.max_retries + 1):
+            response = None
+            try:
+                self._count('requests')
+                response = self.session.post(self.url, json=payload, timeout=self.timeout)
+                if response.status_code not in self.RETRY_STATUS:
+                    response.raise_for_status()
+                    return self._parse_response(response.json(), len(batch_texts))
+                if response.status_code == 429:
+                    self._count('rate_limited')
+                error = f"HTTP {response.status_code}"
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = str(e)
+            except requests.HTTPError as e:
+                # 其余 4xx 属于请求本身的问题，重试无意义
+                self._count('errors')
+                raise EmbeddingError(f"Embedding request rejected: {e}") from e
+
+            if attempt == self.max_retries:
+                break
+            delay = self._retry_delay(attempt, response.status_code if response is not None else None,
+                                      response.headers.get("Retry-After") if response is not None else None)
+            self._count('retries')
+            logger.warning(f"Embedding batch failed ({error}), retrying in {delay:.2f}s "
+                           f"({attempt + 1}/{self.max_retries})")
+            time.sleep(delay)
+
+        self._count('errors')
+        raise EmbeddingError(f"Embedding batch failed after {self.max_retries} retries: {error}")
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        """计算一组文本的向量，返回 (len(texts), dim) 的 float32 矩阵
+
+        Raises:
+            EmbeddingError: 某个批次在重试后仍然失败
+        """
+        if isinstance(texts, str):
+            texts = [texts]
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+        batches = self.make_batches(texts)
+        futures = [
+            self._executor.submit(self._post_batch, [texts[i] for i in batch])
+            for batch in batches
+        ]
+
+        output = None
+        try:
+            for batch, future in zip(batches, futures):
+                vectors = future.result()
+                if output is None:
+                    output = np.empty((len(texts), vectors.shape[1]), dtype=np.float32)
+                output[batch] = vectors
+        except Exception:
+            for future in futures:
+                future.cancel()
+            raise
+        self._count('texts', len(texts))
+        return output
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+        self.session.close()
+
+
+class AsyncEmbeddingClient(BaseEmbeddingClient):
+    """EmbeddingClient 的 asyncio 版本，基于 httpx.AsyncClient
+
+    批次切分、并发上限、重试和 429 处理与 EmbeddingClient 相同，
+    等待网络时不占用线程，适合在异步服务中使用。
+    """
+    def __init__(self, url: str, api_key: str, model: str, **kwargs):
+        super().__init__(url, api_key, model, **kwargs)
+        self.client = httpx.AsyncClient(
+            headers=self.headers,
+            timeout=self.timeout,
+            limits=httpx.Limits(max_connections=self.max_concurrency,
+                                max_keepalive_connections=self.max_concurrency)
+        )
+        self._semaphore = None
+
+    async def _post_batch(self, batch_texts: List[str]) -> np.ndarray:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        payload = self._payload(batch_texts)
+        for attempt in range(self.max_retries + 1):
+            response = None
+            try:
+                self._count('requests')
+                async with self._semaphore:
+                    response = await self.client.post(self.url, json=payload)
+                if response.status_code not in self.RETRY_STATUS:
+                    response.raise_for_status()
+                    return self._parse_response(response.json(), len(batch_texts))
+                if response.status_code == 429:
+                    self._count('rate_limited')
+                error = f"HTTP {response.status_code}"
+            except httpx.TransportError as e:
+                error = str(e) or type(e).__name__
+            except httpx.HTTPStatusError as e:
+                self._count('errors')
+                raise EmbeddingError(f"Embedding request rejected: {e}") from e
+
+            if attempt == self.max_retries:
+                break
+            delay = self._retry_delay(attempt, response.status_code if response is not None else None,
+                                      response.headers.get("Retry-After") if response is not None else None)
+            self._count('retries')
+            logger.warning(f"Embedding batch failed ({error}), retrying in {delay:.2f}s "
+                           f"({attempt + 1}/{self.max_retries})")
+            await asyncio.sleep(delay)
+
+        self._count('errors')
+        raise EmbeddingError(f"Embedding batch failed after {self.max_retries} retries: {error}")
+
+    async def embed(self, texts: List[str]) -> np.ndarray:
+        """计算一组文本的向量，返回 (len(texts), dim) 的 float32 矩阵
+
+        Raises:
+            EmbeddingError: 某个批次在重试后仍然失败
+        """
+        if isinstance(texts, str):
+            texts = [texts]
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+        batches = self.make_batches(texts)
+        results = await asyncio.gather(*(self._post_batch([texts[i] for i in batch]) for batch in batches))
+        output = None
+        for batch, vectors in zip(batches, results):
+            if output is None:
+                output = np.empty((len(texts), vectors.shape[1]), dtype=np.float32)
+            output[batch] = vectors
+        self._count('texts', len(texts))
+        return output
+
+    async def close(self):
+        await self.client.aclose()
+
+
+if __name__ == "__main__":
+    from stub_servers import StubEmbeddingServer
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+    texts = [f"Paragraph {i} about adversarial examples and model extraction attacks. " * 10
+             for i in range(300)]
+    with StubEmbeddingServer(latency=0.05, rate_limit_every=7, fail_every=11) as server:
+        for concurrency in (1, 4, 8):
+            client = EmbeddingClient(server.url, "dummy", "BAAI/bge-large-en-v1.5",
+                                     max_concurrency=concurrency, backoff=0.05)
+            start = time.time()
+            vectors = client.embed(texts)
+            elapsed = time.time() - start
+            print(f"concurrency={concurrency}: {vectors.shape} in {elapsed:.2f}s, stats={client.stats}")
+            client.close()
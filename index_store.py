@@ -0,0 +1,187 @@
+import faiss
+import numpy as np
+from typing import List, Optional
+import os
+import json
+import shutil
+import logging
+import time
+from chunk_store import ChunkStore, TextArena
+from bm25_index import BM25Index
+logger = logging.getLogger(__name__)
+
+# 磁盘格式版本，格式不兼容时递增
+STORE_FORMAT_VERSION = 3
+# 仍可读取并迁移的旧格式版本
+LEGACY_FORMAT_VERSIONS = (2,)
+
+
+class IndexStore:
+    """版本化的磁盘索引存储
+
+    目录结构::
+
+        root/
+          CURRENT            当前版本目录名
+          v000003/
+            info.json        格式版本、向量维度、嵌入模型、分段列表等
+            segment_000.faiss
+            texts.bin / offsets.npy   分块文本
+            doc_ids.npy / pages.npy   每个分块的文档编号和页码
+            documents.json   文档表（标题、文件名）
+            bm25_*.npy / bm25_terms.json   BM25 倒排索引（缺失时由加载方从文本重建）
+            manifest.json    增量导入清单
+            tombstones.npy   已删除的分块编号
+            template.faiss   训练好的空索引（仅 IVF/PQ 类索引）
+
+    每次保存写入一个新的版本目录，写完后原子地替换 CURRENT，读者不会看到写了一半的数据。
+    未改动的分段从上一个版本硬链接过来，不重复写盘。
+    """
+    def __init__(self, root: str, keep_versions: int = 2):
+        self.root = root
+        self.keep_versions = keep_versions
+
+    def current_version(self) -> Optional[str]:
+        path = os.path.join(self.root, 'CURRENT')
+        if not os.path.exists(path):
+            return None
+        with open(path, 'r') as f:
+            version = f.read().strip()
+        return version if os.path.isdir(os.path.join(self.root, version)) else None
+
+    def _next_version(self) -> str:
+        versions = [d for d in os.listdir(self.root) if d.startswith('v') and d[1:].isdigit()]
+        latest = max((int(d[1:]) for d in versions), default=0)
+        return f"v{latest + 1:06d}"
+
+    def save(self, segments: List[faiss.Index], segment_files: List[Optional[str]],
+             chunks: ChunkStore, info: dict,
+             manifest: Optional[dict] = None, tombstones: Optional[np.ndarray] = None,
+             template: Optional[faiss.Index] = None,
+             bm25: Optional[BM25Index] = None) -> List[str]:
+        """保存一个新版本
+
+        Args:
+            segments: 各分段的 FAISS 索引
+            segment_files: 各分段已落盘的文件路径，未改动的分段直接硬链接，None 表示需要重新写出
+            chunks: 分块存储
+            info: 额外写入 info.json 的信息
+            manifest: 增量导入清单
+            tombstones: 已删除的分块编号
+            template: 训练好的空索引，新分段从它克隆
+            bm25: 与分块编号对齐的 BM25 倒排索引
+        Returns:
+            新版本中各分段的文件路径
+        """
+        os.makedirs(self.root, exist_ok=True)
+        version = self._next_version()
+        tmp_dir = os.path.join(self.root, f".{version}.tmp")
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+
+        names = []
+        for i, (segment, src) in enumerate(zip(segments, segment_files)):
+            name = f"segment_{i:03d}.faiss"
+            dst = os.path.join(tmp_dir, name)
+            if src is not None and os.path.exists(src):
+                try:
+                    os.link(src, dst)
+                except OSError:
+                    shutil.copyfile(src, dst)
+            else:
+                faiss.write_index(segment, dst)
+            names.append(name)
+
+        chunks.write(tmp_dir)
+        if bm25 is not None:
+            bm25.write(tmp_dir)
+        with open(os.path.join(tmp_dir, 'manifest.json'), 'w', encoding='utf-8') as f:
+            json.dump(manifest or {}, f, ensure_ascii=False)
+        np.save(os.path.join(tmp_dir, 'tombstones.npy'),
+                np.asarray(tombstones if tombstones is not None else [], dtype=np.int64))
+        if template is not None:
+            faiss.write_index(template, os.path.join(tmp_dir, 'template.faiss'))
+
+        info = dict(info)
+        info.update({
+            'format_version': STORE_FORMAT_VERSION,
+            'ntotal': len(chunks),
+            'segments': names,
+            'created': time.time()
+        })
+        with open(os.path.join(tmp_dir, 'info.json'), 'w', encoding='utf-8') as f:
+            json.dump(info, f, ensure_ascii=False, indent=2)
+
+        version_dir = os.path.join(self.root, version)
+        os.rename(tmp_dir, version_dir)
+        current_tmp = os.path.join(self.root, 'CURRENT.tmp')
+        with open(current_tmp, 'w') as f:
+            f.write(version)
+        os.replace(current_tmp, os.path.join(self.root, 'CURRENT'))
+        logger.info(f"Saved index store version {version} with {len(chunks)} chunks")
+
+        self._prune(version)
+        return [os.path.join(version_dir, name) for name in names]
+
+    def _prune(self, current: str):
+        """删除过旧的版本；已 mmap 这些文件的进程不受影响"""
+        versions = sorted(d for d in os.listdir(self.root) if d.startswith('v') and d[1:].isdigit())
+        for old in versions[:-self.keep_versions]:
+            if old != current:
+                shutil.rmtree(os.path.join(self.root, old), ignore_errors=True)
+
+    def load(self, mmap: bool = True) -> Optional[dict]:
+        """加载当前版本
+
+        Returns:
+            包含 info、segments、segment_files、chunks、manifest、tombstones、template、bm25 的字典；
+            无可用版本时返回 None
+        """
+        version = self.current_version()
+        if version is None:
+            return None
+        version_dir = os.path.join(self.root, version)
+        with open(os.path.join(version_dir, 'info.json'), 'r', encoding='utf-8') as f:
+            info = json.load(f)
+        if info.get('format_version') not in (STORE_FORMAT_VERSION,) + LEGACY_FORMAT_VERSIONS:
+            logger.warning(f"Index store format {info.get('format_version')} is not supported, ignoring {version_dir}")
+            return None
+
+        segments, segment_files = [], []
+        for name in info['segments']:
+            path = os.path.join(version_dir, name)
+            segments.append(self._read_index(path, mmap))
+            segment_files.append(path)
+        with open(os.path.join(version_dir, 'manifest.json'), 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        if info['format_version'] == STORE_FORMAT_VERSION:
+            chunks = ChunkStore.open(version_dir, mmap=mmap)
+        else:
+            logger.info(f"Migrating index store {version_dir} from format {info['format_version']}")
+            texts = TextArena.open(os.path.join(version_dir, 'texts.bin'),
+                                   os.path.join(version_dir, 'offsets.npy'), mmap=mmap)
+            chunks = ChunkStore.from_manifest(texts, manifest)
+        tombstones = np.load(os.path.join(version_dir, 'tombstones.npy'))
+        bm25 = BM25Index.open(version_dir, mmap=mmap)
+        template_path = os.path.join(version_dir, 'template.faiss')
+        template = faiss.read_index(template_path) if os.path.exists(template_path) else None
+        logger.info(f"Loaded index store version {version} with {len(chunks)} chunks")
+        return {
+            'info': info,
+            'segments': segments,
+            'segment_files': segment_files,
+            'chunks': chunks,
+            'manifest': manifest,
+            'tombstones': tombstones,
+            'template': template,
+            'bm25': bm25
+        }
+
+    @staticmethod
+    def _read_index(path: str, mmap: bool) -> faiss.Index:
+        if mmap:
+            try:
+                return faiss.read_index(path, faiss.IO_FLAG_MMAP_IFC | faiss.IO_FLAG_READ_ONLY)
+            except (AttributeError, RuntimeError) as e:
+                logger.debug(f"mmap read not supported for {path}, falling back to full read: {e}")
+        return faiss.read_index(path)
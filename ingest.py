@@ -0,0 +1,275 @@
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+import time
+import numpy as np
+from metrics import stage_metrics
+from parse_cache import ParseCache
+from pdf_extract import PdfExtractor, PyPDF2Extractor
+from rag import SecurityRAGSystem
+logger = logging.getLogger(__name__)
+
+# 队列结束标记
+_DONE = object()
+
+
+def parse_pdf_pages(pdf_path: str, start_page: int = 0, end_page: Optional[int] = None,
+                    extractor: Optional[PdfExtractor] = None, cache_dir: Optional[str] = None,
+                    sha256: Optional[str] = None) -> tuple:
+    """在工作进程中解析PDF的一段页码 [start_page, end_page) 并切分段落
+
+    整篇解析时由 iter_pages 读写解析缓存；按页码范围解析时只读缓存，未命中则把新解析的页一并返回，
+    由调用方在整篇文档的各段都完成后写入缓存。sha256 为调用方已算出的文件内容哈希，各段任务不再重复读文件计算。
+
+    Returns:
+        (文件路径, 起始页, 标题, 分块列表, 新解析的页文本或 None)；标题只有包含第一页的任务才有，其余为 None
+    """
+    extractor = extractor or PyPDF2Extractor()
+    parse_cache = ParseCache(cache_dir) if cache_dir else None
+    chunks, pages, doc_title = [], [], None
+    ranged = start_page != 0 or end_page is not None
+    # 标题只由处理第一页的任务提取，与该任务是否切出有效分块无关
+    for page_num, title, text in SecurityRAGSystem.iter_pages(pdf_path, extractor, parse_cache, start_page,
+                                                              end_page, sha256):
+        if parse_cache is not None and ranged:
+            pages.append(text)
+        doc_title = doc_title or title
+        chunks.extend({'text': para, 'page': page_num, 'title': title}
+                      for para in SecurityRAGSystem.iter_paragraphs(text))
+    parsed = parse_cache is not None and ranged and parse_cache.stats['misses'] > 0
+    return pdf_path, start_page, doc_title, chunks, pages if parsed else None
+
+
+class _WindowStream:
+    """一篇文档从向量化线程流向写入线程的窗口序列
+
+    向量化线程依次放入 (保留的分块, 向量, 跳过的近重复数)，最后放入 _DONE 或向量化时的异常；
+    迭代时产生 (分块, 向量)，遇到异常则抛出。容量很小，峰值内存只与 ingest_window 有关。
+    """
+    def __init__(self, maxsize: int = 2):
+        self._queue = queue.Queue(maxsize=maxsize)
+        self.duplicates = 0
+        self.finished = False
+
+    def put(self, item):
+        self._queue.put(item)
+
+    def __iter__(self) -> Iterator[Tuple[List[dict], np.ndarray]]:
+        while not self.finished:
+            item = self._queue.get()
+            if item is _DONE or isinstance(item, Exception):
+                self.finished = True
+                if item is not _DONE:
+                    raise item
+                return
+            kept, vectors, duplicates = item
+            self.duplicates += duplicates
+            if kept:
+                yield kept, vectors
+
+    def drain(self):
+        while not self.finished:
+            item = self._queue.get()
+            self.finished = item is _DONE or isinstance(item, Exception)
+
+
+class ParallelIngestor:
+    """多进程解析、流水线式导入PDF
+
+    解析在进程池中并行进行（按文件，或按页码范围进一步切分大文件）；
+    每篇文档的所有页解析完成后立即进入向量化线程，按 ingest_window 为窗口逐批去重、向量化，
+    每个窗口向量化完成后由唯一的写入线程插入索引，文档中途失败时撤销已写入的窗口。
+    三个阶段通过有界队列衔接、相互重叠，而不是依次整体完成。
+
+    Args:
+        rag_system: 目标 SecurityRAGSystem
+        workers: 解析进程数，默认等于CPU核数
+        pages_per_task: 每个解析任务的页数，0 表示每个文件一个任务
+        embed_threads: 并行向量化的文档数
+        queue_size: 阶段之间队列的容量
+        mp_context: 进程启动方式（如 'forkserver'），在多线程的服务进程中导入时避免直接 fork
+    """
+    def __init__(self, rag_system: SecurityRAGSystem, workers: Optional[int] = None,
+                 pages_per_task: int = 0, embed_threads: int = 2, queue_size: int = 8,
+                 mp_context: Optional[str] = None):
+        self.rag_system = rag_system
+        self.workers = workers or os.cpu_count() or 1
+        self.pages_per_task = pages_per_task
+        self.embed_threads = embed_threads
+        self.queue_size = queue_size
+        self.mp_context = multiprocessing.get_context(mp_context) if mp_context else None
+
+    def _make_tasks(self, todo: Dict[str, str]) -> Dict[str, List[Tuple[int, Optional[int]]]]:
+        tasks = {}
+        for pdf_path in todo:
+            if self.pages_per_task <= 0:
+                tasks[pdf_path] = [(0, None)]
+                continue
+            try:
+                n_pages = self.rag_system.extractor.page_count(pdf_path)
+            except Exception as e:
+                logger.error(f"Error reading PDF {pdf_path}: {e}")
+                self.rag_system.record_empty(pdf_path, error=f"{type(e).__name__}: {e}", sha256=todo[pdf_path])
+                continue
+            tasks[pdf_path] = [(start, start + self.pages_per_task)
+                               for start in range(0, max(n_pages, 1), self.pages_per_task)]
+        return tasks
+
+    def _embed_loop(self, parsed: queue.Queue, embedded: queue.Queue):
+        try:
+            while True:
+                item = parsed.get()
+                if item is _DONE:
+                    return
+                pdf_path, sha256, title, chunks = item
+                # 文档按 ingest_window 为窗口逐批去重、向量化，写入线程边收边写，不必等整篇向量化完成
+                stream = _WindowStream()
+                embedded.put((pdf_path, sha256, title, stream))
+                window_size = self.rag_system.ingest_window
+                try:
+                    for start in range(0, len(chunks), window_size):
+                        window = chunks[start:start + window_size]
+                        with stage_metrics.time('dedup'):
+                            kept = self.rag_system.deduplicate(pdf_path, window)
+                        vectors = None
+                        if kept:
+                            with stage_metrics.time('ingest_embed'):
+                                vectors = self.rag_system.encode_text([chunk['text'] for chunk in kept])
+                            if vectors is None:
+                                raise RuntimeError("embedding failed")
+                        stream.put((kept, vectors, len(window) - len(kept)))
+                except Exception as e:
+                    # 单篇文档失败不影响其他文档：写入线程撤销已写入的窗口，本线程继续消费队列
+                    logger.error(f"Failed to embed {pdf_path}, skipping: {e}")
+                    stream.put(e)
+                    continue
+                stream.put(_DONE)
+        finally:
+            embedded.put(_DONE)
+
+    def _insert_loop(self, embedded: queue.Queue, stats: dict,
+                     on_inserted: Optional[Callable[[str, int], None]] = None):
+        finished = 0
+        while finished < self.embed_threads:
+            item = embedded.get()
+            if item is _DONE:
+                finished += 1
+                continue
+            pdf_path, sha256, title, stream = item
+            try:
+                n_chunks = self.rag_system.insert_windows(pdf_path, stream, title=title, sha256=sha256)
+            except Exception as e:
+                # 如向量化失败或导入过程中文件被删除；已写入的窗口已撤销，未写入的文档计入 failed
+                logger.error(f"Failed to insert {pdf_path}, skipping: {e}")
+                # 读完剩余的窗口，避免向量化线程阻塞在这篇文档上
+                stream.drain()
+                continue
+            stats['added'] += 1
+            stats['chunks'] += n_chunks
+            stats['duplicates'] += stream.duplicates
+            if on_inserted is not None:
+                try:
+                    on_inserted(pdf_path, n_chunks)
+                except Exception as e:
+                    logger.error(f"on_inserted callback failed for {pdf_path}: {e}")
+
+    def ingest(self, pdf_paths: List[str],
+               on_inserted: Optional[Callable[[str, int], None]] = None) -> dict:
+        """导入一组PDF（未变的文件按清单跳过）
+
+        Args:
+            pdf_paths: PDF路径列表
+            on_inserted: 每篇文档写入索引后的回调，参数为 (路径, 分块数)
+        Returns:
+            统计信息：added、chunks、duplicates（跳过的近重复分块数）、failed、
+            empty（没有有效文本或解析失败、以空分块区间记入清单的文档数，包含在 failed 中）、seconds
+        """
+        start_time = time.time()
+        stats = {'added': 0, 'chunks': 0, 'duplicates': 0, 'failed': 0, 'empty': 0, 'seconds': 0.0}
+        # 路径 -> prepare_ingest 算出的内容哈希，之后解析缓存和清单记录都直接使用
+        todo = {}
+        for path in pdf_paths:
+            prepared = self.rag_system.prepare_ingest(path)
+            if prepared is not None:
+                todo[path] = prepared[1]
+        if not todo:
+            return stats
+        tasks = self._make_tasks(todo)
+        stats['empty'] = len(todo) - len(tasks)
+
+        parsed = queue.Queue(maxsize=self.queue_size)
+        embedded = queue.Queue(maxsize=self.queue_size)
+        embedders = [threading.Thread(target=self._embed_loop, args=(parsed, embedded), daemon=True)
+                     for _ in range(self.embed_threads)]
+        inserter = threading.Thread(target=self._insert_loop, args=(embedded, stats, on_inserted), daemon=True)
+        for thread in embedders + [inserter]:
+            thread.start()
+
+        pending_parts = {path: len(ranges) for path, ranges in tasks.items()}
+        parts: Dict[str, List[tuple]] = {path: [] for path in tasks}
+        task_iter = ((path, start, end) for path, ranges in tasks.items() for start, end in ranges)
+        parse_cache = self.rag_system.parse_cache
+        parse_args = (self.rag_system.extractor, parse_cache.cache_dir if parse_cache is not None else None)
+        try:
+            with ProcessPoolExecutor(max_workers=self.workers, mp_context=self.mp_context) as pool:
+                # 同时在途的任务数有上限，避免解析结果堆积在内存中
+                in_flight = {}
+                for path, start, end in task_iter:
+                    in_flight[pool.submit(parse_pdf_pages, path, start, end, *parse_args, todo[path])] = path
+                    if len(in_flight) >= self.workers * 2:
+                        break
+                while in_flight:
+                    done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        path = in_flight.pop(future)
+                        for path_next, start, end in task_iter:
+                            in_flight[pool.submit(parse_pdf_pages, path_next, start, end, *parse_args,
+                                                  todo[path_next])] = path_next
+                            break
+                        if path not in pending_parts:
+                            continue
+                        try:
+                            _, start, title, chunks, new_pages = future.result()
+                        except Exception as e:
+                            logger.error(f"Error reading PDF {path}: {e}")
+                            pending_parts.pop(path)
+                            parts.pop(path)
+                            # 解析失败的文件在内容改变之前不再重试
+                            self.rag_system.record_empty(path, error=f"{type(e).__name__}: {e}",
+                                                         sha256=todo[path])
+                            stats['empty'] += 1
+                            continue
+                        parts[path].append((start, title, chunks, new_pages))
+                        pending_parts[path] -= 1
+                        if pending_parts[path] == 0:
+                            pending_parts.pop(path)
+                            done_parts = sorted(parts.pop(path), key=lambda p: p[0])
+                            # 标题明确取自从第一页开始的任务，不依赖第一个分块来自哪一段
+                            title = next((t for start, t, _, _ in done_parts if start == 0), None)
+                            chunks = [chunk for _, _, part, _ in done_parts for chunk in part]
+                            if parse_cache is not None and all(p[3] is not None for p in done_parts):
+                                # 按页码范围解析的文档，各段都完成后拼成整篇写入解析缓存
+                                parse_cache.put(path, self.rag_system.extractor, title,
+                                                [page for _, _, _, pages in done_parts for page in pages],
+                                                todo[path])
+                            if chunks:
+                                logger.info(f"Parsed {len(chunks)} chunks from {path}")
+                                parsed.put((path, todo[path], title, chunks))
+                            else:
+                                logger.warning(f"No valid text extracted from {path}")
+                                self.rag_system.record_empty(path, sha256=todo[path])
+                                stats['empty'] += 1
+        finally:
+            for _ in embedders:
+                parsed.put(_DONE)
+            for thread in embedders + [inserter]:
+                thread.join()
+
+        stats['failed'] = len(todo) - stats['added']
+        stats['seconds'] = time.time() - start_time
+        logger.info(f"Parallel ingestion finished: {stats}")
+        return stats
@@ -0,0 +1,169 @@
+from typing import List, Optional
+import logging
+import os
+import queue
+import threading
+import time
+from ingest import ParallelIngestor
+logger = logging.getLogger(__name__)
+
+
+class IngestWorker:
+    """后台导入线程：监视论文目录并接收上传的路径，在请求路径之外构建索引分段
+
+    每篇文档的向量先写入一个新分段，建好后由 SecurityRAGSystem 原子地发布，
+    检索在导入过程中不受阻塞；每轮导入结束后删除已不存在的论文并保存一个新版本。
+
+    Args:
+        rag_system: 目标 SecurityRAGSystem
+        papers_dir: 监视的论文目录
+        poll_interval: 扫描目录的间隔（秒）
+        workers: 解析PDF的进程数，None 表示使用全部CPU核
+        save: 每轮导入后是否保存到磁盘存储
+    """
+    def __init__(self, rag_system, papers_dir: str, poll_interval: float = 5.0,
+                 workers: Optional[int] = None, save: bool = True):
+        self.rag_system = rag_system
+        self.papers_dir = papers_dir
+        self.poll_interval = poll_interval
+        self.save = save and rag_system.store is not None
+        self.ingestor = ParallelIngestor(rag_system, workers=workers, mp_context='forkserver')
+        self._submitted: "queue.Queue[str]" = queue.Queue()
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._status = {
+            'state': 'idle',
+            'queued': 0,
+            'in_progress': [],
+            'documents_added': 0,
+            'documents_removed': 0,
+            'documents_failed': 0,
+            'chunks_added': 0,
+            'chunks_deduplicated': 0,
+            'rounds': 0,
+            'last_round_seconds': 0.0,
+            'last_scan': None,
+            'last_error': None
+        }
+
+    def start(self):
+        self._thread = threading.Thread(target=self._loop, name="ingest-worker", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout: Optional[float] = None):
+        self._stop.set()
+        self._submitted.put(None)
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def submit(self, pdf_path: str):
+        """提交一个PDF路径，下一轮导入时处理"""
+        self._submitted.put(pdf_path)
+        with self._lock:
+            self._status['queued'] += 1
+
+    def status(self) -> dict:
+        """导入进度，供 /v1/ingest/status 返回"""
+        with self._lock:
+            status = dict(self._status)
+            status['in_progress'] = list(status['in_progress'])
+        view = self.rag_system._view
+        status['chunks_total'] = view.ntotal
+        status['chunks_deleted'] = len(view.tombstones)
+        status['segments'] = len(view.segments)
+        status['documents'] = len(self.rag_system.manifest)
+        return status
+
+    def _update(self, **kwargs):
+        with self._lock:
+            self._status.update(kwargs)
+
+    def _on_inserted(self, pdf_path: str, n_chunks: int):
+        with self._lock:
+            self._status['chunks_added'] += n_chunks
+            if pdf_path in self._status['in_progress']:
+                self._status['in_progress'].remove(pdf_path)
+
+    def _drain_submitted(self, timeout: float) -> List[str]:
+        """等待上传的路径或扫描间隔到期，返回本轮需要处理的上传路径"""
+        paths = []
+        try:
+            item = self._submitted.get(timeout=timeout)
+            while True:
+                if item is not None:
+                    paths.append(item)
+                item = self._submitted.get_nowait()
+        except queue.Empty:
+            pass
+        return paths
+
+    def _scan(self) -> List[str]:
+        if not os.path.isdir(self.papers_dir):
+            return []
+        return [os.path.join(self.papers_dir, file) for file in sorted(os.listdir(self.papers_dir))
+                if file.endswith('.pdf')]
+
+    def run_once(self, submitted: Optional[List[str]] = None) -> dict:
+        """执行一轮：扫描目录、导入新增和修改的论文、删除已不存在的论文，并保存"""
+        start = time.time()
+        submitted = submitted or []
+        scanned = self._scan()
+        present = set(os.path.normpath(path) for path in scanned)
+        # 清单状态判断只比较 mtime 和大小，未变的文件不会被读取
+        todo = [path for path in dict.fromkeys(scanned + submitted)
+                if os.path.exists(path) and self.rag_system.needs_ingest(path)]
+        self._update(state='ingesting' if todo else 'scanning', in_progress=list(todo),
+                     last_scan=time.time(), queued=self._submitted.qsize())
+
+        stats = {'added': 0, 'failed': 0, 'empty': 0, 'removed': 0, 'duplicates': 0}
+        try:
+            if todo:
+                result = self.ingestor.ingest(todo, on_inserted=self._on_inserted)
+                for key in ('added', 'failed', 'empty', 'duplicates'):
+                    stats[key] = result[key]
+
+            papers_root = os.path.normpath(self.papers_dir)
+            for path in self.rag_system.manifest_paths():
+                if os.path.dirname(path) == papers_root and path not in present:
+                    if self.rag_system.remove_document(path):
+                        stats['removed'] += 1
+
+            # 没有有效文本或解析失败的文件也已记入清单，保存后重启时同样不再解析
+            if self.save and (stats['added'] or stats['removed'] or stats['empty']):
+                self._update(state='saving')
+                self.rag_system.save()
+        except Exception as e:
+            # 本轮失败不影响后台线程：记录错误，未入清单的文件在下一轮轮询时重试
+            logger.error(f"Ingest round failed: {e}")
+            with self._lock:
+                self._status['rounds'] += 1
+                self._status['in_progress'] = []
+                self._status['last_error'] = str(e)
+                self._status['state'] = 'error'
+            return stats
+
+        with self._lock:
+            self._status['documents_added'] += stats['added']
+            self._status['documents_removed'] += stats['removed']
+            self._status['documents_failed'] += stats['failed']
+            self._status['chunks_deduplicated'] += stats['duplicates']
+            self._status['rounds'] += 1
+            self._status['in_progress'] = []
+            if todo or stats['removed']:
+                self._status['last_round_seconds'] = time.time() - start
+            self._status['state'] = 'idle'
+        if todo or stats['removed']:
+            logger.info(f"Ingest round finished: {stats}")
+        return stats
+
+    def _loop(self):
+        submitted = []
+        while not self._stop.is_set():
+            try:
+                self.run_once(submitted)
+            except Exception as e:
+                logger.error(f"Error in ingest worker: {e}")
+                self._update(state='idle', in_progress=[], last_error=str(e))
+            submitted = self._drain_submitted(self.poll_interval)
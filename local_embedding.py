@@ -0,0 +1,157 @@
+import numpy as np
+from typing import List, Optional
+import argparse
+import os
+import threading
+import logging
+logger = logging.getLogger(__name__)
+
+
+class OnnxEmbeddingClient:
+    """本地 CPU 嵌入后端：用 ONNX Runtime 运行导出的 bge 模型，可直接替换 EmbeddingClient
+
+    嵌入后端只需提供 model（模型名，用作嵌入缓存和导入清单的键）、dimension、
+    embed(texts) -> (n, dim) float32 矩阵以及 close()。
+
+    model_dir 中需要 model.onnx（或 int8 量化后的 model_quantized.onnx）和 tokenizer.json，
+    例如用 optimum 导出：optimum-cli export onnx --model BAAI/bge-large-en-v1.5 models/bge-large-en-v1.5，
+    再用 python local_embedding.py quantize models/bge-large-en-v1.5 生成 int8 模型。
+
+    一次 embed 中的文本先分词并按长度排序，再按补齐后的 token 预算组成批次，
+    长度相近的文本在同一批，补齐浪费的计算最少。
+
+    依赖 onnxruntime 和 tokenizers（pip install onnxruntime tokenizers）。
+
+    Args:
+        model_dir: 模型目录
+        model: 模型名，默认为目录名；与远程模型相同时可以共用已有索引
+        threads: ONNX Runtime 的算子内线程数，None 表示使用全部CPU核
+        max_length: 最大序列长度，超出部分截断
+        max_batch_tokens: 每批补齐后的最多 token 数（批大小 × 批内最长序列）
+        max_batch_items: 每批最多的文本条数
+        quantized: 优先加载 model_quantized.onnx
+        pooling: cls（bge 系列）或 mean
+    """
+    def __init__(self, model_dir: str, model: Optional[str] = None, threads: Optional[int] = None,
+                 max_length: int = 512, max_batch_tokens: int = 16384, max_batch_items: int = 32,
+                 quantized: bool = False, pooling: str = 'cls'):
+        try:
+            import onnxruntime
+            from tokenizers import Tokenizer
+        except ImportError as e:
+            raise ImportError("The onnx embedding backend requires onnxruntime and tokenizers: "
+                              "pip install onnxruntime tokenizers") from e
+        if pooling not in ('cls', 'mean'):
+            raise ValueError(f"Unknown pooling: {pooling}")
+        self.model = model or os.path.basename(os.path.normpath(model_dir))
+        self.max_length = max_length
+        self.max_batch_tokens = max_batch_tokens
+        self.max_batch_items = max_batch_items
+        self.pooling = pooling
+
+        model_path = os.path.join(model_dir, 'model.onnx')
+        quantized_path = os.path.join(model_dir, 'model_quantized.onnx')
+        if quantized and os.path.exists(quantized_path):
+            model_path = quantized_path
+        elif quantized:
+            logger.warning(f"{quantized_path} not found, using {model_path}")
+        options = onnxruntime.SessionOptions()
+        if threads:
+            options.intra_op_num_threads = threads
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = onnxruntime.InferenceSession(model_path, options, providers=['CPUExecutionProvider'])
+        self._input_names = {i.name for i in self.session.get_inputs()}
+        self._output_names = [o.name for o in self.session.get_outputs()]
+
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_dir, 'tokenizer.json'))
+        self.tokenizer.enable_truncation(max_length)
+        self.tokenizer.no_padding()
+
+        self._stats_lock = threading.Lock()
+        self.stats = {'batches': 0, 'texts': 0, 'tokens': 0, 'padded_tokens': 0}
+        hidden = self.session.get_outputs()[0].shape[-1]
+        self.dimension = hidden if isinstance(hidden, int) else len(self.embed(["dimension probe"])[0])
+        logger.info(f"Loaded local embedding model {model_path} (dim={self.dimension})")
+
+    def make_batches(self, lengths: List[int]) -> List[List[int]]:
+        """按长度降序排列后切分批次，返回每批文本的下标；补齐后的 token 数不超过 max_batch_tokens"""
+        order = sorted(range(len(lengths)), key=lambda i: -lengths[i])
+        batches, current = [], []
+        for i in order:
+            # 降序排列，批内最长的是第一条
+            longest = lengths[current[0]] if current else lengths[i]
+            if current and ((len(current) + 1) * longest > self.max_batch_tokens
+                            or len(current) >= self.max_batch_items):
+                batches.append(current)
+                current = []
+            current.append(i)
+        if current:
+            batches.append(current)
+        return batches
+
+    def _run(self, encodings: list) -> np.ndarray:
+        width = max(len(encoding.ids) for encoding in encodings)
+        input_ids = np.zeros((len(encodings), width), dtype=np.int64)
+        attention_mask = np.zeros((len(encodings), width), dtype=np.int64)
+        for row, encoding in enumerate(encodings):
+            input_ids[row, :len(encoding.ids)] = encoding.ids
+            attention_mask[row, :len(encoding.ids)] = 1
+        feeds = {'input_ids': input_ids, 'attention_mask': attention_mask}
+        if 'token_type_ids' in self._input_names:
+            feeds['token_type_ids'] = np.zeros_like(input_ids)
+        if 'sentence_embedding' in self._output_names:
+            return self.session.run(['sentence_embedding'], feeds)[0]
+        hidden = self.session.run([self._output_names[0]], feeds)[0]
+        if self.pooling == 'cls':
+            return hidden[:, 0]
+        mask = attention_mask[:, :, None].astype(np.float32)
+        return (hidden * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1.0)
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        """计算一组文本的向量，返回 (len(texts), dim) 的 float32 矩阵，已做 L2 归一化"""
+        if isinstance(texts, str):
+            texts = [texts]
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+        encodings = self.tokenizer.encode_batch(texts)
+        lengths = [len(encoding.ids) for encoding in encodings]
+        output = None
+        padded = 0
+        batches = self.make_batches(lengths)
+        for batch in batches:
+            vectors = self._run([encodings[i] for i in batch])
+            if output is None:
+                output = np.empty((len(texts), vectors.shape[1]), dtype=np.float32)
+            output[batch] = vectors
+            padded += len(batch) * lengths[batch[0]]
+        output /= np.maximum(np.linalg.norm(output, axis=1, keepdims=True), 1e-12)
+        with self._stats_lock:
+            self.stats['batches'] += len(batches)
+            self.stats['texts'] += len(texts)
+            self.stats['tokens'] += sum(lengths)
+            self.stats['padded_tokens'] += padded
+        return output
+
+    def close(self):
+        pass
+
+
+def quantize_model(model_dir: str) -> str:
+    """把 model_dir/model.onnx 动态量化为 int8 权重，写入 model_quantized.onnx 并返回其路径"""
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+    src = os.path.join(model_dir, 'model.onnx')
+    dst = os.path.join(model_dir, 'model_quantized.onnx')
+    quantize_dynamic(src, dst, weight_type=QuantType.QInt8)
+    logger.info(f"Quantized {src} -> {dst}")
+    return dst
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="本地嵌入模型工具")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    quantize = subparsers.add_parser('quantize', help="把 model.onnx 量化为 int8 的 model_quantized.onnx")
+    quantize.add_argument('model_dir')
+    args = parser.parse_args()
+    if args.command == 'quantize':
+        quantize_model(args.model_dir)
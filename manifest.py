@@ -0,0 +1,126 @@
+from typing import Dict, List, Optional, Tuple
+import os
+import hashlib
+import logging
+import time
+logger = logging.getLogger(__name__)
+
+
+def file_sha256(path: str, block_size: int = 1 << 20) -> str:
+    """计算文件内容的 SHA-256"""
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+class IngestManifest:
+    """增量导入清单
+
+    为每个已导入的PDF记录内容哈希、修改时间、文件大小、分块编号区间 [chunk_start, chunk_end)
+    以及使用的嵌入模型，据此判断文件是新增、未变、已修改还是已删除。
+    导入时因近重复而跳过的分块，其来源文档记录在 dedup_sources 中。
+    """
+    NEW = 'new'
+    UNCHANGED = 'unchanged'
+    MODIFIED = 'modified'
+
+    def __init__(self, entries: Optional[Dict[str, dict]] = None):
+        self.entries: Dict[str, dict] = entries or {}
+
+    @staticmethod
+    def _key(path: str) -> str:
+        return os.path.normpath(path)
+
+    def __contains__(self, path: str) -> bool:
+        return self._key(path) in self.entries
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def get(self, path: str) -> Optional[dict]:
+        return self.entries.get(self._key(path))
+
+    def paths(self) -> List[str]:
+        return list(self.entries)
+
+    def status(self, path: str, embed_model: str) -> Tuple[str, Optional[str]]:
+        """判断文件状态
+
+        修改时间和大小都没变时直接视为未变，不读取文件内容；否则比较内容哈希。
+
+        Returns:
+            (状态, 内容哈希)，未计算哈希时第二项为 None
+        """
+        entry = self.get(path)
+        if entry is None:
+            return self.NEW, None
+        stat = os.stat(path)
+        if entry['embed_model'] != embed_model or entry.get('stale'):
+            return self.MODIFIED, None
+        if entry['mtime'] == stat.st_mtime and entry['size'] == stat.st_size:
+            return self.UNCHANGED, entry['sha256']
+        sha256 = file_sha256(path)
+        if sha256 == entry['sha256']:
+            # 只是被touch过，更新修改时间即可
+            entry['mtime'] = stat.st_mtime
+            entry['size'] = stat.st_size
+            return self.UNCHANGED, sha256
+        return self.MODIFIED, sha256
+
+    def changed(self, path: str, embed_model: str) -> bool:
+        """只比较修改时间和大小（不读取文件内容），判断文件是否可能是新增或已修改
+
+        被 touch 过而内容未变的文件也返回 True，由 status 比较内容哈希确认。
+        """
+        entry = self.get(path)
+        if entry is None or entry['embed_model'] != embed_model or entry.get('stale'):
+            return True
+        stat = os.stat(path)
+        return entry['mtime'] != stat.st_mtime or entry['size'] != stat.st_size
+
+    def record(self, path: str, chunk_start: int, chunk_end: int, embed_model: str,
+               sha256: Optional[str] = None, dedup_sources: Optional[List[str]] = None,
+               error: Optional[str] = None):
+        stat = os.stat(path)
+        self.entries[self._key(path)] = {
+            'sha256': sha256 or file_sha256(path),
+            'mtime': stat.st_mtime,
+            'size': stat.st_size,
+            'chunk_start': chunk_start,
+            'chunk_end': chunk_end,
+            'embed_model': embed_model,
+            'dedup_sources': dedup_sources or [],
+            'ingested_at': time.time()
+        }
+        if error is not None:
+            self.entries[self._key(path)]['error'] = error
+
+    def invalidate_dependents(self, path: str) -> List[str]:
+        """path 被删除后，跳过了与它重复的分块的文档缺少这部分内容，标记为需要重新导入
+
+        Returns:
+            被标记的文档路径
+        """
+        key = self._key(path)
+        dependents = [other for other, entry in self.entries.items() if key in entry.get('dedup_sources', ())]
+        for other in dependents:
+            self.entries[other]['stale'] = True
+        return dependents
+
+    def remove(self, path: str) -> Optional[dict]:
+        return self.entries.pop(self._key(path), None)
+
+    def remap(self, mapping):
+        """压缩后按新编号更新分块区间，mapping 将旧编号映射为新编号"""
+        for entry in self.entries.values():
+            start, end = mapping(entry['chunk_start']), mapping(entry['chunk_end'])
+            entry['chunk_start'], entry['chunk_end'] = int(start), int(end)
+
+    def to_dict(self) -> Dict[str, dict]:
+        return self.entries
+
+    @classmethod
+    def from_dict(cls, entries: Dict[str, dict]) -> "IngestManifest":
+        return cls(dict(entries))
@@ -0,0 +1,147 @@
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+import bisect
+import threading
+import time
+import logging
+logger = logging.getLogger(__name__)
+
+# 直方图的桶上限（秒），覆盖从亚毫秒的索引搜索到数十秒的整篇PDF导入
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class Histogram:
+    """固定桶的累计直方图，observe 只做一次二分查找和加法"""
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[i] += 1
+            self._sum += value
+
+    def snapshot(self) -> Tuple[List[int], float, int]:
+        """返回 (每个桶的累计计数, 总和, 总数)"""
+        with self._lock:
+            counts, total = list(self._counts), self._sum
+        cumulative, running = [], 0
+        for count in counts:
+            running += count
+            cumulative.append(running)
+        return cumulative, total, running
+
+
+class StageMetrics:
+    """各处理阶段（查询向量化、索引搜索、组装提示词、上游 LLM、PDF 解析等）的耗时直方图
+
+    用法：
+        with stage_metrics.time('dense_search'):
+            ...
+    """
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self._histograms: Dict[str, Histogram] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, stage: str, seconds: float):
+        histogram = self._histograms.get(stage)
+        if histogram is None:
+            with self._lock:
+                histogram = self._histograms.setdefault(stage, Histogram(self.buckets))
+        histogram.observe(seconds)
+
+    @contextmanager
+    def time(self, stage: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    def summary(self) -> dict:
+        """每个阶段的调用次数和平均耗时（秒）"""
+        result = {}
+        for stage, histogram in sorted(self._histograms.items()):
+            _, total, count = histogram.snapshot()
+            result[stage] = {'count': count, 'mean_seconds': total / count if count else 0.0}
+        return result
+
+    def render(self, name: str = 'rag_stage_seconds') -> List[str]:
+        lines = [f"# HELP {name} Time spent in each processing stage.", f"# TYPE {name} histogram"]
+        for stage, histogram in sorted(self._histograms.items()):
+            cumulative, total, count = histogram.snapshot()
+            for bound, value in zip(histogram.buckets, cumulative):
+                lines.append(f'{name}_bucket{{stage="{stage}",le="{bound:g}"}} {value}')
+            lines.append(f'{name}_bucket{{stage="{stage}",le="+Inf"}} {count}')
+            lines.append(f'{name}_sum{{stage="{stage}"}} {total:.6f}')
+            lines.append(f'{name}_count{{stage="{stage}"}} {count}')
+        return lines
+
+
+# 进程内共享的阶段耗时，由 /metrics 接口导出
+stage_metrics = StageMetrics()
+
+
+def _metric(lines: List[str], name: str, kind: str, help_text: str, value):
+    lines.append(f"# HELP {name} {help_text}")
+    lines.append(f"# TYPE {name} {kind}")
+    lines.append(f"{name} {value}")
+
+
+def _stats_metrics(lines: List[str], prefix: str, help_text: str, stats: Optional[dict]):
+    """把组件的 stats 计数字典导出为计数器，非数值项忽略"""
+    for key, value in sorted((stats or {}).items()):
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            _metric(lines, f"{prefix}_{key}_total", 'counter', f"{help_text}: {key}.", value)
+
+
+def _hit_rate(hits: int, misses: int) -> float:
+    return hits / (hits + misses) if hits + misses else 0.0
+
+
+def render_prometheus(rag_system, query_batcher=None, query_embedder=None, llm_relay=None, reranker=None,
+                      metrics: StageMetrics = stage_metrics) -> str:
+    """以 Prometheus 文本格式导出阶段耗时、索引规模、缓存命中率和嵌入接口的请求、重试与错误计数
+
+    query_embedder 为单独计算查询向量的客户端（异步服务中的 AsyncEmbeddingClient），没有时省略；
+    llm_relay 为上游 LLM 的流式转发（sse_relay.py），导出转发、取消和上游错误的计数；
+    reranker 为第二阶段重排（reranker.py），导出重排、超出预算退回和得分缓存命中的计数。
+    """
+    lines = metrics.render()
+    view = rag_system._view
+    _metric(lines, 'rag_index_chunks', 'gauge', "Chunks in the published index, including deleted ones.", view.ntotal)
+    _metric(lines, 'rag_index_live_chunks', 'gauge', "Chunks that can be retrieved.",
+            view.ntotal - len(view.tombstones))
+    _metric(lines, 'rag_index_segments', 'gauge', "Index segments in the published snapshot.", len(view.segments))
+    _metric(lines, 'rag_index_documents', 'gauge', "Documents in the ingest manifest.",
+            len(rag_system.manifest))
+    _metric(lines, 'rag_index_version', 'gauge', "Version of the published index snapshot.", view.version)
+
+    cache = rag_system.result_cache
+    if cache is not None:
+        _stats_metrics(lines, 'rag_result_cache', "Result cache events", cache.stats)
+        _metric(lines, 'rag_result_cache_hit_ratio', 'gauge', "Result cache hit ratio (exact and semantic).",
+                f"{_hit_rate(cache.stats['hits'] + cache.stats['semantic_hits'], cache.stats['misses']):.6f}")
+    if rag_system.embed_cache is not None:
+        summary = rag_system.embed_cache.summary()
+        _stats_metrics(lines, 'rag_embed_cache', "Embedding cache events",
+                       {key: summary[key] for key in ('hits', 'misses', 'disk_hits', 'evictions') if key in summary})
+        _metric(lines, 'rag_embed_cache_hit_ratio', 'gauge', "Embedding cache hit ratio.", f"{summary['hit_rate']:.6f}")
+        _metric(lines, 'rag_embed_cache_bytes', 'gauge', "Bytes held by the in-memory embedding cache.",
+                summary['bytes'])
+    if rag_system.parse_cache is not None:
+        _stats_metrics(lines, 'rag_parse_cache', "PDF parse cache events", rag_system.parse_cache.stats)
+    _stats_metrics(lines, 'rag_embedder', "Embedding backend events", getattr(rag_system.embedder, 'stats', None))
+    if query_embedder is not None:
+        _stats_metrics(lines, 'rag_query_embedder', "Query embedding client events", query_embedder.stats)
+    if query_batcher is not None:
+        _stats_metrics(lines, 'rag_query_batcher', "Query batcher events", query_batcher.stats)
+    if llm_relay is not None:
+        _stats_metrics(lines, 'rag_llm_relay', "LLM stream relay events", llm_relay.stats)
+    if reranker is not None:
+        _stats_metrics(lines, 'rag_reranker', "Reranker events", reranker.stats)
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,153 @@
+from typing import Iterator, List, Optional, Tuple
+import gzip
+import json
+import logging
+import os
+import threading
+from manifest import file_sha256
+from pdf_extract import PdfExtractor
+logger = logging.getLogger(__name__)
+
+# 缓存内容（清理后的页文本和标题）的格式版本；修改 SecurityRAGSystem._clean_text 或 _extract_title 后递增，使旧缓存失效
+CACHE_FORMAT = 2
+
+
+class ParseCacheError(Exception):
+    """缓存条目在读取过程中发现损坏"""
+
+
+class ParseCache:
+    """页级解析缓存：每篇文档一个 gzip 压缩的 JSON Lines 文件，第一行为标题，之后每行一页清理后的文本
+
+    键为 (文件内容的 SHA-256, 提取后端名称和版本, CACHE_FORMAT)。分段和过滤规则
+    （_split_into_paragraphs、_is_valid_paragraph）不在键中，调整这些规则后重新切分不需要再解析PDF。
+    文件内容改变后哈希不同，旧条目不再命中。读写都逐页进行，内存占用与文档大小无关。
+
+    Args:
+        cache_dir: 缓存目录
+    """
+    def __init__(self, cache_dir: str):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+        self.stats = {'hits': 0, 'misses': 0, 'writes': 0, 'errors': 0}
+        self._lock = threading.Lock()
+
+    def _path(self, sha256: str, extractor: PdfExtractor) -> str:
+        return os.path.join(self.cache_dir, f"{sha256}.{extractor.name}-{extractor.version}.v{CACHE_FORMAT}.jsonl.gz")
+
+    def _count(self, key: str):
+        with self._lock:
+            self.stats[key] += 1
+
+    def get(self, pdf_path: str, extractor: PdfExtractor,
+            sha256: Optional[str] = None) -> Optional[Tuple[str, Iterator[str]]]:
+        """查找缓存，命中时返回 (标题, 逐页产出清理后文本的迭代器)
+
+        迭代过程中发现条目损坏时删除该条目并抛出 ParseCacheError，调用方可以从下一页起改为解析PDF。
+        """
+        try:
+            path = self._path(sha256 or file_sha256(pdf_path), extractor)
+            f = gzip.open(path, 'rt', encoding='utf-8')
+        except FileNotFoundError:
+            self._count('misses')
+            return None
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable parse cache entry for {pdf_path}: {e}")
+            self._count('errors')
+            return None
+        try:
+            title = json.loads(f.readline())['title']
+        except Exception as e:
+            f.close()
+            logger.warning(f"Ignoring unreadable parse cache entry for {pdf_path}: {e}")
+            self._count('errors')
+            return None
+        self._count('hits')
+        return title, self._iter_pages(f, path, pdf_path)
+
+    def _iter_pages(self, f, path: str, pdf_path: str) -> Iterator[str]:
+        try:
+            with f:
+                for line in f:
+                    yield json.loads(line)
+        except (OSError, EOFError, ValueError) as e:
+            self._count('errors')
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            raise ParseCacheError(f"Corrupt parse cache entry for {pdf_path}: {e}") from e
+
+    def writer(self, pdf_path: str, extractor: PdfExtractor, title: Optional[str],
+               sha256: Optional[str] = None) -> Optional["ParseCacheWriter"]:
+        """开始写入一篇文档，之后逐页调用 write_page，全部写完后 commit；无法写入时返回 None"""
+        try:
+            path = self._path(sha256 or file_sha256(pdf_path), extractor)
+            return ParseCacheWriter(self, path, pdf_path, title)
+        except Exception as e:
+            logger.warning(f"Failed to write parse cache for {pdf_path}: {e}")
+            self._count('errors')
+            return None
+
+    def put(self, pdf_path: str, extractor: PdfExtractor, title: str, pages: List[str],
+            sha256: Optional[str] = None):
+        """写入整篇文档的解析结果"""
+        writer = self.writer(pdf_path, extractor, title, sha256)
+        if writer is None:
+            return
+        for page in pages:
+            if not writer.write_page(page):
+                return
+        writer.commit()
+
+
+class ParseCacheWriter:
+    """逐页写入一个缓存条目：先写临时文件，commit 时原子替换，并发写入同一文档或中途放弃都不会留下不完整的条目"""
+    def __init__(self, cache: ParseCache, path: str, pdf_path: str, title: Optional[str]):
+        self.cache = cache
+        self.path = path
+        self.pdf_path = pdf_path
+        self.pages = 0
+        self._tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        self._file = gzip.open(self._tmp_path, 'wt', encoding='utf-8', compresslevel=6)
+        self._file.write(json.dumps({'title': title}, ensure_ascii=False) + '\n')
+
+    def write_page(self, text: str) -> bool:
+        """追加一页，写入失败时放弃整个条目并返回 False"""
+        if self._file is None:
+            return False
+        try:
+            self._file.write(json.dumps(text, ensure_ascii=False) + '\n')
+        except Exception as e:
+            self._fail(e)
+            return False
+        self.pages += 1
+        return True
+
+    def commit(self):
+        if self._file is None:
+            return
+        try:
+            self._file.close()
+            self._file = None
+            os.replace(self._tmp_path, self.path)
+        except Exception as e:
+            self._fail(e)
+            return
+        self.cache._count('writes')
+        logger.debug(f"Cached {self.pages} parsed pages of {self.pdf_path}")
+
+    def abort(self):
+        """放弃写入（如解析中途失败或调用方不再读取），删除临时文件"""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        try:
+            os.remove(self._tmp_path)
+        except OSError:
+            pass
+
+    def _fail(self, error: Exception):
+        logger.warning(f"Failed to write parse cache for {self.pdf_path}: {error}")
+        self.cache._count('errors')
+        self.abort()
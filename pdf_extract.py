@@ -0,0 +1,109 @@
+import PyPDF2
+from abc import ABC, abstractmethod
+from importlib import metadata
+from typing import Iterator, Optional
+import logging
+logger = logging.getLogger(__name__)
+
+
+def _package_version(package: str) -> str:
+    try:
+        return metadata.version(package)
+    except metadata.PackageNotFoundError:
+        return 'unknown'
+
+
+class PdfExtractor(ABC):
+    """PDF 文本提取后端：逐页产出原始文本，清理和分段由 SecurityRAGSystem 完成
+
+    name 和 version 是解析缓存键的一部分，换后端或升级解析库后旧的缓存不再命中。
+    实现必须可以 pickle（多进程导入时传给解析进程）。子类必须实现 version、page_count 和 iter_pages，
+    缺少任何一个时在创建实例时就报错。
+    """
+    name = 'base'
+
+    @property
+    @abstractmethod
+    def version(self) -> str:
+        """提取库的版本"""
+
+    @abstractmethod
+    def page_count(self, pdf_path: str) -> int:
+        """PDF 的总页数"""
+
+    @abstractmethod
+    def iter_pages(self, pdf_path: str, start_page: int = 0, end_page: Optional[int] = None) -> Iterator[str]:
+        """逐页产出 [start_page, end_page) 的原始文本，end_page 为 None 表示到最后一页"""
+
+
+class PyPDF2Extractor(PdfExtractor):
+    """默认后端，纯 Python 实现，较慢"""
+    name = 'pypdf2'
+
+    @property
+    def version(self) -> str:
+        return _package_version('PyPDF2')
+
+    def page_count(self, pdf_path: str) -> int:
+        with open(pdf_path, 'rb') as file:
+            return len(PyPDF2.PdfReader(file).pages)
+
+    def iter_pages(self, pdf_path: str, start_page: int = 0, end_page: Optional[int] = None) -> Iterator[str]:
+        with open(pdf_path, 'rb') as file:
+            reader = PyPDF2.PdfReader(file)
+            logger.debug(f"Opened {pdf_path} with {len(reader.pages)} pages")
+            end_page = len(reader.pages) if end_page is None else min(end_page, len(reader.pages))
+            for page_num in range(start_page, end_page):
+                yield reader.pages[page_num].extract_text()
+
+
+class PdfiumExtractor(PdfExtractor):
+    """基于 PDFium（Chrome 的 PDF 引擎）的后端，文本提取在 C++ 中完成，通常比 PyPDF2 快一个数量级"""
+    name = 'pdfium'
+
+    def __init__(self):
+        try:
+            import pypdfium2  # noqa: F401
+        except ImportError as e:
+            raise ImportError("The pdfium extractor requires pypdfium2: pip install pypdfium2") from e
+
+    @property
+    def version(self) -> str:
+        return _package_version('pypdfium2')
+
+    def page_count(self, pdf_path: str) -> int:
+        import pypdfium2
+        pdf = pypdfium2.PdfDocument(pdf_path)
+        try:
+            return len(pdf)
+        finally:
+            pdf.close()
+
+    def iter_pages(self, pdf_path: str, start_page: int = 0, end_page: Optional[int] = None) -> Iterator[str]:
+        import pypdfium2
+        pdf = pypdfium2.PdfDocument(pdf_path)
+        try:
+            end_page = len(pdf) if end_page is None else min(end_page, len(pdf))
+            for page_num in range(start_page, end_page):
+                page = pdf[page_num]
+                textpage = page.get_textpage()
+                try:
+                    yield textpage.get_text_range()
+                finally:
+                    textpage.close()
+                    page.close()
+        finally:
+            pdf.close()
+
+
+EXTRACTORS = {
+    PyPDF2Extractor.name: PyPDF2Extractor,
+    PdfiumExtractor.name: PdfiumExtractor
+}
+
+
+def create_extractor(name: str = 'pypdf2') -> PdfExtractor:
+    """按名称创建提取后端（pypdf2 / pdfium）"""
+    if name not in EXTRACTORS:
+        raise ValueError(f"Unknown PDF extractor: {name}, expected one of {tuple(EXTRACTORS)}")
+    return EXTRACTORS[name]()
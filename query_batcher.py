@@ -0,0 +1,87 @@
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import List, Optional
+import logging
+import queue
+import threading
+import time
+logger = logging.getLogger(__name__)
+
+
+class QueryBatcher:
+    """把并发到达的检索请求在一个很短的时间窗口内合并成一次批量检索
+
+    每个请求线程提交查询后阻塞等待结果；后台线程收到第一个查询后最多再等 max_wait 秒
+    或凑满 max_batch 个查询，然后按 (threshold, topk, mode) 分组，每组交给线程池调用
+    retrieval_batch，使一组查询只需一次嵌入请求和一次向量化的 index.search。
+    收集线程提交后立即开始收集下一批，一组查询的嵌入变慢不会拖住其他组和后续批次。
+
+    Args:
+        rag_system: SecurityRAGSystem 实例
+        max_wait: 合并窗口（秒）
+        max_batch: 每批最多的查询数
+        workers: 同时执行的批量检索数
+        timeout: 请求线程等待结果的最长时间（秒），超时抛出 TimeoutError；None 表示一直等待
+    """
+    def __init__(self, rag_system, max_wait: float = 0.005, max_batch: int = 32, workers: int = 4,
+                 timeout: Optional[float] = 30.0):
+        self.rag_system = rag_system
+        self.max_wait = max_wait
+        self.max_batch = max_batch
+        self.timeout = timeout
+        self._queue: "queue.Queue" = queue.Queue()
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="query-batch")
+        self.stats = {'queries': 0, 'batches': 0}
+        self._thread = threading.Thread(target=self._loop, name="query-batcher", daemon=True)
+        self._thread.start()
+
+    def retrieval(self, query: str, threshold: float = 0.8, topk: int = 5, mode: str = 'dense') -> List[dict]:
+        future = Future()
+        self._queue.put((query, threshold, topk, mode, future))
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            # 尚未开始检索的请求直接取消，不再占用线程池
+            future.cancel()
+            raise TimeoutError(f"Retrieval timed out after {self.timeout}s")
+
+    def _collect(self) -> list:
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _loop(self):
+        while True:
+            batch = self._collect()
+            groups = {}
+            for item in batch:
+                groups.setdefault((item[1], item[2], item[3]), []).append(item)
+            for (threshold, topk, mode), items in groups.items():
+                self._pool.submit(self._run_group, items, threshold, topk, mode)
+            self.stats['queries'] += len(batch)
+            self.stats['batches'] += 1
+            logger.debug(f"Dispatched batch of {len(batch)} queries in {len(groups)} group(s)")
+
+    def _run_group(self, items: list, threshold: float, topk: int, mode: str):
+        # 跳过等待超时已被取消的请求
+        items = [item for item in items if item[4].set_running_or_notify_cancel()]
+        if not items:
+            return
+        try:
+            results = self.rag_system.retrieval_batch(
+                [item[0] for item in items], threshold=threshold, topk=topk, mode=mode
+            )
+        except Exception as e:
+            logger.error(f"Batched retrieval failed: {e}")
+            for item in items:
+                item[4].set_exception(e)
+            return
+        for item, result in zip(items, results):
+            item[4].set_result(result)
@@ -1,58 +1,470 @@
-import PyPDF2
 import faiss
 import numpy as np
-import requests
-from typing import List
+from typing import Iterable, Iterator, List, Optional, Tuple
+import itertools
 import os
 import logging
 import time
 import re
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from index_store import IndexStore
+from chunk_store import ChunkStore
+from bm25_index import BM25Index, tokenize
+from dedup import NearDuplicateDetector
+from ann_index import (copy_index, create_flat_index, create_index, enable_reconstruct, exclude_ids,
+                       faiss_metric, min_train_vectors, requires_training, reconstruct_all, resolve_index_params,
+                       search_parameters, set_search_params, validate_index_params)
+from manifest import IngestManifest, file_sha256
+from parse_cache import ParseCache, ParseCacheError
+from pdf_extract import PyPDF2Extractor
+from metrics import stage_metrics
+from embedding_client import EmbeddingClient
+from embedding_cache import EmbeddingCache
+from result_cache import ResultCache
 logger = logging.getLogger(__name__)
 
+# 检索模式：dense 只用向量，lexical 只用 BM25（不需要嵌入服务），hybrid 用倒数排名融合两路结果
+RETRIEVAL_MODES = ('dense', 'lexical', 'hybrid')
+# 分块重新编号（压缩、重建、加载）后旧快照保留的时长（秒），此前的检索结果仍可按旧编号取回向量
+RETIRED_VIEW_SECONDS = 60.0
+
+
+def reciprocal_rank_fusion(dense: List[tuple], lexical: List[tuple], topk: int, rrf_k: int = 60) -> List[tuple]:
+    """倒数排名融合：两路各自按得分降序的 (键, 得分)，融合得分为 sum(1 / (rrf_k + 名次))
+
+    Returns:
+        至多 topk 个 (键, 融合得分, 向量得分, BM25 得分)，未被某一路召回时该路得分为 None
+    """
+    fused = {}
+    for rank, (key, score) in enumerate(dense, 1):
+        fused[key] = [1.0 / (rrf_k + rank), score, None]
+    for rank, (key, score) in enumerate(lexical, 1):
+        entry = fused.setdefault(key, [0.0, None, None])
+        entry[0] += 1.0 / (rrf_k + rank)
+        entry[2] = score
+    ranked = sorted(fused.items(), key=lambda item: -item[1][0])[:topk]
+    return [(key, score, dense_score, bm25_score) for key, (score, dense_score, bm25_score) in ranked]
+
+
+class IndexView:
+    """索引在某一时刻的只读快照
+
+    写入方每完成一步（发布分段、删除、压缩、加载）就构造一个新快照并整体替换 _view，
+    检索开始时只读取一次 _view，之后看到的分段、文本、倒排索引和墓碑始终相互一致。
+    """
+    __slots__ = ('segments', 'chunks', 'bm25', 'tombstones', 'ntotal', 'version', '_selectors')
+
+    def __init__(self, segments: List[faiss.Index], chunks: ChunkStore, bm25: BM25Index, tombstones: set,
+                 version: int = 0):
+        # 每次发布递增，检索结果缓存据此判断索引是否变化
+        self.version = version
+        self.segments = tuple(segments)
+        # 分块存储和倒排索引只会追加（压缩时整体替换），快照中的编号始终有效
+        self.chunks = chunks
+        self.bm25 = bm25
+        self.tombstones = frozenset(tombstones)
+        self.ntotal = sum(segment.ntotal for segment in self.segments)
+        self._selectors = None
+
+    def selectors(self) -> list:
+        """每个分段一个排除墓碑的 ID 过滤器（没有墓碑的分段为 None），第一次检索时构造，之后随快照复用"""
+        if self._selectors is None:
+            dead = np.array(sorted(self.tombstones), dtype=np.int64)
+            selectors, offset = [], 0
+            for segment in self.segments:
+                local = dead[(dead >= offset) & (dead < offset + segment.ntotal)] - offset
+                selectors.append(exclude_ids(local) if len(local) else None)
+                offset += segment.ntotal
+            self._selectors = selectors
+        return self._selectors
+
+    def result(self, idx: int) -> dict:
+        """一条检索结果：分块文本及引用信息，index_version 记录结果来自哪个快照（见 chunk_vectors）"""
+        result = self.chunks.get(idx)
+        result['index_version'] = self.version
+        return result
+
+
 class SecurityRAGSystem:
-    def __init__(self, api_key: str="your_api_key"):
-        self.dimension = 1024
-        self.index = faiss.IndexFlatL2(self.dimension)
-        self.texts = []
-        self.metadata = []
+    def __init__(self, api_key: str="your_api_key", store_dir: Optional[str] = None,
+                 embed_cache_bytes: int = 256 * 1024 * 1024,
+                 index_type: str = 'flat', index_params: Optional[dict] = None,
+                 metric: str = 'l2', dedup_threshold: Optional[float] = 0.85, embedder=None, extractor=None):
+        # embedder 为可替换的嵌入后端（如 local_embedding.OnnxEmbeddingClient），None 表示使用远程接口
+        # extractor 为PDF文本提取后端（见 pdf_extract.py），None 表示使用 PyPDF2
+        self.extractor = extractor or PyPDF2Extractor()
+        self.dimension = getattr(embedder, 'dimension', None) or 1024
+        # l2：原始向量上的欧氏距离，threshold 为距离上限；
+        # cosine：L2 归一化后的内积，threshold 为余弦相似度下限，在索引内部通过范围搜索过滤
+        faiss_metric(metric)
+        self.metric = metric
+        # 索引类型（flat / sq_fp16 / sq8 / ivf_flat / hnsw / ivf_pq / opq_ivf_pq）及参数，可选降维，见 ann_index.py
+        self.index_type = index_type
+        self.index_params = resolve_index_params(index_type, index_params)
+        validate_index_params(index_type, self.index_params, self.dimension)
+        # 已加载的分段与当前的索引类型或降维配置不同，下次保存时重建
+        self._layout_changed = False
+        # 新分段从该模板克隆；需要训练的类型在训练前为 None，此时新向量先写入精确的 Flat 分段
+        self._template = None
+        if not requires_training(index_type, self.index_params):
+            self._template = create_index(index_type, self.dimension, self.index_params, metric=metric)
+        # 索引由若干分段组成：从磁盘 mmap 加载的分段和已发布的内存分段都是只读的，新增向量每批写入一个新分段
+        self.segments: List[faiss.Index] = []
+        self._segment_files: List[Optional[str]] = []
+        # 分块文本、文档编号、页码及文档表（标题、文件名）
+        self.chunks = ChunkStore()
+        # 与分块编号对齐的 BM25 倒排索引，用于词法检索和混合检索
+        self.bm25 = BM25Index()
+        # 增量导入清单和已删除（墓碑）的分块编号
+        self.manifest = IngestManifest()
+        self.tombstones = set()
+        # 墓碑比例超过该值时，保存前先压缩索引
+        self.compact_ratio = 0.2
+        # 近重复检测：与已入库分块的 Jaccard 相似度不低于 dedup_threshold 的分块在向量化之前跳过，None 表示不去重
+        self.dedup = NearDuplicateDetector(dedup_threshold) if dedup_threshold is not None else None
+        # 流式导入时每次向量化并写入索引的分块数
+        self.ingest_window = 256
+        # 未落盘的小分段超过该数量时合并成一个；保存时分段总数超过该值也会合并
+        self.max_segments = 16
+        # 写操作（导入、删除、保存）串行执行；检索不加锁，只读取已发布的分段列表
+        self._write_lock = threading.RLock()
+        self._view = IndexView(self.segments, self.chunks, self.bm25, self.tombstones)
+        # 当前分块编号方式从哪个快照版本开始，以及重新编号前保留的旧快照 (起始版本, 快照, 退役时间)
+        self._numbering_since = 0
+        self._retired_views: List[tuple] = []
+        # 检索结果缓存（见 result_cache.py），None 表示不缓存
+        self.result_cache: Optional[ResultCache] = None
+        # 混合检索时每一路取出的候选数（topk 的倍数）及倒数排名融合的平滑常数
+        self.hybrid_candidates = 4
+        self.rrf_k = 60
+        # 查询向量化的超时（秒），超时或失败时退化为词法检索；None 表示不限时
+        self.embed_timeout: Optional[float] = None
+        self._query_pool = None
         
         self.embed_url = "https://api.siliconflow.cn/v1/embeddings"
+        self.embed_model = embedder.model if embedder is not None else "BAAI/bge-large-en-v1.5"
         self.api_key = api_key
-        self.headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json"
-        }
+        self.embedder = embedder or EmbeddingClient(self.embed_url, self.api_key, self.embed_model)
+        # 嵌入缓存：内存 LRU，配置了存储目录时再加一层 SQLite 磁盘缓存
+        self.embed_cache = EmbeddingCache(
+            self.embed_model, max_bytes=embed_cache_bytes,
+            disk_path=os.path.join(store_dir, 'embed_cache.sqlite') if store_dir else None
+        ) if embed_cache_bytes > 0 else None
+
+        # 页级解析缓存：配置了存储目录时保存每篇文档清理后的页文本，调整分段规则后重新切分不必再解析PDF
+        self.parse_cache = ParseCache(os.path.join(store_dir, 'parse_cache')) if store_dir else None
+
+        self.store = IndexStore(store_dir) if store_dir else None
+        if self.store is not None:
+            self.load()
+
+    @property
+    def ntotal(self) -> int:
+        return sum(segment.ntotal for segment in self.segments)
+
+    def _publish_view(self):
+        """用当前状态构造新快照并原子地替换，之后开始的检索才会看到（调用方持有写锁）"""
+        self._view = IndexView(self.segments, self.chunks, self.bm25, self.tombstones, self._view.version + 1)
+        if self._retired_views:
+            now = time.monotonic()
+            self._retired_views = [entry for entry in self._retired_views if now - entry[2] < RETIRED_VIEW_SECONDS]
+
+    def _retire_view(self):
+        """分块即将重新编号：保留当前快照一段时间，此前检索到的编号仍可从中取回向量（调用方持有写锁）"""
+        self._retired_views = self._retired_views + [(self._numbering_since, self._view, time.monotonic())]
+        self._numbering_since = self._view.version + 1
+
+    def load(self, mmap: bool = True) -> bool:
+        """从磁盘存储热启动，返回是否加载成功"""
+        if self.store is None:
+            return False
+        try:
+            state = self.store.load(mmap=mmap)
+        except Exception as e:
+            logger.error(f"Failed to load index store {self.store.root}: {e}")
+            return False
+        if state is None:
+            return False
+        info = state['info']
+        if (info.get('dimension') != self.dimension or info.get('embed_model') != self.embed_model
+                or info.get('metric', 'l2') != self.metric):
+            logger.warning(f"Index store was built with {info.get('embed_model')} "
+                           f"(dim={info.get('dimension')}, metric={info.get('metric', 'l2')}), ignoring it")
+            return False
+
+        self.segments = state['segments']
+        self._segment_files = state['segment_files']
+        self.chunks = state['chunks']
+        if state['bm25'] is not None and len(state['bm25']) == len(self.chunks):
+            self.bm25 = state['bm25']
+        else:
+            # 旧版本存储没有倒排索引，从分块文本重建，下次保存时写出
+            start = time.time()
+            self.bm25 = BM25Index.build(self.chunks.texts)
+            logger.info(f"Built BM25 index for {len(self.chunks)} chunks in {time.time() - start:.1f}s")
+        self.manifest = IngestManifest.from_dict(state['manifest'])
+        self.tombstones = set(int(i) for i in state['tombstones'])
+        stored_layout = self._index_layout(info.get('index_type'), info.get('reduce'), info.get('reduce_dim'))
+        layout = self._index_layout(self.index_type, self.index_params['reduce'], self.index_params['reduce_dim'])
+        self._layout_changed = stored_layout != layout
+        if state['template'] is not None and not self._layout_changed:
+            self._template = state['template']
+        elif self._layout_changed:
+            logger.info(f"Index store uses {stored_layout} index, it will be rebuilt as {layout} on next save")
+            if info.get('reduce'):
+                logger.warning(f"Rebuilding from a dimension-reduced index uses the reduced vectors; "
+                               f"re-ingest the documents to restore full precision")
+        for segment in self.segments:
+            set_search_params(segment, self.index_params['nprobe'], self.index_params['ef_search'])
+            enable_reconstruct(segment)
+        if self.dedup is not None:
+            # 已入库分块的签名在第一次导入时再计算，不拖慢热启动
+            self.dedup.reset()
+        self._retire_view()
+        self._publish_view()
+        return True
+
+    def save(self):
+        """将当前索引、文本和元数据保存为存储中的一个新版本"""
+        if self.store is None:
+            raise ValueError("store_dir is required to save the index")
+        with self._write_lock:
+            self._save()
+
+    def _save(self):
+        if self._template is None and self.ntotal - len(self.tombstones) >= self.index_params['train_size']:
+            self.train_index()
+        elif self._needs_rebuild():
+            self._rebuild()
+        elif self.tombstones and len(self.tombstones) > self.compact_ratio * self.ntotal:
+            self.compact()
+        elif len(self.segments) > self.max_segments:
+            self._merge_unsaved_segments(1)
+            if len(self.segments) > self.max_segments:
+                self._rebuild()
+        self._segment_files = self.store.save(
+            self.segments, self._segment_files, self.chunks,
+            info={
+                'dimension': self.dimension,
+                'embed_model': self.embed_model,
+                'index_type': self.index_type,
+                'reduce': self.index_params['reduce'],
+                'reduce_dim': self.index_params['reduce_dim'],
+                'metric': self.metric
+            },
+            manifest=self.manifest.to_dict(),
+            tombstones=np.array(sorted(self.tombstones), dtype=np.int64),
+            template=self._template,
+            bm25=self.bm25
+        )
+
+    def _live_vectors(self) -> Iterator[np.ndarray]:
+        """按分段依次产出未被删除的向量"""
+        dead = np.array(sorted(self.tombstones), dtype=np.int64)
+        offset = 0
+        for segment in self.segments:
+            n = segment.ntotal
+            if n:
+                keep = np.ones(n, dtype=bool)
+                keep[dead[(dead >= offset) & (dead < offset + n)] - offset] = False
+                yield reconstruct_all(segment)[keep]
+            offset += n
+
+    @staticmethod
+    def _index_layout(index_type: str, reduce: Optional[str], reduce_dim: Optional[int]) -> str:
+        return f"{index_type}+{reduce}{reduce_dim}" if reduce else index_type
+
+    def _needs_rebuild(self) -> bool:
+        """已训练好模板，但仍有训练前写入的 Flat 分段或其他类型的分段"""
+        if self._template is None:
+            return False
+        if self._layout_changed:
+            return True
+        if self.index_type == 'flat' and self.index_params['reduce'] is None:
+            return False
+        template_type = type(self._template)
+        return any(type(segment) is not template_type for segment in self.segments)
+
+    def train_index(self, sample_size: Optional[int] = None):
+        """在已有向量的随机样本上训练索引，然后把全部向量重建到训练好的索引中"""
+        if not requires_training(self.index_type, self.index_params):
+            return
+        with self._write_lock:
+            vectors = np.vstack(list(self._live_vectors()) or
+                                [np.zeros((0, self.dimension), dtype=np.float32)])
+            sample_size = sample_size or self.index_params['max_train_sample']
+            if len(vectors) > sample_size:
+                vectors = vectors[np.random.default_rng(0).choice(len(vectors), sample_size, replace=False)]
+            minimum = min_train_vectors(self.index_type, self.index_params)
+            if len(vectors) < minimum:
+                raise ValueError(f"Training {self.index_type} needs at least {minimum} vectors, got {len(vectors)}")
+            self._template = create_index(self.index_type, self.dimension, self.index_params,
+                                          train_vectors=vectors, metric=self.metric)
+            del vectors
+            self._rebuild()
+
+    def set_search_params(self, nprobe: Optional[int] = None, ef_search: Optional[int] = None):
+        """调整 IVF 的 nprobe / HNSW 的 efSearch，在召回率和延迟之间取舍"""
+        if nprobe is not None:
+            self.index_params['nprobe'] = nprobe
+        if ef_search is not None:
+            self.index_params['ef_search'] = ef_search
+        for index in self.segments + ([self._template] if self._template is not None else []):
+            set_search_params(index, nprobe, ef_search)
+
+    def compact(self):
+        """去掉墓碑分块，把所有分段合并成一个，并按新编号更新清单"""
+        with self._write_lock:
+            if self.tombstones:
+                self._rebuild()
+
+    def _rebuild(self):
+        """把所有分段中未删除的向量合并写入一个新分段，并按新编号更新清单"""
+        dead = np.array(sorted(self.tombstones), dtype=np.int64)
+        merged = self._new_segment()
+        for vectors in self._live_vectors():
+            if len(vectors):
+                merged.add(vectors)
+
+        keep = np.ones(len(self.chunks), dtype=bool)
+        keep[dead] = False
+        chunks = self.chunks.compact(keep)
+        bm25 = self.bm25.compact(keep)
+        self.manifest.remap(lambda old: old - np.searchsorted(dead, old))
+
+        removed = len(self.tombstones)
+        self.segments = [merged]
+        self._segment_files = [None]
+        self._layout_changed = False
+        self.chunks = chunks
+        self.bm25 = bm25
+        self.tombstones = set()
+        self._retire_view()
+        self._publish_view()
+        logger.info(f"Rebuilt {type(merged).__name__} index: removed {removed} chunks, "
+                    f"{merged.ntotal} remaining")
+
+    def _merge_unsaved_segments(self, limit: int):
+        """尾部尚未落盘的分段多于 limit 个时合并成一个；全局编号保持不变，不影响墓碑和清单
+
+        合并在旁边的新分段上进行，完成后整体发布，正在进行的检索继续使用旧分段。
+        """
+        first = len(self._segment_files)
+        while first > 0 and self._segment_files[first - 1] is None:
+            first -= 1
+        if len(self.segments) - first <= max(limit, 1):
+            return
+        merged = self._new_segment()
+        for segment in self.segments[first:]:
+            if segment.ntotal:
+                merged.add(reconstruct_all(segment))
+        logger.info(f"Merged {len(self.segments) - first} unsaved segments into one")
+        self._segment_files = self._segment_files[:first] + [None]
+        self.segments = self.segments[:first] + [merged]
+        self._publish_view()
+
+    def _new_segment(self) -> faiss.Index:
+        if self._template is None:
+            return create_flat_index(self.dimension, self.metric)
+        segment = copy_index(self._template)
+        set_search_params(segment, self.index_params['nprobe'], self.index_params['ef_search'])
+        # 在写入和发布之前建立编号映射，chunk_vectors 读取已发布的分段时不需要修改它
+        enable_reconstruct(segment)
+        return segment
+
+    def _prepare_vectors(self, vectors: np.ndarray) -> np.ndarray:
+        """转成连续的 float32；cosine 度量下做 L2 归一化"""
+        if self.metric != 'cosine':
+            return np.ascontiguousarray(vectors, dtype=np.float32)
+        vectors = np.array(vectors, dtype=np.float32, order='C')
+        faiss.normalize_L2(vectors)
+        return vectors
+
+    @staticmethod
+    def _segment_params(segment: faiss.Index, selectors: Optional[list], i: int):
+        if selectors is None or selectors[i] is None:
+            return None
+        return search_parameters(segment, selectors[i])
+
+    def _search(self, segments: List[faiss.Index], vectors: np.ndarray, k: int, selectors: Optional[list] = None):
+        """在所有分段中搜索并合并结果，返回全局编号（不足 k 个时以 -1 填充）
+
+        l2 度量下按距离升序，cosine 度量下按相似度降序。selectors 为每个分段的 ID 过滤器（见 IndexView.selectors）。
+        """
+        worst = -np.inf if self.metric == 'cosine' else np.inf
+        all_distances, all_indices = [], []
+        offset = 0
+        for i, segment in enumerate(segments):
+            if segment.ntotal:
+                distances, indices = segment.search(vectors, min(k, segment.ntotal),
+                                                    params=self._segment_params(segment, selectors, i))
+                all_distances.append(distances)
+                all_indices.append(np.where(indices >= 0, indices + offset, -1))
+            offset += segment.ntotal
+        if not all_distances:
+            return (np.full((len(vectors), k), worst, dtype=np.float32),
+                    np.full((len(vectors), k), -1, dtype=np.int64))
+        distances = np.hstack(all_distances)
+        indices = np.hstack(all_indices)
+        distances = np.where(indices >= 0, distances, worst)
+        keys = -distances if self.metric == 'cosine' else distances
+        order = np.argsort(keys, axis=1, kind='stable')[:, :k]
+        distances = np.take_along_axis(distances, order, axis=1)
+        indices = np.take_along_axis(indices, order, axis=1)
+        if distances.shape[1] < k:
+            pad = k - distances.shape[1]
+            distances = np.pad(distances, ((0, 0), (0, pad)), constant_values=worst)
+            indices = np.pad(indices, ((0, 0), (0, pad)), constant_values=-1)
+        return distances, indices
+
+    def _range_search(self, segments: List[faiss.Index], vectors: np.ndarray, min_score: float,
+                      selectors: Optional[list] = None, limit: Optional[int] = None) -> List[tuple]:
+        """cosine 度量下的范围搜索：只取相似度高于 min_score 的结果
+
+        bge 类嵌入的相似度普遍偏高，阈值之上可能是语料的很大一部分；limit 限制每个分段每个查询保留的候选数，
+        用 argpartition 选出前 limit 个，不对全部命中排序。
+
+        Returns:
+            每个查询一个 (相似度, 全局编号)，按相似度降序，至多 limit 个
+        """
+        parts = [[] for _ in range(len(vectors))]
+        offset = 0
+        for i, segment in enumerate(segments):
+            if segment.ntotal:
+                lims, scores, indices = segment.range_search(vectors, min_score,
+                                                             params=self._segment_params(segment, selectors, i))
+                for q in range(len(vectors)):
+                    q_scores, q_indices = scores[lims[q]:lims[q + 1]], indices[lims[q]:lims[q + 1]]
+                    if limit is not None and len(q_scores) > limit:
+                        top = np.argpartition(-q_scores, limit - 1)[:limit]
+                        q_scores, q_indices = q_scores[top], q_indices[top]
+                    parts[q].append((q_scores, q_indices + offset))
+            offset += segment.ntotal
+        results = []
+        for q_parts in parts:
+            if not q_parts:
+                results.append((np.zeros(0, dtype=np.float32), np.zeros(0, dtype=np.int64)))
+                continue
+            scores = np.concatenate([p[0] for p in q_parts])
+            indices = np.concatenate([p[1] for p in q_parts])
+            order = np.argsort(-scores, kind='stable')[:limit]
+            results.append((scores[order], indices[order]))
+        return results
 
     def encode_text(self, texts: List[str]) -> np.ndarray:
+        """计算文本向量，失败时返回 None（每个批次已在客户端内部重试）"""
         if isinstance(texts, str):
             texts = [texts]
-        
-        # 每批处理的文本数量
-        batch_size = 10
-        all_embeddings = []
-        
-        for i in range(0, len(texts), batch_size):
-            batch_texts = texts[i:i+batch_size]
-            payload = {
-                "model": "BAAI/bge-large-en-v1.5",
-                "input": batch_texts,
-                "encoding_format": "float"
-            }
-            
-            try:
-                response = requests.post(
-                    self.embed_url, 
-                    json=payload, 
-                    headers=self.headers
-                )
-                response.raise_for_status()
-                embeddings = response.json()['data']
-                all_embeddings.extend([emb['embedding'] for emb in embeddings])
-            except Exception as e:
-                logger.error(f"Embedding error: {e}")
-                return None
-        
-        return np.array(all_embeddings) if all_embeddings else None
+        if not texts:
+            return None
+        try:
+            if self.embed_cache is not None:
+                return self.embed_cache.get_or_embed(texts, self.embedder.embed)
+            return self.embedder.embed(texts)
+        except Exception as e:
+            logger.error(f"Embedding error: {e}")
+            return None
 
     def read_pdf(self, pdf_path: str) -> List[dict]:
         """读取PDF文件并按段落切分文本
@@ -62,53 +474,100 @@ class SecurityRAGSystem:
         Returns:
             包含文本段落和元数据的字典列表
         """
-        if not os.path.exists(pdf_path):
-            logger.error(f"PDF file not found: {pdf_path}")
-            return []
-
-        chunks_with_metadata = []
         try:
-            with open(pdf_path, 'rb') as file:
-                reader = PyPDF2.PdfReader(file)
-                logger.info(f"Successfully opened PDF: {pdf_path} with {len(reader.pages)} pages")
-                
-                # 提取标题（从第一页）
-                first_page = reader.pages[0].extract_text()
-                title = self._extract_title(first_page)
-                logger.info(f"Extracted title: {title}")
-                
-                # 处理每一页
-                for page_num, page in enumerate(reader.pages, 1):
-                    text = page.extract_text()
-                    logger.debug(f"Processing page {page_num}, raw text length: {len(text)}")
-                    
-                    # 清理文本
-                    text = self._clean_text(text)
-                    
-                    # 按段落分割
-                    paragraphs = self._split_into_paragraphs(text)
-                    logger.debug(f"Page {page_num}: Split into {len(paragraphs)} paragraphs")
-                    
-                    # 处理每个段落
-                    valid_paragraphs = 0
-                    for para in paragraphs:
-                        # 过滤无效段落
-                        if self._is_valid_paragraph(para):
-                            valid_paragraphs += 1
-                            chunks_with_metadata.append({
-                                'text': para
-                            })
-                    logger.debug(f"Page {page_num}: Found {valid_paragraphs} valid paragraphs")
-                    
-            logger.info(f"Extracted {len(chunks_with_metadata)} valid paragraphs from {pdf_path}")
-            return chunks_with_metadata
-                    
+            chunks_with_metadata = list(self.iter_pdf(pdf_path))
         except Exception as e:
             logger.error(f"Error reading PDF {pdf_path}: {e}")
             return []
+        logger.info(f"Extracted {len(chunks_with_metadata)} valid paragraphs from {pdf_path}")
+        return chunks_with_metadata
+
+    def iter_pdf(self, pdf_path: str, sha256: Optional[str] = None) -> Iterator[dict]:
+        """逐页读取PDF，按段落惰性产出分块，内存占用与文档大小无关（sha256 见 iter_pages）
 
-    def _extract_title(self, first_page_text: str) -> str:
-        """从第一页提取论文标题"""
+        Raises:
+            解析失败时直接抛出异常，由调用方决定如何处理已产出的部分
+        """
+        if not os.path.exists(pdf_path):
+            logger.error(f"PDF file not found: {pdf_path}")
+            return
+
+        for page_num, title, text in self.iter_pages(pdf_path, self.extractor, self.parse_cache, sha256=sha256):
+            logger.debug(f"Processing page {page_num}, cleaned text length: {len(text)}")
+            for para in self.iter_paragraphs(text):
+                yield {'text': para, 'page': page_num, 'title': title}
+
+    @staticmethod
+    def iter_pages(pdf_path: str, extractor, parse_cache: Optional[ParseCache] = None,
+                   start_page: int = 0, end_page: Optional[int] = None,
+                   sha256: Optional[str] = None) -> Iterator[tuple]:
+        """逐页产出 [start_page, end_page) 的 (页码, 标题, 清理后的文本)，页码从 1 开始
+
+        命中解析缓存时不再解析PDF（缓存条目中途损坏时从下一页起改为解析）；未命中时整个文件
+        （start_page 为 0 且 end_page 为 None）边解析边逐页写入缓存，全部解析完才提交。读写缓存都不在内存中保留整篇文档。
+        标题从第一页提取，不包含第一页的页码范围产出的标题为 None。
+        sha256 为调用方在 prepare_ingest 中已经算出的文件内容哈希（解析缓存的键），未给出时才读文件计算。
+        """
+        if parse_cache is not None and sha256 is None:
+            sha256 = file_sha256(pdf_path)
+        cached = parse_cache.get(pdf_path, extractor, sha256) if parse_cache is not None else None
+        title = None
+        if cached is not None:
+            cached_title, pages = cached
+            page_num = start_page
+            try:
+                for text in itertools.islice(pages, start_page, end_page):
+                    page_num += 1
+                    yield page_num, cached_title if start_page == 0 else None, text
+                return
+            except ParseCacheError as e:
+                logger.warning(f"{e}, parsing from page {page_num + 1}")
+            # 已产出的页之后改为解析PDF，不再写入缓存
+            if start_page == 0 and page_num > 0:
+                title = cached_title
+            start_page, parse_cache = page_num, None
+
+        # 只有整篇解析时才写入缓存；标题在第一页提取后才能写入条目头部，写入器在第一页时创建
+        writing = parse_cache is not None and start_page == 0 and end_page is None
+        writer = None
+        try:
+            for page_num, text in enumerate(extractor.iter_pages(pdf_path, start_page, end_page), start_page + 1):
+                if page_num == 1:
+                    # 提取标题（从第一页）
+                    title = SecurityRAGSystem._extract_title(text)
+                    logger.info(f"Extracted title: {title}")
+                    if writing:
+                        writer = parse_cache.writer(pdf_path, extractor, title, sha256)
+                text = SecurityRAGSystem._clean_text(text)
+                if writer is not None and not writer.write_page(text):
+                    writer = None
+                yield page_num, title, text
+            if writing and title is None:
+                # 没有任何页的文档（否则第一页已提取出标题）
+                writer = parse_cache.writer(pdf_path, extractor, title, sha256)
+        except BaseException:
+            # 解析失败或调用方提前停止读取，不留下不完整的条目
+            if writer is not None:
+                writer.abort()
+            raise
+        if writer is not None:
+            writer.commit()
+
+    @staticmethod
+    def iter_page_chunks(text: str) -> Iterator[str]:
+        """清理一页文本，按段落切分并过滤无效段落"""
+        return SecurityRAGSystem.iter_paragraphs(SecurityRAGSystem._clean_text(text))
+
+    @staticmethod
+    def iter_paragraphs(text: str) -> Iterator[str]:
+        """把清理后的一页文本按段落切分并过滤无效段落"""
+        for para in SecurityRAGSystem._split_into_paragraphs(text):
+            if SecurityRAGSystem._is_valid_paragraph(para):
+                yield para
+
+    @staticmethod
+    def _extract_title(first_page_text: str) -> str:
+        """从第一页提取论文标题（结果保存在解析缓存中，修改规则后需递增 parse_cache.CACHE_FORMAT）"""
         lines = first_page_text.split('\n')
         for line in lines[:3]:  # 通常标题在前三行
             line = line.strip()
@@ -116,8 +575,9 @@ class SecurityRAGSystem:
                 return line
         return "Unknown Title"
 
-    def _clean_text(self, text: str) -> str:
-        """清理文本"""
+    @staticmethod
+    def _clean_text(text: str) -> str:
+        """清理文本（结果保存在解析缓存中，修改规则后需递增 parse_cache.CACHE_FORMAT）"""
         # 替换多余的空白字符
         text = ' '.join(text.split())
         # 替换特殊破折号
@@ -127,39 +587,43 @@ class SecurityRAGSystem:
         text = '\n'.join(line.strip() for line in text.split('\n'))
         return text
 
-    def _split_into_paragraphs(self, text: str) -> List[str]:
-        """将文本分割成段落"""
+    @staticmethod
+    def _split_into_paragraphs(text: str) -> Iterator[str]:
+        """将文本分割成段落，逐个产出，不一次性构建全部段落"""
         # 首先按多个换行符分割
-        paragraphs = re.split(r'\n\s*\n', text)
-        
-        # 清理每个段落
-        cleaned_paragraphs = []
-        for para in paragraphs:
-            # 清理段落中的多余空白
-            para = ' '.join(para.split())
-            if para:  # 只保留非空段落
-                # 如果段落太长，按句号分割
-                if len(para) > 1000:
-                    sentences = re.split(r'(?<=[.!?。！？])\s+', para)
-                    current_chunk = []
-                    current_length = 0
-                    for sentence in sentences:
-                        if current_length + len(sentence) > 1000:
-                            if current_chunk:
-                                cleaned_paragraphs.append(' '.join(current_chunk))
-                            current_chunk = [sentence]
-                            current_length = len(sentence)
-                        else:
-                            current_chunk.append(sentence)
-                            current_length += len(sentence)
-                    if current_chunk:
-                        cleaned_paragraphs.append(' '.join(current_chunk))
-                else:
-                    cleaned_paragraphs.append(para)
-        
-        return cleaned_paragraphs
+        pos = 0
+        for sep in re.finditer(r'\n\s*\n', text):
+            yield from SecurityRAGSystem._split_long_paragraph(text[pos:sep.start()])
+            pos = sep.end()
+        yield from SecurityRAGSystem._split_long_paragraph(text[pos:])
 
-    def _is_valid_paragraph(self, para: str) -> bool:
+    @staticmethod
+    def _split_long_paragraph(para: str) -> Iterator[str]:
+        """清理单个段落，过长时按句号切分成多个不超过1000字符的块"""
+        # 清理段落中的多余空白
+        para = ' '.join(para.split())
+        if not para:  # 只保留非空段落
+            return
+        if len(para) <= 1000:
+            yield para
+            return
+        # 如果段落太长，按句号分割
+        current_chunk = []
+        current_length = 0
+        for sentence in re.split(r'(?<=[.!?。！？])\s+', para):
+            if current_length + len(sentence) > 1000:
+                if current_chunk:
+                    yield ' '.join(current_chunk)
+                current_chunk = [sentence]
+                current_length = len(sentence)
+            else:
+                current_chunk.append(sentence)
+                current_length += len(sentence)
+        if current_chunk:
+            yield ' '.join(current_chunk)
+
+    @staticmethod
+    def _is_valid_paragraph(para: str) -> bool:
         """检查段落是否有效"""
         # 移除空白字符
         para = para.strip()
@@ -183,7 +647,8 @@ class SecurityRAGSystem:
         
         return True
 
-    def _is_paragraph_end(self, text: str) -> bool:
+    @staticmethod
+    def _is_paragraph_end(text: str) -> bool:
         """检查文本是否是段落的结束"""
         # 检查是否以句号等标点符号结尾
         if any(text.endswith(end) for end in ['.', '。', '!', '?', '！', '？']):
@@ -195,36 +660,506 @@ class SecurityRAGSystem:
         
         return False
 
-    def add_documents(self, pdf_path: str):
-        chunks_with_metadata = self.read_pdf(pdf_path)
-        if not chunks_with_metadata:
-            logger.warning(f"No valid text extracted from {pdf_path}")
-            return
-            
+    def prepare_ingest(self, pdf_path: str) -> Optional[Tuple[str, str]]:
+        """根据导入清单判断是否需要导入；已修改的文件先删除旧分块
+
+        Returns:
+            需要导入时返回 (清单状态（new 或 modified）, 文件内容哈希)，未变的文件返回 None。
+            哈希随后传给解析缓存和清单记录，一次导入中每个文件只读取计算一次
+        """
+        with self._write_lock:
+            status, sha256 = self.manifest.status(pdf_path, self.embed_model)
+            if status == IngestManifest.UNCHANGED:
+                logger.debug(f"Skipping unchanged file: {pdf_path}")
+                return None
+            if status == IngestManifest.MODIFIED:
+                logger.info(f"File modified, re-ingesting: {pdf_path}")
+                self.remove_document(pdf_path)
+            return status, sha256 or file_sha256(pdf_path)
+
+    def needs_ingest(self, pdf_path: str) -> bool:
+        """在写锁内查询导入清单，判断文件是否可能新增或已修改
+
+        只比较修改时间和大小，不读取文件内容；是否真的修改由导入时的 prepare_ingest 比较哈希确认。
+        """
+        with self._write_lock:
+            return self.manifest.changed(pdf_path, self.embed_model)
+
+    def manifest_paths(self) -> List[str]:
+        """在写锁内取得导入清单中的全部路径"""
+        with self._write_lock:
+            return self.manifest.paths()
+
+    def deduplicate(self, pdf_path: str, chunks_with_metadata: List[dict]) -> List[dict]:
+        """在向量化之前去掉近重复的分块（与已入库的分块或同一文档中靠前的分块），返回保留的分块"""
+        if self.dedup is None:
+            return chunks_with_metadata
+        if not self.dedup.loaded:
+            view = self._view
+            start = time.time()
+            self.dedup.load((view.chunks.documents[view.chunks.doc_ids[i]]['path'], view.chunks.text(i))
+                            for i in range(view.ntotal) if i not in view.tombstones)
+            logger.info(f"Computed MinHash signatures for {view.ntotal} chunks in {time.time() - start:.1f}s")
+        return self.dedup.filter(os.path.normpath(pdf_path), chunks_with_metadata)
+
+    def _dedup_sources(self, pdf_path: str) -> List[str]:
+        return self.dedup.sources(os.path.normpath(pdf_path)) if self.dedup is not None else []
+
+    def forget_duplicates(self, pdf_path: str):
+        """文档删除或导入失败后去掉其登记的签名，之后与它重复的分块不再被跳过"""
+        if self.dedup is not None:
+            self.dedup.forget(os.path.normpath(pdf_path))
+
+    def _append_chunks(self, doc_id: int, chunks_with_metadata: List[dict], vectors: np.ndarray):
+        """把一批分块写入一个新分段并发布（调用方持有写锁）"""
+        segment = self._new_segment()
+        segment.add(self._prepare_vectors(vectors))
+        self._publish_segment(doc_id, chunks_with_metadata, segment)
+
+    def _publish_segment(self, doc_id: int, chunks_with_metadata: List[dict], segment: faiss.Index):
+        """发布一个已经建好的只读分段（调用方持有写锁）
+
+        先追加分块和倒排表，再用新的分段列表整体替换旧列表并发布快照（read-copy-update）：
+        正在进行的检索继续使用旧快照，之后的检索才会看到新分段，且其文本已经就绪。
+        已发布的分段不再修改，检索无需加锁；未落盘的小分段过多时合并成一个。
+        """
         texts = [chunk['text'] for chunk in chunks_with_metadata]
-        vectors = self.encode_text(texts)
-        
-        if vectors is not None:
-            self.texts.extend(texts)
-            self.metadata.extend(chunks_with_metadata)
-            self.index.add(vectors)
-            logger.info(f"Added {len(chunks_with_metadata)} chunks from {pdf_path}")
-
-    def retrieval(self, query: str, threshold: float = 0.8, topk: int = 5) -> List[dict]:
-        query_vector = self.encode_text(query)
-        if query_vector is None:
-            return []
-            
-        distances, indices = self.index.search(query_vector, topk)
-        results = []
-        for idx, distance in zip(indices[0], distances[0]):
-            if distance < threshold:
-                results.append({
-                    'text': self.texts[idx],
-                    'distance': float(distance)
-                })
+        self.chunks.extend(doc_id, texts, [chunk.get('page', 0) for chunk in chunks_with_metadata])
+        self.bm25.add(texts)
+        self._segment_files = self._segment_files + [None]
+        self.segments = self.segments + [segment]
+        self._publish_view()
+        self._merge_unsaved_segments(self.max_segments)
+
+    def insert_chunks(self, pdf_path: str, chunks_with_metadata: List[dict], vectors: np.ndarray,
+                      title: Optional[str] = None, sha256: Optional[str] = None):
+        """把一篇PDF的分块及其向量写入索引，并记录到导入清单
+
+        向量先在锁外写入一个新分段，建好后再原子地发布，检索不会被导入阻塞。
+        分块为空（全部是近重复）时只记录清单。title 为文档标题，未给出时取第一个分块的标题；
+        sha256 为 prepare_ingest 返回的内容哈希，未给出时记录清单时计算。
+        """
+        start = time.perf_counter()
+        if chunks_with_metadata:
+            segment = self._new_segment()
+            segment.add(self._prepare_vectors(vectors))
+        with self._write_lock:
+            chunk_start = len(self.chunks)
+            if chunks_with_metadata:
+                if title is None:
+                    title = chunks_with_metadata[0].get('title')
+                doc_id = self.chunks.add_document(pdf_path, title)
+                self._publish_segment(doc_id, chunks_with_metadata, segment)
+                stage_metrics.observe('index_insert', time.perf_counter() - start)
+            try:
+                self.manifest.record(pdf_path, chunk_start, len(self.chunks), self.embed_model,
+                                     sha256=sha256, dedup_sources=self._dedup_sources(pdf_path))
+            except Exception:
+                # 无法记录清单（如文件已被删除）时撤销刚发布的分块，不留下清单之外的分块
+                self.tombstones.update(range(chunk_start, len(self.chunks)))
+                self._publish_view()
+                raise
+        logger.info(f"Added {len(chunks_with_metadata)} chunks from {pdf_path}")
+
+    def insert_windows(self, pdf_path: str, windows: Iterable[Tuple[List[dict], np.ndarray]],
+                       title: Optional[str] = None, sha256: Optional[str] = None) -> int:
+        """把一篇PDF按窗口逐批写入索引，全部写完后记录到导入清单
+
+        windows 逐个产生 (分块列表, 向量)，可以边向量化边写入，每个窗口写入一个新分段并立即发布。
+        写入期间持有写锁，使这篇文档的分块编号连续。任一窗口失败（包括 windows 本身抛出异常，
+        如向量化失败）时撤销已写入的部分并重新抛出，与 _ingest_pdf 相同。title 和 sha256 同 insert_chunks。
+
+        Returns:
+            写入的分块数
+        """
+        with self._write_lock:
+            chunk_start = len(self.chunks)
+            doc_id = None
+            try:
+                for chunks_with_metadata, vectors in windows:
+                    start = time.perf_counter()
+                    if doc_id is None:
+                        doc_id = self.chunks.add_document(
+                            pdf_path, title if title is not None else chunks_with_metadata[0].get('title'))
+                    self._append_chunks(doc_id, chunks_with_metadata, vectors)
+                    stage_metrics.observe('index_insert', time.perf_counter() - start)
+                self.manifest.record(pdf_path, chunk_start, len(self.chunks), self.embed_model,
+                                     sha256=sha256, dedup_sources=self._dedup_sources(pdf_path))
+            except Exception:
+                # 丢弃这篇文档已写入的部分，下次同步时重试
+                self.tombstones.update(range(chunk_start, len(self.chunks)))
+                self.forget_duplicates(pdf_path)
+                self._publish_view()
+                raise
+            added = len(self.chunks) - chunk_start
+        logger.info(f"Added {added} chunks from {pdf_path}")
+        return added
+
+    def record_empty(self, pdf_path: str, error: Optional[str] = None, sha256: Optional[str] = None):
+        """把没有可索引内容的PDF（扫描版、无有效段落或解析失败）以空分块区间记入清单
+
+        文件内容不变时之后的同步按清单跳过，不再反复解析；文件修改后照常重新导入。
+        """
+        with self._write_lock:
+            try:
+                self.manifest.record(pdf_path, len(self.chunks), len(self.chunks), self.embed_model,
+                                     sha256=sha256, error=error)
+            except OSError as e:
+                logger.warning(f"Cannot record {pdf_path} in the manifest: {e}")
+
+    def add_documents(self, pdf_path: str) -> bool:
+        """增量导入一篇PDF：未变的文件跳过，已修改的文件先删除旧分块再重新导入
+
+        分块以 ingest_window 为窗口流式处理：每凑满一个窗口就向量化并写入索引，
+        峰值内存只与窗口大小有关，与PDF大小无关。
+
+        Returns:
+            索引是否发生了变化
+        """
+        with self._write_lock:
+            return self._add_documents(pdf_path)
+
+    def _add_documents(self, pdf_path: str) -> bool:
+        prepared = self.prepare_ingest(pdf_path)
+        if prepared is None:
+            return False
+        with stage_metrics.time('add_documents'):
+            return self._ingest_pdf(pdf_path, *prepared)
+
+    def _ingest_pdf(self, pdf_path: str, status: str, sha256: str) -> bool:
+        chunk_start = len(self.chunks)
+        doc_id = None
+        parsed = 0
+        parsing = False
+        chunks = self.iter_pdf(pdf_path, sha256)
+        try:
+            while True:
+                # 解析是惰性的，每个窗口的解析耗时在取出分块时计入
+                parsing = True
+                with stage_metrics.time('pdf_parse'):
+                    window = list(itertools.islice(chunks, self.ingest_window))
+                parsing = False
+                if not window:
+                    break
+                parsed += len(window)
+                with stage_metrics.time('dedup'):
+                    window = self.deduplicate(pdf_path, window)
+                if not window:
+                    continue
+                with stage_metrics.time('ingest_embed'):
+                    vectors = self.encode_text([chunk['text'] for chunk in window])
+                if vectors is None:
+                    raise RuntimeError("embedding failed")
+                with stage_metrics.time('index_insert'):
+                    if doc_id is None:
+                        doc_id = self.chunks.add_document(pdf_path, window[0].get('title'))
+                    self._append_chunks(doc_id, window, vectors)
+        except Exception as e:
+            logger.error(f"Error ingesting {pdf_path}: {e}")
+            # 丢弃这篇文档已写入的部分，下次同步时重试
+            self.tombstones.update(range(chunk_start, len(self.chunks)))
+            self.forget_duplicates(pdf_path)
+            self._publish_view()
+            if parsing:
+                # 解析失败的文件在内容改变之前不再重试；向量化失败则下次同步时重试
+                self.record_empty(pdf_path, error=f"{type(e).__name__}: {e}", sha256=sha256)
+            return status == IngestManifest.MODIFIED or len(self.chunks) > chunk_start
+
+        if parsed == 0:
+            logger.warning(f"No valid text extracted from {pdf_path}")
+            self.record_empty(pdf_path, sha256=sha256)
+            return status == IngestManifest.MODIFIED
+        self.manifest.record(pdf_path, chunk_start, len(self.chunks), self.embed_model,
+                             sha256=sha256, dedup_sources=self._dedup_sources(pdf_path))
+        logger.info(f"Added {len(self.chunks) - chunk_start} chunks from {pdf_path}")
+        return True
+
+    def remove_document(self, pdf_path: str) -> bool:
+        """将一篇PDF的所有分块标记为墓碑，检索时不再返回，压缩时真正删除
+
+        因与它重复而跳过了分块的文档会被标记为需要重新导入。
+        """
+        with self._write_lock:
+            entry = self.manifest.remove(pdf_path)
+            if entry is None:
+                return False
+            self.tombstones.update(range(entry['chunk_start'], entry['chunk_end']))
+            self.forget_duplicates(pdf_path)
+            dependents = self.manifest.invalidate_dependents(pdf_path)
+            self._publish_view()
+        logger.info(f"Removed {entry['chunk_end'] - entry['chunk_start']} chunks of {pdf_path}")
+        if dependents:
+            logger.info(f"{len(dependents)} documents deduplicated against {pdf_path} will be re-ingested")
+        return True
+
+    def sync_directory(self, papers_dir: str, ingestor=None) -> dict:
+        """让索引与目录内容保持一致：导入新增和修改的PDF，删除已不存在的PDF
+
+        Args:
+            papers_dir: PDF文件目录
+            ingestor: 可选的批量导入器（如 ingest.ParallelIngestor），为 None 时逐个调用 add_documents
+        Returns:
+            各类文件的数量统计
+        """
+        stats = {'added': 0, 'unchanged': 0, 'removed': 0, 'duplicates': 0}
+        skipped = self.dedup.stats['chunks_skipped'] if self.dedup is not None else 0
+        pdf_paths = [os.path.join(papers_dir, file) for file in sorted(os.listdir(papers_dir))
+                     if file.endswith('.pdf')]
+        present = set(os.path.normpath(path) for path in pdf_paths)
+        if ingestor is not None:
+            added = ingestor.ingest(pdf_paths)['added']
+            stats['added'] = added
+            stats['unchanged'] = len(pdf_paths) - added
+        else:
+            for pdf_path in pdf_paths:
+                if self.add_documents(pdf_path):
+                    stats['added'] += 1
+                else:
+                    stats['unchanged'] += 1
+        if self.dedup is not None:
+            stats['duplicates'] = self.dedup.stats['chunks_skipped'] - skipped
+
+        papers_root = os.path.normpath(papers_dir)
+        for path in self.manifest_paths():
+            if os.path.dirname(path) == papers_root and path not in present:
+                self.remove_document(path)
+                stats['removed'] += 1
+        logger.info(f"Synced {papers_dir}: {stats}")
+        return stats
+
+    def retrieval(self, query: str, threshold: float = 0.8, topk: int = 5, mode: str = 'dense') -> List[dict]:
+        results = self.retrieval_batch([query], threshold=threshold, topk=topk, mode=mode)[0]
         logger.info(f"Retrieved {len(results)} results for query '{query}'")
         return results
+
+    def retrieval_batch(self, queries: List[str], threshold: float = 0.8, topk: int = 5,
+                        mode: str = 'dense') -> List[List[dict]]:
+        """批量检索：一次请求计算所有查询的向量，再用一次 index.search 完成全部搜索
+
+        Args:
+            queries: 查询文本
+            threshold: 向量检索的阈值（l2 为距离上限，cosine 为相似度下限），对 BM25 结果不生效
+            topk: 每个查询返回的结果数
+            mode: dense / lexical / hybrid；向量化失败或超时时退化为 lexical
+        """
+        if mode not in RETRIEVAL_MODES:
+            raise ValueError(f"Unknown retrieval mode: {mode}, expected one of {RETRIEVAL_MODES}")
+        if not queries:
+            return []
+        # 缓存命中的查询不再计算向量
+        results = self.cached_results(queries, threshold=threshold, topk=topk, mode=mode)
+        missing = [i for i, result in enumerate(results) if result is None]
+        if not missing:
+            return results
+        queries = [queries[i] for i in missing]
+        query_vectors = None
+        if mode != 'lexical':
+            with stage_metrics.time('query_embed'):
+                query_vectors = self.encode_query(queries)
+            if query_vectors is None:
+                logger.warning("Query embedding unavailable, falling back to lexical retrieval")
+        for i, result in zip(missing, self.search(queries, query_vectors, threshold=threshold, topk=topk, mode=mode)):
+            results[i] = result
+        return results
+
+    def cached_results(self, queries: List[str], threshold: float = 0.8, topk: int = 5,
+                       mode: str = 'dense') -> List[Optional[List[dict]]]:
+        """在检索结果缓存的精确层中查找，未命中（或未启用缓存）的查询对应 None"""
+        if self.result_cache is None:
+            return [None] * len(queries)
+        version = self._view.version
+        return [self.result_cache.get(query, (mode, threshold, topk), version) for query in queries]
+
+    def encode_query(self, queries: List[str]) -> Optional[np.ndarray]:
+        """计算查询向量；设置了 embed_timeout 时最多等待该时长，超时返回 None
+
+        超时的请求在后台继续完成并写入嵌入缓存，同样的查询下次可以直接命中。
+        """
+        if self.embed_timeout is None:
+            return self.encode_text(queries)
+        if self._query_pool is None:
+            self._query_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="query-embed")
+        future = self._query_pool.submit(self.encode_text, queries)
+        try:
+            return future.result(timeout=self.embed_timeout)
+        except FutureTimeoutError:
+            logger.warning(f"Query embedding timed out after {self.embed_timeout}s")
+            return None
+
+    def search(self, queries: List[str], query_vectors: Optional[np.ndarray], threshold: float = 0.8,
+               topk: int = 5, mode: str = 'dense') -> List[List[dict]]:
+        """用查询文本和（可选的）查询向量检索，每个查询返回一个结果列表
+
+        lexical 模式的 score 为 BM25 得分；hybrid 模式的 score 为倒数排名融合得分
+        sum(1 / (rrf_k + 名次))，并分别带上 dense_score 和 bm25_score（未被该路召回时为 None）。
+        query_vectors 为 None 时按 lexical 处理。
+
+        启用了检索结果缓存时，先在语义层查找向量足够接近的已缓存查询，检索结果随后写入缓存；
+        向量化失败而退化为 lexical 的结果不写入缓存。
+        """
+        view = self._view
+        cache = self.result_cache
+        if cache is None:
+            return self._search_view(view, queries, query_vectors, threshold, topk, mode)
+        params = (mode, threshold, topk)
+        # 混合检索还要求关键词集合相同，只差一个编号的查询不会共用结果
+        guards = [frozenset(tokenize(query)) if mode != 'dense' else None for query in queries]
+        results = [None] * len(queries)
+        if query_vectors is not None:
+            results = [cache.get_similar(vector, params, view.version, guard)
+                       for vector, guard in zip(query_vectors, guards)]
+        todo = [i for i, result in enumerate(results) if result is None]
+        if todo:
+            vectors = query_vectors[todo] if query_vectors is not None else None
+            searched = self._search_view(view, [queries[i] for i in todo], vectors, threshold, topk, mode)
+            for i, result in zip(todo, searched):
+                results[i] = result
+                if vectors is not None or mode == 'lexical':
+                    cache.put(queries[i], params, view.version, result,
+                              vector=query_vectors[i] if query_vectors is not None else None, guard=guards[i])
+        return results
+
+    def _search_view(self, view: IndexView, queries: List[str], query_vectors: Optional[np.ndarray],
+                     threshold: float, topk: int, mode: str) -> List[List[dict]]:
+        if mode == 'lexical' or query_vectors is None:
+            all_results = []
+            for query in queries:
+                results = []
+                for idx, score in self._lexical_hits(view, query, topk):
+                    result = view.result(idx)
+                    result.update({'score': score, 'bm25_score': score})
+                    results.append(result)
+                all_results.append(results)
+            return all_results
+        if mode == 'dense':
+            return self._dense_results(view, self._dense_hits(view, query_vectors, threshold, topk))
+
+        candidates = topk * self.hybrid_candidates
+        dense_hits = self._dense_hits(view, query_vectors, threshold, candidates)
+        all_results = []
+        for query, dense in zip(queries, dense_hits):
+            dense = [(idx, score) for idx, score, _ in dense]
+            lexical = self._lexical_hits(view, query, candidates)
+            results = []
+            for idx, score, dense_score, bm25_score in reciprocal_rank_fusion(dense, lexical, topk, self.rrf_k):
+                result = view.result(idx)
+                result.update({'score': score, 'dense_score': dense_score, 'bm25_score': bm25_score})
+                results.append(result)
+            all_results.append(results)
+        return all_results
+
+    def _lexical_hits(self, view: IndexView, query: str, topk: int) -> List[tuple]:
+        """BM25 检索，返回 (全局编号, 得分)，只包含快照中已发布且未删除的分块"""
+        with stage_metrics.time('lexical_search'):
+            scores, indices = view.bm25.search(query, topk, limit=view.ntotal, exclude=view.tombstones)
+        return list(zip(indices.tolist(), scores.tolist()))
+
+    def chunk_vectors(self, ids: List[int], versions: Optional[List[Optional[int]]] = None) -> Optional[np.ndarray]:
+        """从索引中取出分块向量（量化、降维或 PQ 索引得到的是近似值）
+
+        versions 与 ids 一一对应，为各检索结果的 index_version。检索之后分块被重新编号（压缩、重建）时，
+        从重新编号前保留的旧快照中按旧编号取回；未给出版本的编号须来自当前快照。
+
+        Returns:
+            (len(ids), dimension) 的 float32 矩阵，编号已失效、旧快照已不再保留或索引不支持取回时返回 None
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        if versions is None:
+            return self._reconstruct(self._view, ids)
+        vectors = np.empty((len(ids), self.dimension), dtype=np.float32)
+        for version in set(versions):
+            view = self._numbered_view(version)
+            if view is None:
+                logger.debug(f"Chunk numbering of index version {version} is no longer retained")
+                return None
+            rows = np.array([i for i, v in enumerate(versions) if v == version], dtype=np.int64)
+            part = self._reconstruct(view, ids[rows])
+            if part is None:
+                return None
+            vectors[rows] = part
+        return vectors
+
+    def _numbered_view(self, version: Optional[int]) -> Optional[IndexView]:
+        """分块编号方式与 version 快照相同的快照：当前快照，或重新编号前保留的旧快照"""
+        # 先读快照再读编号起点：写入方总是先更新编号起点和旧快照列表，再发布新快照
+        view = self._view
+        if version is None or version >= self._numbering_since:
+            return view
+        for since, retired, _ in self._retired_views:
+            if since <= version <= retired.version:
+                return retired
+        return None
+
+    def _reconstruct(self, view: IndexView, ids: np.ndarray) -> Optional[np.ndarray]:
+        if len(ids) and (ids.min() < 0 or ids.max() >= view.ntotal):
+            return None
+        vectors = np.empty((len(ids), self.dimension), dtype=np.float32)
+        offset = 0
+        for segment in view.segments:
+            rows = np.flatnonzero((ids >= offset) & (ids < offset + segment.ntotal))
+            if len(rows):
+                try:
+                    # IVF 类分段的编号映射在发布前已建立（见 _new_segment、load），这里不加锁、不修改分段
+                    vectors[rows] = segment.reconstruct_batch(ids[rows] - offset)
+                except RuntimeError as e:
+                    logger.warning(f"Cannot reconstruct vectors from {type(segment).__name__}: {e}")
+                    return None
+            offset += segment.ntotal
+        return vectors
+
+    def search_vectors(self, query_vectors: np.ndarray, threshold: float = 0.8, topk: int = 5) -> List[List[dict]]:
+        """用已计算好的查询向量检索，每个查询返回一个结果列表
+
+        每条结果都带 score（越大越相似）；l2 度量下另带 distance，score 为其相反数。
+        """
+        view = self._view
+        return self._dense_results(view, self._dense_hits(view, query_vectors, threshold, topk))
+
+    def _dense_results(self, view: IndexView, hits: List[List[tuple]]) -> List[List[dict]]:
+        all_results = []
+        for row in hits:
+            results = []
+            for idx, score, distance in row:
+                result = view.result(idx)
+                result['score'] = score
+                if distance is not None:
+                    result['distance'] = distance
+                results.append(result)
+            all_results.append(results)
+        return all_results
+
+    def _dense_hits(self, view: IndexView, query_vectors: np.ndarray, threshold: float,
+                    topk: int) -> List[List[tuple]]:
+        """向量检索，每个查询返回至多 topk 个 (全局编号, score, distance)，已去掉墓碑并按阈值过滤"""
+        query_vectors = self._prepare_vectors(query_vectors)
+        # 整个检索只使用同一个快照，不受并发导入和压缩的影响
+        with stage_metrics.time('dense_search'):
+            if self.metric == 'cosine':
+                # 阈值和墓碑都在索引内部生效，每个分段只需保留 topk 个候选
+                hits = self._range_search(view.segments, query_vectors, threshold, view.selectors(), limit=topk)
+            else:
+                # 墓碑在索引内部由 ID 过滤器跳过，只需取出 topk 条
+                k = max(min(topk, view.ntotal), 1)
+                distances, indices = self._search(view.segments, query_vectors, k, view.selectors())
+                hits = list(zip(distances, indices))
+
+        all_hits = []
+        for row_scores, row_indices in hits:
+            row = []
+            for idx, value in zip(row_indices, row_scores):
+                if idx < 0 or idx in view.tombstones:
+                    continue
+                if self.metric == 'cosine':
+                    row.append((int(idx), float(value), None))
+                elif value < threshold:
+                    row.append((int(idx), -float(value), float(value)))
+                else:
+                    continue
+                if len(row) >= topk:
+                    break
+            all_hits.append(row)
+        return all_hits
+
 if __name__ == "__main__":
     # 配置日志
     logging.basicConfig(
@@ -238,5 +1173,5 @@ if __name__ == "__main__":
     results = rag.retrieval("What are the main security threats in online communities?")
     print("\nSearch Results:")
     for i, result in enumerate(results, 1):
-        print(f"\n{i}. Distance: {result['distance']:.3f}")
+        print(f"\n{i}. Score: {result['score']:.3f}")
         print(f"Text: {result['text'][:200]}...")
\ No newline at end of file
@@ -0,0 +1,187 @@
+import numpy as np
+from collections import OrderedDict
+from typing import List, Optional
+import hashlib
+import logging
+import os
+import threading
+import time
+import zlib
+from embedding_cache import normalize_text
+logger = logging.getLogger(__name__)
+
+
+class OnnxCrossEncoder:
+    """本地 CPU cross-encoder：用 ONNX Runtime 对 (查询, 分块) 成对打分
+
+    model_dir 中需要 model.onnx（或 int8 量化后的 model_quantized.onnx）和 tokenizer.json，
+    例如 optimum-cli export onnx --model BAAI/bge-reranker-base models/bge-reranker-base，
+    小模型（如 cross-encoder/ms-marco-MiniLM-L-6-v2）在 CPU 上每对只需约 1ms。
+    量化可用 python local_embedding.py quantize <模型目录>。
+
+    打分器只需提供 model（模型名）和 score(query, texts) -> (len(texts),) 的 float32 数组，可以替换为其他实现。
+
+    依赖 onnxruntime 和 tokenizers（pip install onnxruntime tokenizers）。
+
+    Args:
+        model_dir: 模型目录
+        model: 模型名，默认为目录名
+        threads: ONNX Runtime 的算子内线程数，None 表示使用全部CPU核
+        max_length: (查询, 分块) 拼接后的最大序列长度，超出部分截断分块
+        quantized: 优先加载 model_quantized.onnx
+    """
+    def __init__(self, model_dir: str, model: Optional[str] = None, threads: Optional[int] = None,
+                 max_length: int = 512, quantized: bool = False):
+        try:
+            import onnxruntime
+            from tokenizers import Tokenizer
+        except ImportError as e:
+            raise ImportError("The onnx reranker requires onnxruntime and tokenizers: "
+                              "pip install onnxruntime tokenizers") from e
+        self.model = model or os.path.basename(os.path.normpath(model_dir))
+        model_path = os.path.join(model_dir, 'model.onnx')
+        quantized_path = os.path.join(model_dir, 'model_quantized.onnx')
+        if quantized and os.path.exists(quantized_path):
+            model_path = quantized_path
+        elif quantized:
+            logger.warning(f"{quantized_path} not found, using {model_path}")
+        options = onnxruntime.SessionOptions()
+        if threads:
+            options.intra_op_num_threads = threads
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = onnxruntime.InferenceSession(model_path, options, providers=['CPUExecutionProvider'])
+        self._input_names = {i.name for i in self.session.get_inputs()}
+
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_dir, 'tokenizer.json'))
+        self.tokenizer.enable_truncation(max_length, strategy='only_second')
+        self.tokenizer.no_padding()
+        logger.info(f"Loaded cross-encoder {model_path}")
+
+    def score(self, query: str, texts: List[str]) -> np.ndarray:
+        """一批 (query, text) 的相关性得分（logit），越大越相关"""
+        encodings = self.tokenizer.encode_batch([(query, text) for text in texts])
+        width = max(len(encoding.ids) for encoding in encodings)
+        input_ids = np.zeros((len(encodings), width), dtype=np.int64)
+        attention_mask = np.zeros((len(encodings), width), dtype=np.int64)
+        token_type_ids = np.zeros((len(encodings), width), dtype=np.int64)
+        for row, encoding in enumerate(encodings):
+            input_ids[row, :len(encoding.ids)] = encoding.ids
+            attention_mask[row, :len(encoding.ids)] = 1
+            token_type_ids[row, :len(encoding.ids)] = encoding.type_ids
+        feeds = {'input_ids': input_ids, 'attention_mask': attention_mask}
+        if 'token_type_ids' in self._input_names:
+            feeds['token_type_ids'] = token_type_ids
+        logits = self.session.run(None, feeds)[0]
+        # 单输出为相关性 logit；两类输出取"相关"一类
+        logits = logits.reshape(len(texts), -1)
+        return (logits[:, -1] if logits.shape[1] > 1 else logits[:, 0]).astype(np.float32)
+
+
+class Reranker:
+    """两阶段检索的第二阶段：对第一阶段超量召回的候选用 cross-encoder 重新打分排序
+
+    候选按第一阶段的顺序分批打分。每个请求有延迟预算：每个请求至少打分一批，之后每批结束时检查实际耗时，
+    已超出预算，或按本次请求测得的每对耗时预计剩余候选打不完时停止，返回第一阶段的顺序
+    （已打出的分数仍写入缓存，同样的查询下次可以直接用）。耗时估计不跨请求保留，偶尔一次慢批（如模型冷启动）
+    不会影响之后的请求。
+
+    得分按 (查询哈希, 分块编号) 缓存，并校验分块文本的 CRC，索引压缩后编号改变的分块不会误用旧分数。
+
+    Args:
+        scorer: 提供 score(query, texts) 的打分器，如 OnnxCrossEncoder
+        batch_size: 每批打分的候选数
+        budget: 每个请求的默认延迟预算（秒），None 表示不限时
+        cache_size: 缓存的 (查询, 分块) 得分数，0 表示不缓存
+    """
+    def __init__(self, scorer, batch_size: int = 16, budget: Optional[float] = 0.2, cache_size: int = 100000):
+        self.scorer = scorer
+        self.batch_size = batch_size
+        self.budget = budget
+        self.cache_size = cache_size
+        # (查询哈希, 分块编号) -> (文本 CRC, 得分)
+        self._cache: "OrderedDict[tuple, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {'requests': 0, 'reranked': 0, 'fallbacks': 0, 'cache_hits': 0, 'pairs_scored': 0, 'batches': 0}
+
+    @staticmethod
+    def _query_key(query: str) -> bytes:
+        return hashlib.sha256(normalize_text(query).casefold().encode('utf-8')).digest()[:16]
+
+    def _cached(self, query_key: bytes, results: List[dict]) -> List[Optional[float]]:
+        scores = []
+        with self._lock:
+            for result in results:
+                key = (query_key, result['chunk_id'])
+                entry = self._cache.get(key)
+                if entry is not None and entry[0] == zlib.crc32(result['text'].encode('utf-8')):
+                    self._cache.move_to_end(key)
+                    scores.append(entry[1])
+                else:
+                    scores.append(None)
+        return scores
+
+    def _store(self, query_key: bytes, results: List[dict], scores: np.ndarray):
+        if self.cache_size <= 0:
+            return
+        with self._lock:
+            for result, score in zip(results, scores):
+                key = (query_key, result['chunk_id'])
+                self._cache[key] = (zlib.crc32(result['text'].encode('utf-8')), float(score))
+                self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def _count(self, **deltas):
+        with self._lock:
+            for key, value in deltas.items():
+                self.stats[key] += value
+
+    def rerank(self, query: str, results: List[dict], topk: int, budget: Optional[float] = None) -> List[dict]:
+        """对检索结果重新排序并保留前 topk 个
+
+        Args:
+            query: 查询文本
+            results: 第一阶段按相关性排序的检索结果
+            topk: 返回的结果数
+            budget: 本次请求的延迟预算（秒），None 表示使用默认预算
+        Returns:
+            重排后的结果，score 为 cross-encoder 得分，first_stage_score 为原得分；
+            超出预算时为第一阶段的前 topk 个结果（不修改）
+        """
+        if not results:
+            return []
+        start = time.perf_counter()
+        budget = self.budget if budget is None else budget
+        query_key = self._query_key(query)
+        scores = self._cached(query_key, results)
+        missing = [i for i, score in enumerate(scores) if score is None]
+        self._count(requests=1, cache_hits=len(results) - len(missing))
+
+        scored, scoring_seconds = 0, 0.0
+        for offset in range(0, len(missing), self.batch_size):
+            batch = missing[offset:offset + self.batch_size]
+            batch_start = time.perf_counter()
+            batch_scores = self.scorer.score(query, [results[i]['text'] for i in batch])
+            now = time.perf_counter()
+            scored += len(batch)
+            scoring_seconds += now - batch_start
+            self._store(query_key, [results[i] for i in batch], batch_scores)
+            for i, score in zip(batch, batch_scores):
+                scores[i] = float(score)
+            self._count(pairs_scored=len(batch), batches=1)
+
+            remaining = len(missing) - offset - len(batch)
+            if budget is None or not remaining:
+                continue
+            # 每批之后检查实际耗时；按本次请求测得的每对耗时预计剩下的候选打不完时也立即退回
+            elapsed = now - start
+            if elapsed >= budget or elapsed + scoring_seconds / scored * remaining > budget:
+                logger.warning(f"Reranking {len(missing)} candidates would exceed the budget of "
+                               f"{budget * 1000:.0f}ms ({scored} scored in {elapsed * 1000:.0f}ms), "
+                               f"keeping first-stage order")
+                self._count(fallbacks=1)
+                return results[:topk]
+
+        order = sorted(range(len(results)), key=lambda i: -scores[i])[:topk]
+        self._count(reranked=1)
+        return [{**results[i], 'score': scores[i], 'first_stage_score': results[i]['score']} for i in order]
@@ -0,0 +1,152 @@
+import numpy as np
+from collections import OrderedDict
+from typing import Hashable, List, Optional
+import logging
+import threading
+import time
+from embedding_cache import normalize_text
+logger = logging.getLogger(__name__)
+
+
+class ResultCache:
+    """检索结果缓存
+
+    精确层的键为 (规范化并忽略大小写的查询, 检索参数)，命中时连嵌入请求和索引搜索都可以省掉；
+    可选的语义层保存每条结果对应的查询向量，新查询与某个已缓存查询的余弦相似度不低于 similarity 时
+    直接复用其结果，省掉索引搜索。
+
+    条目按 TTL 过期，超过 max_entries 时淘汰最久未使用的条目。每个条目属于一个索引版本，
+    查询时传入的版本比缓存中的新（索引发生了变化）就清空整个缓存；仍在使用旧快照的检索传入较旧的版本，
+    既不查找也不写入，不会把新版本的缓存清掉。
+
+    Args:
+        max_entries: 最多缓存的查询数
+        ttl: 条目的有效期（秒）
+        similarity: 语义层的余弦相似度下限（如 0.97），None 表示不启用语义层
+    """
+    def __init__(self, max_entries: int = 1024, ttl: float = 300.0, similarity: Optional[float] = None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.similarity = similarity
+        self._lock = threading.Lock()
+        # 键 -> [过期时间, 结果, 语义层槽位]
+        self._entries: "OrderedDict[tuple, list]" = OrderedDict()
+        self._version = None
+        # 语义层：每个槽位一行归一化的查询向量，空槽位为全零
+        self._vectors: Optional[np.ndarray] = None
+        self._slot_keys: List[Optional[tuple]] = [None] * max_entries
+        self._slot_guards: List[Optional[Hashable]] = [None] * max_entries
+        self._free = list(range(max_entries - 1, -1, -1))
+        self.stats = {'hits': 0, 'semantic_hits': 0, 'misses': 0, 'evictions': 0, 'invalidations': 0, 'stale': 0}
+
+    @staticmethod
+    def _key(query: str, params: tuple) -> tuple:
+        return normalize_text(query).casefold(), params
+
+    def _sync_version(self, version: int) -> bool:
+        """索引版本更新时清空缓存，返回 version 是否为当前版本；比缓存旧的版本返回 False（调用方持有锁）"""
+        if version == self._version:
+            return True
+        if self._version is not None and version < self._version:
+            self.stats['stale'] += 1
+            return False
+        if self._entries:
+            self.stats['invalidations'] += 1
+            logger.debug(f"Index changed to version {version}, dropping {len(self._entries)} cached results")
+        self._entries.clear()
+        if self._vectors is not None:
+            self._vectors[:] = 0
+        self._slot_keys = [None] * self.max_entries
+        self._slot_guards = [None] * self.max_entries
+        self._free = list(range(self.max_entries - 1, -1, -1))
+        self._version = version
+        return True
+
+    def _drop(self, key: tuple):
+        """删除一个条目并释放其语义层槽位（调用方持有锁）"""
+        entry = self._entries.pop(key)
+        slot = entry[2]
+        if slot is not None:
+            self._vectors[slot] = 0
+            self._slot_keys[slot] = None
+            self._slot_guards[slot] = None
+            self._free.append(slot)
+
+    @staticmethod
+    def _copy(results: List[dict]) -> List[dict]:
+        return [dict(result) for result in results]
+
+    def get(self, query: str, params: tuple, version: int) -> Optional[List[dict]]:
+        """精确层查找，未命中时返回 None"""
+        key = self._key(query, params)
+        with self._lock:
+            if not self._sync_version(version):
+                self.stats['misses'] += 1
+                return None
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] < time.monotonic():
+                self._drop(key)
+                entry = None
+            if entry is None:
+                self.stats['misses'] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.stats['hits'] += 1
+            return self._copy(entry[1])
+
+    def get_similar(self, vector: np.ndarray, params: tuple, version: int,
+                    guard: Optional[Hashable] = None) -> Optional[List[dict]]:
+        """语义层查找：返回与 vector 最相似、参数和 guard 都相同的已缓存查询的结果
+
+        guard 是额外必须完全相同的条件，例如混合检索时查询的关键词集合，
+        避免只差一个 CVE 编号的两个查询因为向量接近而共用结果。
+        """
+        if self.similarity is None:
+            return None
+        vector = np.asarray(vector, dtype=np.float32)
+        vector = vector / max(float(np.linalg.norm(vector)), 1e-12)
+        with self._lock:
+            if not self._sync_version(version):
+                return None
+            if self._vectors is None or len(self._vectors[0]) != len(vector):
+                return None
+            scores = self._vectors @ vector
+            now = time.monotonic()
+            for slot in np.argsort(-scores):
+                if scores[slot] < self.similarity:
+                    break
+                key = self._slot_keys[slot]
+                if key is None or key[1] != params or self._slot_guards[slot] != guard:
+                    continue
+                entry = self._entries[key]
+                if entry[0] < now:
+                    self._drop(key)
+                    continue
+                self._entries.move_to_end(key)
+                self.stats['semantic_hits'] += 1
+                return self._copy(entry[1])
+        return None
+
+    def put(self, query: str, params: tuple, version: int, results: List[dict],
+            vector: Optional[np.ndarray] = None, guard: Optional[Hashable] = None):
+        """缓存一个查询的结果；提供 vector 且启用了语义层时同时写入语义层"""
+        key = self._key(query, params)
+        with self._lock:
+            if not self._sync_version(version):
+                return
+            if key in self._entries:
+                self._drop(key)
+            while len(self._entries) >= self.max_entries:
+                self._drop(next(iter(self._entries)))
+                self.stats['evictions'] += 1
+            slot = None
+            if vector is not None and self.similarity is not None:
+                vector = np.asarray(vector, dtype=np.float32)
+                if self._vectors is None:
+                    self._vectors = np.zeros((self.max_entries, len(vector)), dtype=np.float32)
+                if len(self._vectors[0]) == len(vector):
+                    slot = self._free.pop()
+                    self._vectors[slot] = vector / max(float(np.linalg.norm(vector)), 1e-12)
+                    self._slot_keys[slot] = key
+                    self._slot_guards[slot] = guard
+            self._entries[key] = [time.monotonic() + self.ttl, self._copy(results), slot]
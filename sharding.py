@@ -0,0 +1,466 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+import heapq
+import logging
+import multiprocessing
+import os
+import pickle
+import shutil
+import socket
+import socketserver
+import struct
+import sys
+import tempfile
+import threading
+import zlib
+import numpy as np
+from embedding_cache import EmbeddingCache
+from embedding_client import EmbeddingClient
+from metrics import stage_metrics
+from rag import RETRIEVAL_MODES, SecurityRAGSystem, reciprocal_rank_fusion
+logger = logging.getLogger(__name__)
+
+# 全局分块编号 = 分片号 * SHARD_ID_STRIDE + 分片内编号，同一分片中相邻的分块全局编号也相邻
+SHARD_ID_STRIDE = 1 << 40
+_HEADER = struct.Struct('<Q')
+# ShardClient.call 未指定 timeout 时使用连接池的默认超时
+_DEFAULT_TIMEOUT = object()
+
+
+class ShardError(Exception):
+    """分片进程不可用或执行请求失败"""
+
+
+def _recv_exactly(sock: socket.socket, n: int) -> Optional[bytes]:
+    buffer = bytearray()
+    while len(buffer) < n:
+        data = sock.recv(n - len(buffer))
+        if not data:
+            return None
+        buffer += data
+    return bytes(buffer)
+
+
+def send_message(sock: socket.socket, obj):
+    """长度前缀 + pickle 的消息帧；只用于本机上由协调进程启动的分片进程之间"""
+    data = pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)
+    sock.sendall(_HEADER.pack(len(data)) + data)
+
+
+def recv_message(sock: socket.socket):
+    """读取一个消息帧，对端关闭连接时返回 None"""
+    header = _recv_exactly(sock, _HEADER.size)
+    if header is None:
+        return None
+    data = _recv_exactly(sock, _HEADER.unpack(header)[0])
+    if data is None:
+        raise ConnectionError("connection closed in the middle of a message")
+    return pickle.loads(data)
+
+
+def shard_for(path: str, n_shards: int) -> int:
+    """按规范化路径的哈希把论文分配到分片，同一篇论文总在同一个分片"""
+    return zlib.crc32(os.path.normpath(path).encode('utf-8')) % n_shards
+
+
+class ShardWorker:
+    """分片进程中对外提供的操作，每个分片拥有独立的 SecurityRAGSystem（索引、分块存储、导入清单）"""
+    METHODS = ('search', 'add_documents', 'insert_chunks', 'remove_document', 'sync', 'save',
+               'chunk_vectors', 'stats')
+
+    def __init__(self, rag_system: SecurityRAGSystem):
+        self.rag_system = rag_system
+
+    def search(self, queries: List[str], query_vectors: Optional[np.ndarray], threshold: float, topk: int,
+               modes: tuple) -> dict:
+        """每种模式（dense / lexical）各返回一组结果，由协调进程合并"""
+        return {mode: self.rag_system.search(queries, query_vectors if mode == 'dense' else None,
+                                             threshold=threshold, topk=topk, mode=mode)
+                for mode in modes}
+
+    def add_documents(self, pdf_path: str) -> bool:
+        return self.rag_system.add_documents(pdf_path)
+
+    def insert_chunks(self, pdf_path: str, chunks_with_metadata: List[dict], vectors: np.ndarray,
+                      title: Optional[str] = None):
+        self.rag_system.insert_chunks(pdf_path, chunks_with_metadata, vectors, title=title)
+
+    def remove_document(self, pdf_path: str) -> bool:
+        return self.rag_system.remove_document(pdf_path)
+
+    def sync(self, pdf_paths: List[str], papers_dir: str, present: List[str]) -> dict:
+        """导入分配给本分片的论文，删除目录中已不存在的论文（present 为目录中的全部论文）"""
+        stats = {'added': 0, 'unchanged': 0, 'removed': 0}
+        for pdf_path in pdf_paths:
+            stats['added' if self.rag_system.add_documents(pdf_path) else 'unchanged'] += 1
+        present = set(present)
+        papers_root = os.path.normpath(papers_dir)
+        for path in self.rag_system.manifest_paths():
+            if os.path.dirname(path) == papers_root and path not in present:
+                self.rag_system.remove_document(path)
+                stats['removed'] += 1
+        return stats
+
+    def save(self):
+        if self.rag_system.store is not None:
+            self.rag_system.save()
+
+    def chunk_vectors(self, ids: List[int], versions: Optional[List[Optional[int]]] = None) -> Optional[np.ndarray]:
+        return self.rag_system.chunk_vectors(ids, versions)
+
+    def stats(self) -> dict:
+        view = self.rag_system._view
+        return {'chunks': view.ntotal, 'live_chunks': view.ntotal - len(view.tombstones),
+                'segments': len(view.segments), 'documents': len(self.rag_system.manifest)}
+
+
+class _ShardSocketServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # 协调进程等待超时后会关闭连接，之后写回响应失败是预期情况
+        if isinstance(sys.exc_info()[1], ConnectionError):
+            return
+        super().handle_error(request, client_address)
+
+
+def serve_shard(socket_path: str, options: dict, ready):
+    """分片进程的入口：创建本分片的 RAG 系统，在 Unix 套接字上处理协调进程的请求直到收到 shutdown"""
+    options = dict(options)
+    embed_url = options.pop('embed_url', None)
+    embed_model = options.pop('embed_model', None)
+    if embed_url is not None:
+        options['embedder'] = EmbeddingClient(embed_url, options.get('api_key', ''), embed_model)
+    worker = ShardWorker(SecurityRAGSystem(**options))
+
+    class Handler(socketserver.BaseRequestHandler):
+        def handle(self):
+            while True:
+                message = recv_message(self.request)
+                if message is None:
+                    return
+                method, args = message
+                if method == 'shutdown':
+                    send_message(self.request, ('ok', None))
+                    threading.Thread(target=self.server.shutdown, daemon=True).start()
+                    return
+                try:
+                    if method not in ShardWorker.METHODS:
+                        raise ValueError(f"Unknown shard method: {method}")
+                    response = ('ok', getattr(worker, method)(*args))
+                except Exception as e:
+                    logger.error(f"Shard request {method} failed: {e}")
+                    response = ('error', f"{type(e).__name__}: {e}")
+                send_message(self.request, response)
+
+    server = _ShardSocketServer(socket_path, Handler)
+    ready.set()
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+
+class ShardClient:
+    """到一个分片进程的连接池，每个并发请求独占一条连接
+
+    Args:
+        socket_path: 分片进程的 Unix 套接字路径
+        timeout: 默认的请求超时（秒），None 表示一直等待；分片卡住时调用方得到 ShardError 而不是一直阻塞
+    """
+    def __init__(self, socket_path: str, timeout: Optional[float] = 10.0):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self._idle: List[socket.socket] = []
+        self._lock = threading.Lock()
+
+    def call(self, method: str, *args, timeout=_DEFAULT_TIMEOUT):
+        """调用分片上的方法；timeout 覆盖默认超时，超时或连接失败时抛出 ShardError"""
+        timeout = self.timeout if timeout is _DEFAULT_TIMEOUT else timeout
+        with self._lock:
+            sock = self._idle.pop() if self._idle else None
+        try:
+            if sock is None:
+                sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                sock.settimeout(timeout)
+                sock.connect(self.socket_path)
+            sock.settimeout(timeout)
+            send_message(sock, (method, args))
+            response = recv_message(sock)
+            if response is None:
+                raise ConnectionError("shard closed the connection")
+        except BaseException as e:
+            # 没有完整往返（超时、连接错误、序列化失败或被中断）的连接上可能残留半条消息，
+            # 迟到的响应也会错位到下一个请求上，一律关闭不再复用
+            if sock is not None:
+                sock.close()
+            if isinstance(e, socket.timeout):
+                raise ShardError(f"{self.socket_path}: {method} timed out after {timeout}s") from e
+            if isinstance(e, Exception):
+                raise ShardError(f"{self.socket_path}: {method} failed: {type(e).__name__}: {e}") from e
+            raise
+        # 只有完整收到响应的连接才放回连接池
+        with self._lock:
+            self._idle.append(sock)
+        status, value = response
+        if status != 'ok':
+            raise ShardError(value)
+        return value
+
+    def close(self):
+        with self._lock:
+            for sock in self._idle:
+                sock.close()
+            self._idle = []
+
+
+class ShardedRAGSystem:
+    """分片检索：论文按路径哈希分配到 n_shards 个分片进程，每个进程拥有独立的索引和分块存储
+
+    协调进程只计算一次查询向量，通过 Unix 套接字把检索并发地发给所有分片（scatter），
+    再用堆合并各分片的 top-k 并在全局应用阈值（gather）。混合检索时两路候选分别在全局合并后
+    再做倒数排名融合；BM25 的 IDF 按分片内统计，分片之间的得分只是近似可比。
+    近重复检测只在分片内部进行。
+
+    导入时各分片并行解析、向量化和写索引，吞吐随分片数（CPU 核数）增长。
+    返回结果的 chunk_id 为全局编号（见 SHARD_ID_STRIDE），另带 shard 字段。
+
+    Args:
+        n_shards: 分片进程数
+        store_dir: 存储目录，分片 i 使用其中的 shard{i} 子目录；None 表示不落盘
+        embed_url: 嵌入接口地址，None 表示使用 SecurityRAGSystem 的默认接口
+        api_key: 嵌入接口的 API 密钥
+        embed_model: 嵌入模型名
+        embed_cache_bytes: 嵌入缓存的大小，协调进程（查询向量）和每个分片（分块向量）各一份
+        mp_context: 分片进程的启动方式，默认 spawn，不继承协调进程的线程和锁
+        request_timeout: 检索等读请求的超时（秒），超时的分片按失败处理，检索返回其余分片的结果
+        write_timeout: 导入、同步、保存等写请求的超时（秒），None 表示一直等待
+        其余参数传给每个分片的 SecurityRAGSystem
+    """
+    def __init__(self, n_shards: int, store_dir: Optional[str] = None, embed_url: Optional[str] = None,
+                 api_key: str = "your_api_key", embed_model: str = "BAAI/bge-large-en-v1.5",
+                 index_type: str = 'flat', index_params: Optional[dict] = None, metric: str = 'l2',
+                 dedup_threshold: Optional[float] = 0.85, embed_cache_bytes: int = 64 * 1024 * 1024,
+                 mp_context: str = 'spawn', request_timeout: Optional[float] = 10.0,
+                 write_timeout: Optional[float] = 3600.0):
+        self.n_shards = n_shards
+        self.request_timeout = request_timeout
+        self.write_timeout = write_timeout
+        self.store_dir = store_dir
+        self.metric = metric
+        self.embed_model = embed_model
+        self.embedder = EmbeddingClient(embed_url or "https://api.siliconflow.cn/v1/embeddings", api_key, embed_model)
+        self.dimension = getattr(self.embedder, 'dimension', None) or 1024
+        self.embed_cache = EmbeddingCache(embed_model, max_bytes=embed_cache_bytes) if embed_cache_bytes > 0 else None
+        self.hybrid_candidates = 4
+        self.rrf_k = 60
+        self._options = {
+            'api_key': api_key, 'index_type': index_type, 'index_params': index_params, 'metric': metric,
+            'dedup_threshold': dedup_threshold, 'embed_cache_bytes': embed_cache_bytes,
+            'embed_url': embed_url, 'embed_model': embed_model
+        }
+        self._context = multiprocessing.get_context(mp_context)
+        self._socket_dir = None
+        self._processes = []
+        self.shards: List[ShardClient] = []
+        self._pool = None
+
+    def start(self, timeout: float = 120.0):
+        """启动全部分片进程并等待它们就绪（包括从磁盘加载索引）"""
+        self._socket_dir = tempfile.mkdtemp(prefix='rag-shards-')
+        events = []
+        for i in range(self.n_shards):
+            options = dict(self._options)
+            if self.store_dir is not None:
+                options['store_dir'] = os.path.join(self.store_dir, f"shard{i}")
+            socket_path = os.path.join(self._socket_dir, f"shard{i}.sock")
+            ready = self._context.Event()
+            process = self._context.Process(target=serve_shard, args=(socket_path, options, ready),
+                                            name=f"rag-shard-{i}", daemon=True)
+            process.start()
+            self._processes.append(process)
+            self.shards.append(ShardClient(socket_path, timeout=self.request_timeout))
+            events.append(ready)
+        for i, ready in enumerate(events):
+            if not ready.wait(timeout):
+                self.close()
+                raise ShardError(f"Shard {i} did not start within {timeout}s")
+        self._pool = ThreadPoolExecutor(max_workers=self.n_shards * 4, thread_name_prefix="shard-scatter")
+        logger.info(f"Started {self.n_shards} shard processes")
+        return self
+
+    def close(self, timeout: float = 10.0):
+        for shard, process in zip(self.shards, self._processes):
+            if process.is_alive():
+                try:
+                    shard.call('shutdown')
+                except ShardError:
+                    pass
+            shard.close()
+        for process in self._processes:
+            process.join(timeout)
+            if process.is_alive():
+                process.terminate()
+        if self._pool is not None:
+            self._pool.shutdown(wait=False)
+        if self._socket_dir is not None:
+            shutil.rmtree(self._socket_dir, ignore_errors=True)
+        self.embedder.close()
+        self._processes, self.shards, self._pool = [], [], None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _scatter(self, calls: List[tuple], tolerate_errors: bool = False, timeout=_DEFAULT_TIMEOUT) -> list:
+        """并发执行 (分片号, 方法, 参数...)，按顺序返回结果；tolerate_errors 时失败或超时的分片返回 None"""
+        futures = [self._pool.submit(self.shards[shard].call, method, *args, timeout=timeout)
+                   for shard, method, *args in calls]
+        results = []
+        for (shard, method, *_), future in zip(calls, futures):
+            try:
+                results.append(future.result())
+            except ShardError as e:
+                if not tolerate_errors:
+                    raise
+                logger.error(f"Shard {shard} {method} failed, results will be partial: {e}")
+                results.append(None)
+        return results
+
+    def encode_text(self, texts: List[str]) -> Optional[np.ndarray]:
+        """计算查询向量，失败时返回 None"""
+        try:
+            if self.embed_cache is not None:
+                return self.embed_cache.get_or_embed(texts, self.embedder.embed)
+            return self.embedder.embed(texts)
+        except Exception as e:
+            logger.error(f"Embedding error: {e}")
+            return None
+
+    def retrieval(self, query: str, threshold: float = 0.8, topk: int = 5, mode: str = 'dense') -> List[dict]:
+        return self.retrieval_batch([query], threshold=threshold, topk=topk, mode=mode)[0]
+
+    def retrieval_batch(self, queries: List[str], threshold: float = 0.8, topk: int = 5,
+                        mode: str = 'dense') -> List[List[dict]]:
+        """与 SecurityRAGSystem.retrieval_batch 相同，向量化失败时退化为 lexical"""
+        if mode not in RETRIEVAL_MODES:
+            raise ValueError(f"Unknown retrieval mode: {mode}, expected one of {RETRIEVAL_MODES}")
+        if not queries:
+            return []
+        query_vectors = None
+        if mode != 'lexical':
+            with stage_metrics.time('query_embed'):
+                query_vectors = self.encode_text(list(queries))
+            if query_vectors is None:
+                logger.warning("Query embedding unavailable, falling back to lexical retrieval")
+        return self.search(queries, query_vectors, threshold=threshold, topk=topk, mode=mode)
+
+    def _passes(self, result: dict, threshold: float) -> bool:
+        if self.metric == 'cosine':
+            return result['score'] >= threshold
+        return result['distance'] < threshold
+
+    def search(self, queries: List[str], query_vectors: Optional[np.ndarray], threshold: float = 0.8,
+               topk: int = 5, mode: str = 'dense') -> List[List[dict]]:
+        """在所有分片上检索并合并，结果格式与 SecurityRAGSystem.search 相同"""
+        if query_vectors is None:
+            mode = 'lexical'
+        modes = ('dense', 'lexical') if mode == 'hybrid' else (mode,)
+        k = topk * self.hybrid_candidates if mode == 'hybrid' else topk
+        with stage_metrics.time('shard_scatter'):
+            parts = self._scatter([(i, 'search', list(queries), query_vectors, threshold, k, modes)
+                                   for i in range(self.n_shards)], tolerate_errors=True)
+        merged = {m: [[] for _ in queries] for m in modes}
+        for shard, part in enumerate(parts):
+            if part is None:
+                continue
+            for m in modes:
+                for q, rows in enumerate(part[m]):
+                    for result in rows:
+                        result['chunk_id'] = shard * SHARD_ID_STRIDE + result['chunk_id']
+                        result['shard'] = shard
+                    merged[m][q].extend(rows)
+
+        key = lambda result: result['score']
+        if mode == 'lexical':
+            return [heapq.nlargest(topk, rows, key=key) for rows in merged['lexical']]
+        if mode == 'dense':
+            return [heapq.nlargest(topk, (r for r in rows if self._passes(r, threshold)), key=key)
+                    for rows in merged['dense']]
+
+        all_results = []
+        for dense_rows, lexical_rows in zip(merged['dense'], merged['lexical']):
+            dense = heapq.nlargest(k, (r for r in dense_rows if self._passes(r, threshold)), key=key)
+            lexical = heapq.nlargest(k, lexical_rows, key=key)
+            by_id = {r['chunk_id']: r for r in lexical}
+            by_id.update((r['chunk_id'], r) for r in dense)
+            results = []
+            for chunk_id, score, dense_score, bm25_score in reciprocal_rank_fusion(
+                    [(r['chunk_id'], r['score']) for r in dense], [(r['chunk_id'], r['score']) for r in lexical],
+                    topk, self.rrf_k):
+                result = dict(by_id[chunk_id])
+                result.pop('distance', None)
+                result.update({'score': score, 'dense_score': dense_score, 'bm25_score': bm25_score})
+                results.append(result)
+            all_results.append(results)
+        return all_results
+
+    def chunk_vectors(self, ids: List[int], versions: Optional[List[Optional[int]]] = None) -> Optional[np.ndarray]:
+        """按全局编号从各分片取回分块向量，任一分片失败时返回 None
+
+        versions 为各结果所在分片的快照版本（见 SecurityRAGSystem.chunk_vectors），按分片拆分后转发。
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        shards = ids // SHARD_ID_STRIDE
+        calls = [(int(shard), 'chunk_vectors', (ids[shards == shard] % SHARD_ID_STRIDE).tolist(),
+                  None if versions is None else [v for v, s in zip(versions, shards) if s == shard])
+                 for shard in np.unique(shards)]
+        try:
+            parts = self._scatter(calls)
+        except ShardError as e:
+            logger.warning(f"Cannot fetch chunk vectors: {e}")
+            return None
+        if any(part is None for part in parts):
+            return None
+        vectors = None
+        for (shard, *_), part in zip(calls, parts):
+            if vectors is None:
+                vectors = np.empty((len(ids), part.shape[1]), dtype=np.float32)
+            vectors[shards == shard] = part
+        return vectors
+
+    def add_documents(self, pdf_path: str) -> bool:
+        return self.shards[shard_for(pdf_path, self.n_shards)].call('add_documents', pdf_path,
+                                                                    timeout=self.write_timeout)
+
+    def insert_chunks(self, pdf_path: str, chunks_with_metadata: List[dict], vectors: np.ndarray,
+                      title: Optional[str] = None):
+        self.shards[shard_for(pdf_path, self.n_shards)].call('insert_chunks', pdf_path, chunks_with_metadata,
+                                                             vectors, title, timeout=self.write_timeout)
+
+    def remove_document(self, pdf_path: str) -> bool:
+        return self.shards[shard_for(pdf_path, self.n_shards)].call('remove_document', pdf_path,
+                                                                    timeout=self.write_timeout)
+
+    def sync_directory(self, papers_dir: str) -> dict:
+        """各分片并行同步分配给它的论文，返回汇总的统计"""
+        pdf_paths = [os.path.join(papers_dir, file) for file in sorted(os.listdir(papers_dir))
+                     if file.endswith('.pdf')]
+        present = [os.path.normpath(path) for path in pdf_paths]
+        assigned = [[] for _ in range(self.n_shards)]
+        for path in pdf_paths:
+            assigned[shard_for(path, self.n_shards)].append(path)
+        parts = self._scatter([(i, 'sync', assigned[i], papers_dir, present) for i in range(self.n_shards)],
+                              timeout=self.write_timeout)
+        stats = {key: sum(part[key] for part in parts) for key in ('added', 'unchanged', 'removed')}
+        logger.info(f"Synced {papers_dir} across {self.n_shards} shards: {stats}")
+        return stats
+
+    def save(self):
+        self._scatter([(i, 'save') for i in range(self.n_shards)], timeout=self.write_timeout)
+
+    def stats(self) -> List[dict]:
+        """每个分片的分块数、分段数和文档数"""
+        return self._scatter([(i, 'stats') for i in range(self.n_shards)])
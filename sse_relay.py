@@ -0,0 +1,221 @@
+from typing import AsyncIterator, Callable, Iterator, Optional
+import logging
+import threading
+import time
+import httpx
+logger = logging.getLogger(__name__)
+
+_DONE_EVENT = b"data: [DONE]\n\n"
+
+
+class RelayError(Exception):
+    """上游 LLM 返回了非 200 状态"""
+    def __init__(self, status_code: int, message: str):
+        super().__init__(f"Upstream returned {status_code}: {message}")
+        self.status_code = status_code
+
+
+def _event_boundary(buffer: bytearray) -> int:
+    """最后一个完整 SSE 事件之后的位置，没有完整事件时返回 0"""
+    return max(buffer.rfind(b"\n\n") + 2, buffer.rfind(b"\r\n\r\n") + 4, 0)
+
+
+class SSECoalescer:
+    """按完整事件边界合并上游的 SSE 字节
+
+    第一个事件立即发出，不增加首 token 延迟；之后距上次发出不足 flush_interval 时先积攒，
+    几十个 token 合成一次写出，减少下游的系统调用和分块编码开销。积攒的数据在下一段上游数据到达
+    或流结束时发出，因此额外延迟不超过 flush_interval 与相邻 token 间隔中的较大者。
+    """
+    def __init__(self, flush_interval: float = 0.02, max_buffer: int = 64 * 1024):
+        self.flush_interval = flush_interval
+        self.max_buffer = max_buffer
+        self._buffer = bytearray()
+        self._last_flush = None
+        self._tail = b""
+        self.flushes = 0
+
+    def feed(self, data: bytes, now: float) -> Optional[bytes]:
+        """加入一段上游数据，需要发出时返回要写给下游的字节"""
+        self._buffer += data
+        if self._last_flush is not None and now - self._last_flush < self.flush_interval \
+                and len(self._buffer) < self.max_buffer:
+            return None
+        end = _event_boundary(self._buffer)
+        if not end:
+            return None
+        out = bytes(self._buffer[:end])
+        del self._buffer[:end]
+        self._last_flush = now
+        self._tail = out[-len(_DONE_EVENT):]
+        self.flushes += 1
+        return out
+
+    def finish(self) -> bytes:
+        """上游结束：发出剩余数据，上游没有发送 [DONE] 时补上"""
+        out = bytes(self._buffer)
+        self._buffer.clear()
+        if not (self._tail + out).rstrip().endswith(b"data: [DONE]"):
+            if out and not out.endswith(b"\n\n"):
+                out += b"\n\n"
+            out += _DONE_EVENT
+        self.flushes += 1
+        return out
+
+
+class _RelayBase:
+    def __init__(self, base_url: str, api_key: str, flush_interval: float):
+        self.url = base_url.rstrip('/') + '/chat/completions'
+        self.headers = {'Authorization': f"Bearer {api_key}", 'Accept': 'text/event-stream',
+                        # 原样转发字节，上游不能压缩
+                        'Accept-Encoding': 'identity'}
+        self.flush_interval = flush_interval
+        self.stats = {'streams': 0, 'completed': 0, 'cancelled': 0, 'upstream_errors': 0, 'bytes': 0, 'flushes': 0}
+        self._lock = threading.Lock()
+
+    def _count(self, **deltas):
+        with self._lock:
+            for key, value in deltas.items():
+                self.stats[key] += value
+
+    def _upstream_error(self, status_code: int, body: bytes) -> RelayError:
+        self._count(upstream_errors=1)
+        message = body.decode('utf-8', errors='replace')[:500]
+        logger.error(f"Upstream LLM returned {status_code}: {message}")
+        return RelayError(status_code, message)
+
+
+class SSERelay(_RelayBase):
+    """把上游 LLM 的流式响应（SSE）原样转发给客户端
+
+    与 OpenAI SDK 逐个解析片段再 model_dump、json.dumps 不同，这里不解析 JSON，只按事件边界合并字节后转发。
+    上游连接来自 httpx 的连接池，在请求之间复用；下游客户端断开时关闭上游响应，上游不再继续生成。
+
+    Args:
+        base_url: 上游 OpenAI 兼容接口的地址（如 http://localhost:8000/v1）
+        api_key: 上游的 API 密钥
+        flush_interval: 合并相邻 token 的时间窗口（秒），0 表示每段数据都立即转发
+        max_connections: 连接池的最大连接数
+        timeout: 连接和读取超时（秒）
+    """
+    def __init__(self, base_url: str, api_key: str, flush_interval: float = 0.02, max_connections: int = 100,
+                 timeout: float = 120.0):
+        super().__init__(base_url, api_key, flush_interval)
+        self.client = httpx.Client(
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+            timeout=httpx.Timeout(timeout, connect=10.0)
+        )
+
+    def open(self, payload: dict, on_first_chunk: Optional[Callable[[], None]] = None,
+             on_complete: Optional[Callable[[], None]] = None) -> "RelayStream":
+        """发送流式请求并等待响应头；上游返回错误状态时抛出 RelayError，此时还没有向客户端写出任何内容"""
+        request = self.client.build_request('POST', self.url, json={**payload, 'stream': True}, headers=self.headers)
+        response = self.client.send(request, stream=True)
+        if response.status_code != 200:
+            try:
+                body = response.read()
+            finally:
+                response.close()
+            raise self._upstream_error(response.status_code, body)
+        self._count(streams=1)
+        return RelayStream(self, response, on_first_chunk, on_complete)
+
+    def close(self):
+        self.client.close()
+
+
+class RelayStream:
+    """一个正在转发的流，作为 WSGI 响应体迭代；服务器在客户端断开或响应结束时调用 close()"""
+    def __init__(self, relay: SSERelay, response: httpx.Response, on_first_chunk=None, on_complete=None):
+        self.relay = relay
+        self.response = response
+        self.on_first_chunk = on_first_chunk
+        self.on_complete = on_complete
+        self._completed = False
+        self._closed = False
+
+    def __iter__(self) -> Iterator[bytes]:
+        coalescer = SSECoalescer(self.relay.flush_interval)
+        sent = 0
+        try:
+            for data in self.response.iter_raw():
+                out = coalescer.feed(data, time.perf_counter())
+                if out:
+                    if sent == 0 and self.on_first_chunk is not None:
+                        self.on_first_chunk()
+                    sent += len(out)
+                    yield out
+            out = coalescer.finish()
+            sent += len(out)
+            self._completed = True
+            yield out
+            if self.on_complete is not None:
+                self.on_complete()
+        finally:
+            self.relay._count(bytes=sent, flushes=coalescer.flushes)
+            self.close()
+
+    def close(self):
+        """关闭上游响应；流没有读完时连接被直接断开，上游随之停止生成"""
+        if self._closed:
+            return
+        self._closed = True
+        self.response.close()
+        if self._completed:
+            self.relay._count(completed=1)
+        else:
+            self.relay._count(cancelled=1)
+            logger.info("Client went away, cancelled upstream stream")
+
+
+class AsyncSSERelay(_RelayBase):
+    """SSERelay 的异步版本，用于 api_async.py；参数相同"""
+    def __init__(self, base_url: str, api_key: str, flush_interval: float = 0.02, max_connections: int = 100,
+                 timeout: float = 120.0):
+        super().__init__(base_url, api_key, flush_interval)
+        self.client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+            timeout=httpx.Timeout(timeout, connect=10.0)
+        )
+
+    async def open(self, payload: dict) -> httpx.Response:
+        """发送流式请求并等待响应头；上游返回错误状态时抛出 RelayError"""
+        request = self.client.build_request('POST', self.url, json={**payload, 'stream': True}, headers=self.headers)
+        response = await self.client.send(request, stream=True)
+        if response.status_code != 200:
+            try:
+                body = await response.aread()
+            finally:
+                await response.aclose()
+            raise self._upstream_error(response.status_code, body)
+        self._count(streams=1)
+        return response
+
+    async def relay(self, response: httpx.Response, on_first_chunk: Optional[Callable[[], None]] = None,
+                    on_complete: Optional[Callable[[], None]] = None) -> AsyncIterator[bytes]:
+        """转发 open 返回的响应；客户端断开时生成器被取消，finally 中关闭上游连接"""
+        coalescer = SSECoalescer(self.flush_interval)
+        sent = 0
+        completed = False
+        try:
+            async for data in response.aiter_raw():
+                out = coalescer.feed(data, time.perf_counter())
+                if out:
+                    if sent == 0 and on_first_chunk is not None:
+                        on_first_chunk()
+                    sent += len(out)
+                    yield out
+            out = coalescer.finish()
+            sent += len(out)
+            completed = True
+            yield out
+            if on_complete is not None:
+                on_complete()
+        finally:
+            await response.aclose()
+            self._count(bytes=sent, flushes=coalescer.flushes, **{'completed' if completed else 'cancelled': 1})
+            if not completed:
+                logger.info("Client went away, cancelled upstream stream")
+
+    async def close(self):
+        await self.client.aclose()
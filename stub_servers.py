@@ -0,0 +1,242 @@
+import numpy as np
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List
+import base64
+import hashlib
+import json
+import logging
+import sys
+import threading
+import time
+logger = logging.getLogger(__name__)
+
+
+def stub_embedding(text: str, dimension: int) -> np.ndarray:
+    """根据文本哈希生成确定性的单位向量，相同文本总是得到相同向量"""
+    seed = int.from_bytes(hashlib.sha256(text.encode('utf-8')).digest()[:8], 'little')
+    vector = np.random.default_rng(seed).standard_normal(dimension).astype(np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+class _StubHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # 客户端断开（如取消流式请求）是预期情况，不打印异常
+        if isinstance(sys.exc_info()[1], ConnectionError):
+            return
+        super().handle_error(request, client_address)
+
+
+class StubServer:
+    """在后台线程中运行的本地 HTTP 服务器基类，支持 with 语句"""
+    def __init__(self, host: str = "127.0.0.1", port: int = 0):
+        self.host = host
+        self.port = port
+        self._server = None
+        self._thread = None
+
+    def _handler_class(self):
+        raise NotImplementedError
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    def start(self):
+        self._server = _StubHTTPServer((self.host, self.port), self._handler_class())
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        logger.info(f"{type(self).__name__} listening on {self.base_url}")
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+class StubEmbeddingServer(StubServer):
+    """兼容 /v1/embeddings 的桩服务器
+
+    Args:
+        dimension: 向量维度
+        latency: 每个请求的固定延迟（秒）
+        per_item_latency: 每条文本额外增加的延迟（秒）
+        fail_every: 每 N 个请求返回一次 500，0 表示不注入错误
+        rate_limit_every: 每 N 个请求返回一次 429，0 表示不限流
+        retry_after: 429 响应中的 Retry-After（秒）
+    """
+    def __init__(self, dimension: int = 1024, latency: float = 0.0, per_item_latency: float = 0.0,
+                 fail_every: int = 0, rate_limit_every: int = 0, retry_after: float = 0.05, **kwargs):
+        super().__init__(**kwargs)
+        self.dimension = dimension
+        self.latency = latency
+        self.per_item_latency = per_item_latency
+        self.fail_every = fail_every
+        self.rate_limit_every = rate_limit_every
+        self.retry_after = retry_after
+        self.request_count = 0
+        self.batch_sizes: List[int] = []
+        self._lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        return f"{self.base_url}/v1/embeddings"
+
+    def _handler_class(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # 响应头和响应体分两次写出，关闭 Nagle 避免与延迟确认叠加出约 40ms 的等待
+            disable_nagle_algorithm = True
+
+            def log_message(self, format, *args):
+                logger.debug(format % args)
+
+            def _send_json(self, status: int, body: dict, headers: dict = None):
+                data = json.dumps(body).encode('utf-8')
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                payload = json.loads(self.rfile.read(length))
+                with stub._lock:
+                    stub.request_count += 1
+                    count = stub.request_count
+                if stub.rate_limit_every and count % stub.rate_limit_every == 0:
+                    self._send_json(429, {"error": {"message": "rate limited"}},
+                                    {"Retry-After": str(stub.retry_after)})
+                    return
+                if stub.fail_every and count % stub.fail_every == 0:
+                    self._send_json(500, {"error": {"message": "injected failure"}})
+                    return
+
+                inputs = payload["input"]
+                if isinstance(inputs, str):
+                    inputs = [inputs]
+                with stub._lock:
+                    stub.batch_sizes.append(len(inputs))
+                time.sleep(stub.latency + stub.per_item_latency * len(inputs))
+                encode = ((lambda v: base64.b64encode(v.astype('<f4').tobytes()).decode('ascii'))
+                          if payload.get("encoding_format") == "base64" else (lambda v: v.tolist()))
+                data = [
+                    {"object": "embedding", "index": i,
+                     "embedding": encode(stub_embedding(text, stub.dimension))}
+                    for i, text in enumerate(inputs)
+                ]
+                self._send_json(200, {"object": "list", "data": data, "model": payload.get("model")})
+
+        return Handler
+
+
+class StubLLMServer(StubServer):
+    """兼容 /v1/chat/completions 的桩服务器，流式请求按固定节奏逐个返回 token
+
+    流式响应使用分块传输编码，连接可以复用；客户端中途断开时停止发送并计入 disconnects。
+
+    Args:
+        tokens: 每个回答的 token 数
+        ttft: 收到请求到第一个 token 的延迟（秒），模拟 prefill
+        token_interval: 相邻 token 的间隔（秒），模拟 decode
+        token: 每个 token 的文本
+    """
+    def __init__(self, tokens: int = 64, ttft: float = 0.05, token_interval: float = 0.01,
+                 token: str = "安全", **kwargs):
+        super().__init__(**kwargs)
+        self.tokens = tokens
+        self.ttft = ttft
+        self.token_interval = token_interval
+        self.token = token
+        self.request_count = 0
+        self.completed = 0
+        self.disconnects = 0
+        self._lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        return f"{self.base_url}/v1"
+
+    def _count(self, key: str):
+        with self._lock:
+            setattr(self, key, getattr(self, key) + 1)
+
+    def _chunk(self, model: str, delta: dict, finish_reason=None) -> bytes:
+        body = {"id": "chatcmpl-stub", "object": "chat.completion.chunk", "created": int(time.time()),
+                "model": model, "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]}
+        return f"data: {json.dumps(body, ensure_ascii=False)}\n\n".encode('utf-8')
+
+    def _handler_class(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # 响应头和响应体分两次写出，关闭 Nagle 避免与延迟确认叠加出约 40ms 的等待
+            disable_nagle_algorithm = True
+
+            def log_message(self, format, *args):
+                logger.debug(format % args)
+
+            def _write_chunk(self, data: bytes):
+                self.wfile.write(f"{len(data):x}\r\n".encode('ascii') + data + b"\r\n")
+                self.wfile.flush()
+
+            def _stream(self, model: str):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                time.sleep(stub.ttft)
+                self._write_chunk(stub._chunk(model, {"role": "assistant", "content": ""}))
+                for i in range(stub.tokens):
+                    if i:
+                        time.sleep(stub.token_interval)
+                    self._write_chunk(stub._chunk(model, {"content": stub.token}))
+                self._write_chunk(stub._chunk(model, {}, "stop"))
+                self._write_chunk(b"data: [DONE]\n\n")
+                self.wfile.write(b"0\r\n\r\n")
+                self.wfile.flush()
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                payload = json.loads(self.rfile.read(length))
+                stub._count('request_count')
+                model = payload.get("model", "stub")
+                try:
+                    if payload.get("stream"):
+                        self._stream(model)
+                    else:
+                        time.sleep(stub.ttft + stub.token_interval * max(stub.tokens - 1, 0))
+                        body = json.dumps({
+                            "id": "chatcmpl-stub", "object": "chat.completion", "created": int(time.time()),
+                            "model": model,
+                            "choices": [{"index": 0, "finish_reason": "stop",
+                                         "message": {"role": "assistant", "content": stub.token * stub.tokens}}]
+                        }, ensure_ascii=False).encode('utf-8')
+                        self.send_response(200)
+                        self.send_header("Content-Type", "application/json")
+                        self.send_header("Content-Length", str(len(body)))
+                        self.end_headers()
+                        self.wfile.write(body)
+                except (BrokenPipeError, ConnectionResetError):
+                    stub._count('disconnects')
+                    self.close_connection = True
+                    return
+                stub._count('completed')
+
+        return Handler
@@ -0,0 +1,52 @@
+from typing import Iterator, Optional
+import hashlib
+import numpy as np
+from pdf_extract import PdfExtractor
+
+
+class FakeExtractor(PdfExtractor):
+    """不读取PDF的提取后端：每篇文档 pages 页，第一行为标题，每页一个由文件名和页码决定的有效段落"""
+    name = 'fake'
+
+    def __init__(self, pages: int = 3):
+        self.pages = pages
+
+    @property
+    def version(self) -> str:
+        return '1'
+
+    def page_count(self, pdf_path: str) -> int:
+        return self.pages
+
+    def iter_pages(self, pdf_path: str, start_page: int = 0, end_page: Optional[int] = None) -> Iterator[str]:
+        end_page = self.pages if end_page is None else min(end_page, self.pages)
+        for page in range(start_page, end_page):
+            words = ' '.join(f"{pdf_path.rsplit('/', 1)[-1]}-{page}-w{i}" for i in range(20))
+            yield f"Title of {pdf_path.rsplit('/', 1)[-1]}\n\n{words}."
+
+
+class StubEmbedder:
+    """按文本哈希生成确定性向量的嵌入后端，记录每次请求的条数"""
+    model = 'stub-embedder'
+
+    def __init__(self, dimension: int = 16):
+        self.dimension = dimension
+        self.calls = []
+
+    def embed(self, texts):
+        self.calls.append(len(texts))
+        rows = []
+        for text in texts:
+            seed = int.from_bytes(hashlib.sha256(text.encode('utf-8')).digest()[:8], 'little')
+            rows.append(np.random.default_rng(seed).standard_normal(self.dimension))
+        return np.array(rows, dtype=np.float32)
+
+
+def write_pdfs(directory, names) -> list:
+    """FakeExtractor 不读取文件内容，只需要文件存在；内容不同使内容哈希不同"""
+    paths = []
+    for name in names:
+        path = directory / name
+        path.write_bytes(name.encode('utf-8'))
+        paths.append(str(path))
+    return paths
@@ -0,0 +1,54 @@
+import pytest
+from bm25_index import BM25Index, tokenize
+from rag import reciprocal_rank_fusion
+
+TEXTS = [
+    "buffer overflow in the kernel network stack",
+    "CVE-2021-44228 remote code execution in log4j",
+    "buffer overflow exploit: a second buffer overflow variant",
+    "kernel scheduler fairness",
+]
+
+
+@pytest.fixture
+def index():
+    index = BM25Index()
+    index.add(TEXTS)
+    return index
+
+
+def test_higher_term_frequency_ranks_first(index):
+    scores, ids = index.search("buffer overflow", topk=10)
+    assert ids.tolist() == [2, 0]
+    assert scores[0] > scores[1] > 0
+
+
+def test_identifiers_match_whole_and_in_parts(index):
+    assert "cve-2021-44228" in tokenize(TEXTS[1])
+    assert index.search("CVE-2021-44228", topk=10)[1].tolist() == [1]
+    assert index.search("44228", topk=10)[1].tolist() == [1]
+
+
+def test_rare_terms_outweigh_common_ones(index):
+    # kernel 出现在两个分块中，scheduler 只出现在一个分块中
+    scores, ids = index.search("kernel scheduler", topk=10)
+    assert ids.tolist() == [3, 0]
+
+
+def test_limit_and_exclude(index):
+    assert index.search("buffer overflow", topk=10, exclude=frozenset({2}))[1].tolist() == [0]
+    assert index.search("buffer overflow", topk=10, limit=2)[1].tolist() == [0]
+    assert index.search("buffer overflow", topk=1)[1].tolist() == [2]
+
+
+def test_reciprocal_rank_fusion_order():
+    dense = [('a', 0.9), ('b', 0.8), ('c', 0.7)]
+    lexical = [('c', 5.0), ('a', 3.0), ('d', 1.0)]
+    fused = reciprocal_rank_fusion(dense, lexical, topk=10, rrf_k=60)
+    assert [key for key, *_ in fused] == ['a', 'c', 'b', 'd']
+    assert fused[0][1] == pytest.approx(1 / 61 + 1 / 62)
+    assert fused[1][1] == pytest.approx(1 / 63 + 1 / 61)
+    # 只被一路召回的结果，另一路得分为 None
+    assert fused[2][2:] == (0.8, None)
+    assert fused[3][2:] == (None, 1.0)
+    assert [key for key, *_ in reciprocal_rank_fusion(dense, lexical, topk=2)] == ['a', 'c']
@@ -0,0 +1,44 @@
+import numpy as np
+from rag import SecurityRAGSystem
+from tests.fakes import StubEmbedder
+
+
+def add_document(rag: SecurityRAGSystem, path: str, vectors: np.ndarray):
+    with rag._write_lock:
+        doc_id = rag.chunks.add_document(path, None)
+        start = len(rag.chunks)
+        rag._append_chunks(doc_id, [{'text': f"{path} chunk {i}", 'page': 1} for i in range(len(vectors))], vectors)
+        rag.manifest.entries[path] = {'chunk_start': start, 'chunk_end': len(rag.chunks)}
+
+
+def test_vectors_come_from_the_searched_snapshot():
+    rag = SecurityRAGSystem(embedder=StubEmbedder(dimension=8), embed_cache_bytes=0, dedup_threshold=None)
+    vectors = np.random.default_rng(0).standard_normal((6, 8)).astype(np.float32)
+    add_document(rag, 'a.pdf', vectors[:3])
+    add_document(rag, 'b.pdf', vectors[3:])
+    results = rag.search_vectors(vectors[3:4], threshold=1e-3, topk=1)[0]
+    assert results[0]['chunk_id'] == 3
+
+    # 检索之后删除 a.pdf 并压缩，b.pdf 的分块重新编号为 0..2
+    rag.remove_document('a.pdf')
+    rag.compact()
+    ids = [r['chunk_id'] for r in results]
+    assert rag.chunk_vectors(ids) is None
+    np.testing.assert_allclose(rag.chunk_vectors(ids, [r['index_version'] for r in results]), vectors[3:4])
+
+    fresh = rag.search_vectors(vectors[3:4], threshold=1e-3, topk=1)[0]
+    assert fresh[0]['chunk_id'] == 0
+    np.testing.assert_allclose(rag.chunk_vectors([0], [fresh[0]['index_version']]), vectors[3:4])
+
+
+def test_expired_snapshot_returns_none(monkeypatch):
+    rag = SecurityRAGSystem(embedder=StubEmbedder(dimension=8), embed_cache_bytes=0, dedup_threshold=None)
+    vectors = np.random.default_rng(1).standard_normal((4, 8)).astype(np.float32)
+    add_document(rag, 'a.pdf', vectors[:2])
+    add_document(rag, 'b.pdf', vectors[2:])
+    results = rag.search_vectors(vectors[2:3], threshold=1e-3, topk=1)[0]
+    rag.remove_document('a.pdf')
+    rag.compact()
+    monkeypatch.setattr('rag.RETIRED_VIEW_SECONDS', 0.0)
+    add_document(rag, 'c.pdf', vectors[:1])
+    assert rag.chunk_vectors([results[0]['chunk_id']], [results[0]['index_version']]) is None
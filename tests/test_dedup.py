@@ -0,0 +1,52 @@
+import os
+from dedup import NearDuplicateDetector
+from rag import SecurityRAGSystem
+from tests.fakes import FakeExtractor, StubEmbedder, write_pdfs
+
+SHARED = ' '.join(f"shared-{i}" for i in range(30))
+
+
+class SharedPageExtractor(FakeExtractor):
+    """每篇文档的第一页相同（如会议模板的版权页），第二页各不相同"""
+    def __init__(self):
+        super().__init__(pages=2)
+
+    def iter_pages(self, pdf_path, start_page=0, end_page=None):
+        for page, text in enumerate(super().iter_pages(pdf_path, start_page, end_page), start_page):
+            yield f"Shared page\n\n{SHARED}." if page == 0 else text
+
+
+def test_near_duplicates_within_and_across_documents():
+    detector = NearDuplicateDetector(threshold=0.85)
+    chunks = [{'text': SHARED}, {'text': SHARED + " extra"}, {'text': "something else entirely here"}]
+    kept = detector.filter('a.pdf', chunks)
+    assert [c['text'] for c in kept] == [SHARED, "something else entirely here"]
+    assert detector.filter('b.pdf', [{'text': SHARED}]) == []
+    assert detector.sources('b.pdf') == ['a.pdf']
+
+    detector.forget('a.pdf')
+    assert detector.filter('c.pdf', [{'text': SHARED}]) == [{'text': SHARED}]
+
+
+def test_duplicate_chunks_are_skipped_and_dependents_reingested(tmp_path):
+    rag = SecurityRAGSystem(embedder=StubEmbedder(), extractor=SharedPageExtractor(), embed_cache_bytes=0)
+    a, b = write_pdfs(tmp_path, ["a.pdf", "b.pdf"])
+    stats = rag.sync_directory(str(tmp_path))
+    assert stats['added'] == 2
+    assert stats['duplicates'] == 1
+    assert len(rag.chunks) == 3
+    assert rag.manifest.get(b)['dedup_sources'] == [os.path.normpath(a)]
+
+    # a.pdf 删除后，b.pdf 缺少跳过的那一页，被标记为需要重新导入，下次同步时重新导入
+    os.remove(a)
+    stats = rag.sync_directory(str(tmp_path))
+    assert stats['removed'] == 1
+    assert rag.manifest.get(b)['stale']
+    assert rag.needs_ingest(b)
+    stats = rag.sync_directory(str(tmp_path))
+    assert stats['added'] == 1
+    assert stats['duplicates'] == 0
+    entry = rag.manifest.get(b)
+    assert entry['chunk_end'] - entry['chunk_start'] == 2
+    assert entry['dedup_sources'] == []
+    assert 'stale' not in entry
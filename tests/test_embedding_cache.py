@@ -0,0 +1,42 @@
+import numpy as np
+from embedding_cache import EmbeddingCache
+
+
+def embed(texts):
+    return np.array([[len(text), 1.0] for text in texts], dtype=np.float32)
+
+
+def test_duplicates_in_one_call_are_counted_once():
+    cache = EmbeddingCache('model')
+    calls = []
+    cache.get_or_embed(["a", "b", "a", "a"], lambda texts: calls.append(texts) or embed(texts))
+    assert calls == [["a", "b"]]
+    assert cache.stats['misses'] == 2
+    assert cache.stats['hits'] == 0
+
+    cache.get_or_embed(["a", "a", "c"], embed)
+    assert cache.stats['hits'] == 1
+    assert cache.stats['misses'] == 3
+
+
+def test_disk_layer_is_read_without_the_memory_lock(tmp_path):
+    path = str(tmp_path / "embeddings.sqlite")
+    cache = EmbeddingCache('model', disk_path=path)
+    cache.get_or_embed(["a", "bb"], embed)
+    cache.close()
+
+    cache = EmbeddingCache('model', disk_path=path)
+    read_disk = cache._read_disk
+
+    def checked_read(keys):
+        assert not cache._lock.locked()
+        return read_disk(keys)
+
+    def no_embed(texts):
+        raise AssertionError("unexpected embedding request")
+
+    cache._read_disk = checked_read
+    vectors = cache.get_or_embed(["bb", "a", "bb"], no_embed)
+    np.testing.assert_array_equal(vectors, embed(["bb", "a", "bb"]))
+    assert cache.stats['disk_hits'] == 2
+    assert cache.stats['hits'] == 2
@@ -0,0 +1,70 @@
+import asyncio
+import time
+import pytest
+from embedding_client import AsyncEmbeddingClient, EmbeddingClient, EmbeddingError
+from stub_servers import StubEmbeddingServer
+
+
+def make_client(server, cls=EmbeddingClient, **kwargs):
+    kwargs.setdefault('backoff', 0.001)
+    return cls(server.url, "test-key", "stub-model", **kwargs)
+
+
+def test_rate_limited_batch_waits_for_retry_after():
+    with StubEmbeddingServer(dimension=8, rate_limit_every=2, retry_after=0.3) as server:
+        client = make_client(server)
+        try:
+            assert client.embed(["first"]).shape == (1, 8)
+            start = time.monotonic()
+            assert client.embed(["second"]).shape == (1, 8)
+            # backoff 只有 1ms，等待时间来自 Retry-After
+            assert time.monotonic() - start >= 0.3
+        finally:
+            client.close()
+    assert client.stats['rate_limited'] == 1
+    assert client.stats['retries'] == 1
+    assert server.request_count == 3
+
+
+def test_server_errors_are_retried():
+    with StubEmbeddingServer(dimension=8, fail_every=2) as server:
+        client = make_client(server, max_batch_items=1, max_concurrency=1)
+        try:
+            vectors = client.embed(["a", "b", "c"])
+        finally:
+            client.close()
+    # 第 2、4 个请求返回 500，各重试一次
+    assert vectors.shape == (3, 8)
+    assert client.stats['retries'] == 2
+    assert client.stats['errors'] == 0
+    assert server.request_count == 5
+
+
+def test_gives_up_after_max_retries():
+    with StubEmbeddingServer(dimension=8, fail_every=1) as server:
+        client = make_client(server, max_retries=2)
+        try:
+            with pytest.raises(EmbeddingError, match="after 2 retries"):
+                client.embed(["a"])
+        finally:
+            client.close()
+    assert server.request_count == 3
+    assert client.stats['errors'] == 1
+
+
+def test_async_client_honours_retry_after():
+    async def run(server):
+        client = make_client(server, cls=AsyncEmbeddingClient)
+        try:
+            await client.embed(["first"])
+            start = time.monotonic()
+            vectors = await client.embed(["second"])
+            return vectors, time.monotonic() - start, client.stats
+        finally:
+            await client.close()
+
+    with StubEmbeddingServer(dimension=8, rate_limit_every=2, retry_after=0.3) as server:
+        vectors, elapsed, stats = asyncio.run(run(server))
+    assert vectors.shape == (1, 8)
+    assert elapsed >= 0.3
+    assert stats['rate_limited'] == 1
@@ -0,0 +1,37 @@
+import numpy as np
+import pytest
+from rag import SecurityRAGSystem
+from tests.fakes import StubEmbedder
+
+
+def make_rag(index_type, **index_params) -> SecurityRAGSystem:
+    return SecurityRAGSystem(embedder=StubEmbedder(dimension=32), index_type=index_type,
+                             index_params=index_params, embed_cache_bytes=0, dedup_threshold=None)
+
+
+@pytest.mark.parametrize('index_type', ['ivf_pq', 'opq_ivf_pq'])
+def test_pq_train_size_below_codebook_size_fails_fast(index_type):
+    with pytest.raises(ValueError, match="train_size=100"):
+        make_rag(index_type, pq_m=8, train_size=100)
+    with pytest.raises(ValueError, match="max_train_sample=15"):
+        make_rag(index_type, pq_m=8, pq_nbits=4, train_size=16, max_train_sample=15)
+
+
+def test_pq_m_must_divide_dimension():
+    with pytest.raises(ValueError, match="pq_m=5"):
+        make_rag('ivf_pq', pq_m=5, train_size=256)
+
+
+def test_pca_train_size_below_reduce_dim_fails_fast():
+    with pytest.raises(ValueError, match="reduce=pca"):
+        make_rag('flat', reduce='pca', reduce_dim=16, train_size=8)
+
+
+def test_smallest_valid_train_size_trains():
+    rag = make_rag('ivf_pq', pq_m=8, pq_nbits=4, train_size=16)
+    rag._append_chunks(rag.chunks.add_document('doc.pdf', None),
+                       [{'text': f"chunk {i}", 'page': 1} for i in range(16)],
+                       np.random.default_rng(0).standard_normal((16, 32)).astype(np.float32))
+    rag.train_index()
+    assert rag._template is not None
+    assert rag._view.ntotal == 16
@@ -0,0 +1,75 @@
+import json
+import os
+from index_store import IndexStore
+from rag import SecurityRAGSystem
+from tests.fakes import FakeExtractor, StubEmbedder, write_pdfs
+
+
+def make_rag(store_dir) -> SecurityRAGSystem:
+    return SecurityRAGSystem(store_dir=str(store_dir), embedder=StubEmbedder(), extractor=FakeExtractor(),
+                             embed_cache_bytes=0, dedup_threshold=None)
+
+
+def ingest(rag: SecurityRAGSystem, papers_dir, names):
+    for path in write_pdfs(papers_dir, names):
+        assert rag.add_documents(path)
+
+
+def test_save_and_load_round_trip(tmp_path):
+    papers = tmp_path / "papers"
+    papers.mkdir()
+    rag = make_rag(tmp_path / "store")
+    ingest(rag, papers, ["a.pdf", "b.pdf", "c.pdf"])
+    rag.remove_document(str(papers / "b.pdf"))
+    query = rag.chunks.text(7)
+    before = rag.retrieval(query, threshold=10.0, topk=3, mode='dense')
+    # 不在保存时压缩，墓碑随存储一起保存
+    rag.compact_ratio = 1.0
+    rag.save()
+
+    loaded = make_rag(tmp_path / "store")
+    assert loaded.load()
+    assert len(loaded.chunks) == 9
+    assert loaded._view.tombstones == {3, 4, 5}
+    assert loaded.manifest.to_dict() == rag.manifest.to_dict()
+    after = loaded.retrieval(query, threshold=10.0, topk=3, mode='dense')
+    assert [(r['chunk_id'], r['title'], r['file_name'], r['page']) for r in after] == \
+           [(r['chunk_id'], r['title'], r['file_name'], r['page']) for r in before]
+    assert after[0]['file_name'] == 'c.pdf'
+    assert after[0]['title'] == 'Title of c.pdf'
+    assert after[0]['page'] == 2
+
+
+def test_format_2_store_is_migrated(tmp_path):
+    papers = tmp_path / "papers"
+    papers.mkdir()
+    rag = make_rag(tmp_path / "store")
+    ingest(rag, papers, ["a.pdf", "b.pdf"])
+    rag.save()
+
+    # 改写成格式 2：只有文本区，没有文档编号、页码和文档表
+    store = IndexStore(str(tmp_path / "store"))
+    version_dir = os.path.join(store.root, store.current_version())
+    for name in ('doc_ids.npy', 'pages.npy', 'documents.json'):
+        os.remove(os.path.join(version_dir, name))
+    with open(os.path.join(version_dir, 'info.json')) as f:
+        info = json.load(f)
+    info['format_version'] = 2
+    with open(os.path.join(version_dir, 'info.json'), 'w') as f:
+        json.dump(info, f)
+
+    loaded = make_rag(tmp_path / "store")
+    assert loaded.load()
+    result = loaded.chunks.get(4)
+    assert result['file_name'] == 'b.pdf'
+    assert result['title'] == 'b'
+    assert result['page'] == 0
+    assert result['text'] == rag.chunks.text(4)
+
+    # 再次保存时写出格式 3
+    loaded.save()
+    with open(os.path.join(store.root, store.current_version(), 'info.json')) as f:
+        assert json.load(f)['format_version'] == 3
+    reloaded = make_rag(tmp_path / "store")
+    assert reloaded.load()
+    assert reloaded.chunks.get(4)['file_name'] == 'b.pdf'
@@ -0,0 +1,121 @@
+import threading
+import manifest
+import parse_cache
+import rag as rag_module
+from ingest import ParallelIngestor
+from parse_cache import ParseCache
+from rag import SecurityRAGSystem
+from tests.fakes import FakeExtractor, StubEmbedder, write_pdfs
+
+
+def make_rag(**kwargs) -> SecurityRAGSystem:
+    return SecurityRAGSystem(embedder=StubEmbedder(), extractor=FakeExtractor(), embed_cache_bytes=0,
+                             dedup_threshold=None, **kwargs)
+
+
+def run_ingest(ingestor: ParallelIngestor, paths: list, timeout: float = 30.0) -> dict:
+    result = {}
+    thread = threading.Thread(target=lambda: result.update(ingestor.ingest(paths)), daemon=True)
+    thread.start()
+    thread.join(timeout)
+    assert not thread.is_alive(), "ingest() did not return"
+    return result
+
+
+def test_ingest_returns_when_insert_fails(tmp_path, monkeypatch):
+    rag = make_rag()
+    paths = write_pdfs(tmp_path, [f"p{i}.pdf" for i in range(30)])
+    insert_windows = rag.insert_windows
+
+    def flaky_insert(pdf_path, *args, **kwargs):
+        if pdf_path.endswith(('p3.pdf', 'p17.pdf')):
+            raise FileNotFoundError(pdf_path)
+        return insert_windows(pdf_path, *args, **kwargs)
+
+    monkeypatch.setattr(rag, 'insert_windows', flaky_insert)
+    stats = run_ingest(ParallelIngestor(rag, workers=1, queue_size=2), paths)
+    assert stats['added'] == 28
+    assert stats['failed'] == 2
+    assert paths[3] not in rag.manifest
+
+
+def test_ingest_returns_when_embedding_raises(tmp_path, monkeypatch):
+    rag = make_rag()
+    paths = write_pdfs(tmp_path, [f"p{i}.pdf" for i in range(10)])
+    embed = rag.embedder.embed
+
+    def flaky_embed(texts):
+        if any('p4.pdf' in text for text in texts):
+            raise ValueError("bad response")
+        return embed(texts)
+
+    monkeypatch.setattr(rag.embedder, 'embed', flaky_embed)
+    stats = run_ingest(ParallelIngestor(rag, workers=1, queue_size=2), paths)
+    assert stats['added'] == 9
+    assert stats['failed'] == 1
+
+
+def test_documents_are_embedded_in_windows(tmp_path):
+    rag = make_rag()
+    rag.ingest_window = 2
+    paths = write_pdfs(tmp_path, ["a.pdf", "b.pdf"])
+    stats = run_ingest(ParallelIngestor(rag, workers=1), paths)
+    assert stats['added'] == 2
+    assert stats['chunks'] == 6
+    assert max(rag.embedder.calls) == 2
+    entry = rag.manifest.get(paths[0])
+    assert entry['chunk_end'] - entry['chunk_start'] == 3
+
+
+def test_failed_window_rolls_back_the_document(tmp_path, monkeypatch):
+    rag = make_rag()
+    rag.ingest_window = 2
+    paths = write_pdfs(tmp_path, ["a.pdf", "b.pdf"])
+    embed = rag.embedder.embed
+
+    def flaky_embed(texts):
+        # a.pdf 的第一个窗口写入成功，第二个窗口失败
+        if len(texts) == 1 and 'a.pdf' in texts[0]:
+            raise ValueError("bad response")
+        return embed(texts)
+
+    monkeypatch.setattr(rag.embedder, 'embed', flaky_embed)
+    stats = run_ingest(ParallelIngestor(rag, workers=1), paths)
+    assert stats['added'] == 1
+    assert paths[0] not in rag.manifest
+    assert len(rag._view.tombstones) == 2
+    assert all(rag.chunks.documents[rag.chunks.doc_ids[i]]['path'] == paths[0] for i in rag._view.tombstones)
+
+
+def test_deleted_file_leaves_no_orphan_chunks(tmp_path):
+    rag = make_rag()
+    path, = write_pdfs(tmp_path, ["gone.pdf"])
+    chunks = [{'text': 'some text', 'page': 1}]
+    vectors = rag.embedder.embed(['some text'])
+    (tmp_path / "gone.pdf").unlink()
+    try:
+        rag.insert_chunks(path, chunks, vectors)
+    except FileNotFoundError:
+        pass
+    assert path not in rag.manifest
+    assert rag._view.tombstones == {0}
+
+
+def test_each_file_is_hashed_once(tmp_path, monkeypatch):
+    rag = make_rag()
+    rag.parse_cache = ParseCache(str(tmp_path / "cache"))
+    paths = write_pdfs(tmp_path, ["a.pdf", "b.pdf"])
+    # 解析任务在 fork 出的子进程中运行，调用记录写入文件
+    log = tmp_path / "hashed.log"
+    file_sha256 = manifest.file_sha256
+
+    def counting_sha256(path, *args, **kwargs):
+        with open(log, 'a') as f:
+            f.write(path + "\n")
+        return file_sha256(path, *args, **kwargs)
+
+    for module in (manifest, parse_cache, rag_module):
+        monkeypatch.setattr(module, 'file_sha256', counting_sha256)
+    stats = run_ingest(ParallelIngestor(rag, workers=1, pages_per_task=1), paths)
+    assert stats['added'] == 2
+    assert sorted(log.read_text().split()) == sorted(paths)
@@ -0,0 +1,82 @@
+import os
+import PyPDF2
+import pytest
+from ingest_worker import IngestWorker
+from rag import SecurityRAGSystem
+
+
+class NoEmbedder:
+    """没有可索引文本的论文不应触发向量化"""
+    model = 'test-embedder'
+    dimension = 8
+
+    def embed(self, texts):
+        raise AssertionError("unexpected embedding request")
+
+
+@pytest.fixture
+def papers_dir(tmp_path):
+    writer = PyPDF2.PdfWriter()
+    writer.add_blank_page(width=612, height=792)
+    with open(tmp_path / 'scanned.pdf', 'wb') as f:
+        writer.write(f)
+    (tmp_path / 'corrupt.pdf').write_bytes(b"this is not a pdf")
+    return tmp_path
+
+
+def test_unindexable_papers_are_not_reparsed(papers_dir):
+    rag = SecurityRAGSystem(embedder=NoEmbedder(), embed_cache_bytes=0)
+    worker = IngestWorker(rag, str(papers_dir), workers=1, save=False)
+    stats = worker.run_once()
+    assert stats['failed'] == 2
+    assert stats['empty'] == 2
+    assert len(rag.manifest) == 2
+    assert 'error' in rag.manifest.get(str(papers_dir / 'corrupt.pdf'))
+    assert 'error' not in rag.manifest.get(str(papers_dir / 'scanned.pdf'))
+
+    def fail_ingest(*args, **kwargs):
+        raise AssertionError("unchanged papers were parsed again")
+
+    worker.ingestor.ingest = fail_ingest
+    stats = worker.run_once()
+    assert stats['failed'] == 0
+    assert worker.status()['documents_failed'] == 2
+
+
+def test_modified_unindexable_paper_is_retried(papers_dir):
+    rag = SecurityRAGSystem(embedder=NoEmbedder(), embed_cache_bytes=0)
+    worker = IngestWorker(rag, str(papers_dir), workers=1, save=False)
+    worker.run_once()
+    (papers_dir / 'corrupt.pdf').write_bytes(b"still not a pdf, but different")
+    stats = worker.run_once()
+    assert stats['failed'] == 1
+    assert len(rag.manifest) == 2
+
+
+def test_sequential_sync_records_unindexable_papers(papers_dir):
+    rag = SecurityRAGSystem(embedder=NoEmbedder(), embed_cache_bytes=0)
+    rag.sync_directory(str(papers_dir))
+    assert len(rag.manifest) == 2
+    assert rag.prepare_ingest(str(papers_dir / 'scanned.pdf')) is None
+    assert rag.prepare_ingest(str(papers_dir / 'corrupt.pdf')) is None
+
+
+def test_failed_round_does_not_stop_the_worker(papers_dir):
+    rag = SecurityRAGSystem(embedder=NoEmbedder(), embed_cache_bytes=0)
+    worker = IngestWorker(rag, str(papers_dir), workers=1, save=False)
+    real_ingest = worker.ingestor.ingest
+
+    def broken_ingest(*args, **kwargs):
+        raise RuntimeError("pool crashed")
+
+    worker.ingestor.ingest = broken_ingest
+    worker.run_once()
+    status = worker.status()
+    assert status['state'] == 'error'
+    assert status['last_error'] == "pool crashed"
+    assert status['in_progress'] == []
+
+    worker.ingestor.ingest = real_ingest
+    stats = worker.run_once()
+    assert stats['empty'] == 2
+    assert worker.status()['state'] == 'idle'
@@ -0,0 +1,54 @@
+import os
+from manifest import IngestManifest, file_sha256
+from rag import SecurityRAGSystem
+from tests.fakes import FakeExtractor, StubEmbedder, write_pdfs
+
+MODEL = 'stub-embedder'
+
+
+def test_unchanged_touched_and_modified_files(tmp_path):
+    path, = write_pdfs(tmp_path, ["a.pdf"])
+    manifest = IngestManifest()
+    assert manifest.status(path, MODEL) == (IngestManifest.NEW, None)
+    manifest.record(path, 0, 3, MODEL)
+    assert manifest.status(path, MODEL) == (IngestManifest.UNCHANGED, file_sha256(path))
+    assert not manifest.changed(path, MODEL)
+
+    # 只改修改时间：比较哈希后仍视为未变，并更新记录的修改时间
+    stat = os.stat(path)
+    os.utime(path, (stat.st_atime, stat.st_mtime + 10))
+    assert manifest.changed(path, MODEL)
+    assert manifest.status(path, MODEL)[0] == IngestManifest.UNCHANGED
+    assert not manifest.changed(path, MODEL)
+
+    with open(path, 'ab') as f:
+        f.write(b"more")
+    assert manifest.status(path, MODEL) == (IngestManifest.MODIFIED, file_sha256(path))
+    assert manifest.status(path, 'other-model')[0] == IngestManifest.MODIFIED
+
+
+def test_modified_and_deleted_documents_are_filtered_from_search(tmp_path):
+    rag = SecurityRAGSystem(embedder=StubEmbedder(), extractor=FakeExtractor(), embed_cache_bytes=0,
+                            dedup_threshold=None)
+    a, b = write_pdfs(tmp_path, ["a.pdf", "b.pdf"])
+    assert rag.sync_directory(str(tmp_path))['added'] == 2
+    old_a = rag.chunks.text(0)
+    old_b = rag.chunks.text(3)
+
+    with open(a, 'ab') as f:
+        f.write(b" v2")
+    os.remove(b)
+    stats = rag.sync_directory(str(tmp_path))
+    assert stats['added'] == 1
+    assert stats['removed'] == 1
+    assert b not in rag.manifest
+    entry = rag.manifest.get(a)
+    assert (entry['chunk_start'], entry['chunk_end']) == (6, 9)
+    assert rag._view.tombstones == set(range(6))
+
+    # 墓碑分块不出现在任何检索模式的结果中
+    for mode in ('dense', 'lexical', 'hybrid'):
+        for query in (old_a, old_b):
+            results = rag.retrieval(query, threshold=100.0, topk=10, mode=mode)
+            assert results
+            assert all(r['chunk_id'] >= 6 for r in results)
@@ -0,0 +1,66 @@
+import os
+import pytest
+from ingest import ParallelIngestor
+from parse_cache import ParseCache
+from rag import SecurityRAGSystem
+from tests.fakes import FakeExtractor, StubEmbedder, write_pdfs
+
+
+class GuardedExtractor(FakeExtractor):
+    """存在 forbid 文件时拒绝解析；解析进程是 fork 出来的，用文件而不是内存中的标志"""
+    def __init__(self, forbid: str):
+        super().__init__(pages=4)
+        self.forbid = forbid
+
+    def iter_pages(self, pdf_path, start_page=0, end_page=None):
+        if os.path.exists(self.forbid):
+            raise AssertionError(f"{pdf_path} was parsed again")
+        yield from super().iter_pages(pdf_path, start_page, end_page)
+
+
+def make_rag(tmp_path) -> SecurityRAGSystem:
+    rag = SecurityRAGSystem(embedder=StubEmbedder(), extractor=GuardedExtractor(str(tmp_path / "forbid")),
+                            embed_cache_bytes=0, dedup_threshold=None)
+    rag.parse_cache = ParseCache(str(tmp_path / "cache"))
+    return rag
+
+
+def documents(rag: SecurityRAGSystem) -> list:
+    return [(rag.chunks.get(i)['title'], rag.chunks.get(i)['page'], rag.chunks.text(i)) for i in range(len(rag.chunks))]
+
+
+@pytest.mark.parametrize('pages_per_task', [0, 1])
+def test_cached_pages_are_not_parsed_again(tmp_path, pages_per_task):
+    papers = tmp_path / "papers"
+    papers.mkdir()
+    paths = write_pdfs(papers, ["a.pdf", "b.pdf"])
+    first = make_rag(tmp_path)
+    if pages_per_task:
+        ParallelIngestor(first, workers=1, pages_per_task=pages_per_task).ingest(paths)
+    else:
+        first.sync_directory(str(papers))
+    assert len(os.listdir(tmp_path / "cache")) == 2
+
+    (tmp_path / "forbid").touch()
+    second = make_rag(tmp_path)
+    second.sync_directory(str(papers))
+    assert second.parse_cache.stats['hits'] == 2
+    assert documents(second) == documents(first)
+    assert second.chunks.get(0)['title'] == 'Title of a.pdf'
+
+
+def test_corrupt_entry_falls_back_to_parsing(tmp_path):
+    papers = tmp_path / "papers"
+    papers.mkdir()
+    write_pdfs(papers, ["a.pdf"])
+    first = make_rag(tmp_path)
+    first.sync_directory(str(papers))
+    entry, = (tmp_path / "cache").iterdir()
+    # 截断压缩流：标题可以读出，之后的某一页读取时报错
+    data = entry.read_bytes()
+    entry.write_bytes(data[:len(data) // 2])
+
+    second = make_rag(tmp_path)
+    second.sync_directory(str(papers))
+    assert documents(second) == documents(first)
+    assert second.parse_cache.stats['errors'] == 1
@@ -0,0 +1,17 @@
+import pytest
+from pdf_extract import PdfExtractor
+
+
+def test_incomplete_extractor_cannot_be_created():
+    class NoPageCount(PdfExtractor):
+        name = 'broken'
+
+        @property
+        def version(self) -> str:
+            return '1'
+
+        def iter_pages(self, pdf_path, start_page=0, end_page=None):
+            yield ''
+
+    with pytest.raises(TypeError, match="page_count"):
+        NoPageCount()
@@ -0,0 +1,36 @@
+import threading
+import time
+import pytest
+from query_batcher import QueryBatcher
+
+
+class SlowRAG:
+    """'slow' 模式的批量检索阻塞到 release 被设置"""
+    def __init__(self):
+        self.release = threading.Event()
+
+    def retrieval_batch(self, queries, threshold=0.8, topk=5, mode='dense'):
+        if mode == 'slow':
+            self.release.wait(10)
+        return [[{'query': query, 'mode': mode}] for query in queries]
+
+
+def test_slow_group_does_not_block_other_queries():
+    rag = SlowRAG()
+    batcher = QueryBatcher(rag, timeout=5.0)
+    slow = threading.Thread(target=batcher.retrieval, args=("slow query",), kwargs={'mode': 'slow'})
+    slow.start()
+    time.sleep(0.05)
+    start = time.monotonic()
+    assert batcher.retrieval("fast query", mode='dense') == [{'query': "fast query", 'mode': 'dense'}]
+    assert time.monotonic() - start < 1.0
+    rag.release.set()
+    slow.join(5)
+
+
+def test_retrieval_times_out():
+    rag = SlowRAG()
+    batcher = QueryBatcher(rag, timeout=0.1)
+    with pytest.raises(TimeoutError):
+        batcher.retrieval("slow query", mode='slow')
+    rag.release.set()
@@ -0,0 +1,43 @@
+import numpy as np
+import pytest
+from rag import SecurityRAGSystem
+from tests.fakes import StubEmbedder
+
+SIMILARITIES = [0.5, 0.95, 0.79, 0.85, -0.2, 0.9, 0.81]
+
+
+def unit(cosine: float, dimension: int = 8) -> np.ndarray:
+    vector = np.zeros(dimension, dtype=np.float32)
+    vector[0], vector[1] = cosine, np.sqrt(1 - cosine ** 2)
+    return vector
+
+
+@pytest.fixture
+def rag():
+    rag = SecurityRAGSystem(embedder=StubEmbedder(dimension=8), metric='cosine', embed_cache_bytes=0,
+                            dedup_threshold=None)
+    doc_id = rag.chunks.add_document('doc.pdf', None)
+    # 分成两个分段，阈值和 topk 在分段之间也要正确合并；未归一化的向量写入时会被归一化
+    for part in (SIMILARITIES[:4], SIMILARITIES[4:]):
+        rag._append_chunks(doc_id, [{'text': f"chunk {s}", 'page': 1} for s in part],
+                           np.stack([3 * unit(s) for s in part]))
+    return rag
+
+
+def test_only_chunks_above_the_threshold_are_returned(rag):
+    results = rag.search_vectors(unit(1.0)[None], threshold=0.8, topk=10)[0]
+    assert [r['chunk_id'] for r in results] == [1, 5, 3, 6]
+    np.testing.assert_allclose([r['score'] for r in results], [0.95, 0.9, 0.85, 0.81], atol=1e-5)
+    assert 'distance' not in results[0]
+
+
+def test_topk_is_applied_across_segments(rag):
+    results = rag.search_vectors(unit(1.0)[None], threshold=0.0, topk=3)[0]
+    assert [r['chunk_id'] for r in results] == [1, 5, 3]
+
+
+def test_tombstoned_chunks_are_skipped(rag):
+    rag.tombstones.update({1, 5})
+    rag._publish_view()
+    results = rag.search_vectors(unit(1.0)[None], threshold=0.8, topk=10)[0]
+    assert [r['chunk_id'] for r in results] == [3, 6]
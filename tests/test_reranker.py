@@ -0,0 +1,56 @@
+import time
+import numpy as np
+from reranker import Reranker
+
+
+class SleepingScorer:
+    """第一批耗时 first_batch 秒，之后每对耗时 pair_latency 秒；得分为文本长度，结果顺序与第一阶段相反"""
+    model = 'sleeping'
+
+    def __init__(self, first_batch: float, pair_latency: float):
+        self.first_batch = first_batch
+        self.pair_latency = pair_latency
+        self.calls = 0
+
+    def score(self, query, texts):
+        self.calls += 1
+        time.sleep(self.first_batch if self.calls == 1 else self.pair_latency * len(texts))
+        return np.array([len(text) for text in texts], dtype=np.float32)
+
+
+def candidates(query_id: int, n: int = 50) -> list:
+    return [{'chunk_id': query_id * n + i, 'text': 'x' * (i + 1), 'score': 1.0 - i / n} for i in range(n)]
+
+
+def test_slow_first_batch_does_not_disable_reranking():
+    scorer = SleepingScorer(first_batch=0.15, pair_latency=0.0005)
+    reranker = Reranker(scorer, batch_size=16, budget=0.2)
+    first = reranker.rerank("query 0", candidates(0), topk=8)
+    assert [r['chunk_id'] for r in first] == list(range(8))
+    assert reranker.stats['fallbacks'] == 1
+
+    for q in range(1, 5):
+        results = reranker.rerank(f"query {q}", candidates(q), topk=8)
+        assert [r['chunk_id'] for r in results] == [q * 50 + i for i in range(49, 41, -1)]
+    assert reranker.stats['reranked'] == 4
+    assert reranker.stats['fallbacks'] == 1
+
+
+def test_stops_once_budget_is_crossed():
+    scorer = SleepingScorer(first_batch=0.08, pair_latency=0.01)
+    reranker = Reranker(scorer, batch_size=8, budget=0.05)
+    start = time.perf_counter()
+    results = reranker.rerank("query", candidates(0), topk=5)
+    assert time.perf_counter() - start < 0.15
+    assert [r['chunk_id'] for r in results] == list(range(5))
+    assert reranker.stats['batches'] == 1
+    assert reranker.stats['fallbacks'] == 1
+
+
+def test_cached_scores_are_reused():
+    scorer = SleepingScorer(first_batch=0.0, pair_latency=0.0)
+    reranker = Reranker(scorer, batch_size=16, budget=None)
+    reranker.rerank("query", candidates(0), topk=8)
+    reranker.rerank("Query ", candidates(0), topk=8)
+    assert reranker.stats['pairs_scored'] == 50
+    assert reranker.stats['cache_hits'] == 50
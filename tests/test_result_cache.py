@@ -0,0 +1,72 @@
+import numpy as np
+from rag import SecurityRAGSystem
+from result_cache import ResultCache
+
+PARAMS = ('dense', 0.8, 5)
+
+
+def results(name):
+    return [{'chunk_id': 0, 'text': name, 'score': 1.0}]
+
+
+def test_older_version_does_not_clear_newer_entries():
+    cache = ResultCache()
+    cache.put("query", PARAMS, 2, results("new"))
+    # 仍在使用旧快照的检索既不命中也不写入
+    assert cache.get("query", PARAMS, 1) is None
+    cache.put("query", PARAMS, 1, results("old"))
+    assert cache.get("query", PARAMS, 2) == results("new")
+    assert cache.stats['invalidations'] == 0
+    assert cache.stats['stale'] == 2
+
+
+def test_newer_version_invalidates():
+    cache = ResultCache()
+    cache.put("query", PARAMS, 1, results("old"))
+    assert cache.get("query", PARAMS, 2) is None
+    assert cache.stats['invalidations'] == 1
+    cache.put("query", PARAMS, 1, results("old"))
+    assert cache.get("query", PARAMS, 2) is None
+
+
+def test_semantic_tier_requires_the_same_keywords():
+    cache = ResultCache(similarity=0.97)
+    vector = np.array([1.0, 0.0, 0.0], dtype=np.float32)
+    close = np.array([1.0, 0.05, 0.0], dtype=np.float32)
+    cache.put("exploit for CVE-2021-44228", PARAMS, 1, results("44228"), vector=vector,
+              guard=frozenset({'exploit', 'cve-2021-44228'}))
+    # 向量几乎相同，但关键词不同（只差一个 CVE 编号）
+    assert cache.get_similar(close, PARAMS, 1, guard=frozenset({'exploit', 'cve-2021-45046'})) is None
+    assert cache.get_similar(close, PARAMS, 1, guard=frozenset({'exploit', 'cve-2021-44228'})) == results("44228")
+    assert cache.get_similar(np.array([0.0, 1.0, 0.0]), PARAMS, 1,
+                             guard=frozenset({'exploit', 'cve-2021-44228'})) is None
+    assert cache.stats['semantic_hits'] == 1
+
+
+def test_hybrid_queries_differing_by_identifier_are_not_shared():
+    class ConstantEmbedder:
+        """所有文本的向量都相同，语义层只能靠关键词区分查询"""
+        model = 'constant'
+        dimension = 4
+
+        def embed(self, texts):
+            return np.ones((len(texts), 4), dtype=np.float32)
+
+    rag = SecurityRAGSystem(embedder=ConstantEmbedder(), embed_cache_bytes=0, dedup_threshold=None,
+                            metric='cosine')
+    rag.result_cache = ResultCache(similarity=0.97)
+    doc_id = rag.chunks.add_document('doc.pdf', None)
+    rag._append_chunks(doc_id, [{'text': "log4shell 44228 jndi lookup", 'page': 1},
+                                {'text': "follow-up 45046 context lookup", 'page': 2}],
+                       np.ones((2, 4), dtype=np.float32))
+
+    first = rag.retrieval("CVE-2021-44228", threshold=0.5, topk=1, mode='hybrid')
+    second = rag.retrieval("CVE-2021-45046", threshold=0.5, topk=1, mode='hybrid')
+    assert first[0]['chunk_id'] == 0
+    assert second[0]['chunk_id'] == 1
+    assert rag.result_cache.stats['semantic_hits'] == 0
+
+    # dense 模式没有关键词条件，向量相同的查询直接复用
+    rag.retrieval("CVE-2021-44228", threshold=0.5, topk=1, mode='dense')
+    rag.retrieval("CVE-2021-45046", threshold=0.5, topk=1, mode='dense')
+    assert rag.result_cache.stats['semantic_hits'] == 1
@@ -0,0 +1,43 @@
+import pickle
+import socket
+import threading
+import pytest
+import sharding
+from sharding import ShardClient, ShardError, recv_message, send_message
+
+
+def pooled_client():
+    client_end, server_end = socket.socketpair()
+    client = ShardClient("unused.sock", timeout=5.0)
+    client._idle.append(client_end)
+    return client, client_end, server_end
+
+
+def test_clean_round_trip_returns_the_connection():
+    client, client_end, server_end = pooled_client()
+
+    def serve():
+        method, args = recv_message(server_end)
+        send_message(server_end, ('ok', (method, args)))
+
+    thread = threading.Thread(target=serve)
+    thread.start()
+    assert client.call('stats', 1) == ('stats', (1,))
+    thread.join()
+    assert client._idle == [client_end]
+
+
+@pytest.mark.parametrize('error, expected', [(pickle.PicklingError("cannot pickle"), ShardError),
+                                             (KeyboardInterrupt(), KeyboardInterrupt)])
+def test_failed_round_trip_closes_the_connection(monkeypatch, error, expected):
+    client, client_end, server_end = pooled_client()
+
+    def failing_send(sock, obj):
+        raise error
+
+    monkeypatch.setattr(sharding, 'send_message', failing_send)
+    with pytest.raises(expected):
+        client.call('stats')
+    assert client_end.fileno() == -1
+    assert client._idle == []
+    server_end.close()